@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Admission control for the data endpoints.
+
+RateLimiter gives every client a token bucket: tokens refill at rate per
+second up to burst, and a request that finds the bucket empty is turned
+away with the time until the next token. InFlightLimiter caps how many
+requests are served at once, so a burst sheds the excess immediately
+instead of queueing it behind a saturated connection pool.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Clients whose buckets are remembered; the least recently seen are forgotten first
+MAX_CLIENTS = 65536
+
+
+class RateLimiter:
+    def __init__(self, rate, burst=None, max_clients=MAX_CLIENTS, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate)
+        self.max_clients = max_clients
+        self.clock = clock
+        # client -> (tokens, monotonic time they were counted at)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, client):
+        """Take a token for client; return 0 if the request is admitted, else seconds until it would be"""
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                # A forgotten client starts again with a full bucket
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        with self._lock:
+            clients = len(self._buckets)
+        return {"rate": self.rate, "burst": self.burst, "clients": clients}
+
+
+class InFlightLimiter:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a slot if one is free; every True must be paired with release()"""
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.limit, "in_flight": self.in_flight}
@@ -1,6 +1,25 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, has_app_context, request, jsonify
+from werkzeug.http import generate_etag
+import base64
+import gzip
+import itertools
+import json
+import logging
+import math
+import os
+import re
 import sqlite3
+import time
+import zlib
+
+import admission
+import cache
+import db_pool
+import lookup
+import metrics
+import msgpack_lite
+import snapshot
 
 app = Flask(__name__)
 
@@ -21,94 +40,1262 @@ VALID_MEASURES = {
     'Daily fine particulate matter'
 }
 
+def year_filter(alias, table='health_rankings'):
+    """SQL restricting alias to release years between two parameters, or to the latest
+    year each county has for the measure when a third parameter is set (see year_params)"""
+    return f"""
+  AND {alias}.release_year BETWEEN ? AND ?
+  AND (? = 0 OR {alias}.release_year = (
+      SELECT MAX(l.release_year) FROM {table} l
+      WHERE l.fips = {alias}.fips AND l.Measure_name = {alias}.Measure_name))"""
+
+# Query to get all health data for counties in the given ZIP code
+# JOINs on the precomputed integer fips column prepare_db.py adds to both tables
+COUNTY_DATA_QUERY = f"""
+SELECT h.*
+FROM zip_county z
+JOIN health_rankings h ON h.fips = z.fips
+WHERE z.zip = ? AND h.Measure_name = ?{year_filter('h')}
+ORDER BY z.fips, h.release_year, h.rowid
+"""
+
+# Same rows as COUNTY_DATA_QUERY, pre-serialized at build time
+COUNTY_JSON_QUERY = f"""
+SELECT r.json
+FROM zip_county z
+JOIN record_json r ON r.fips = z.fips
+WHERE z.zip = ? AND r.Measure_name = ?{year_filter('r', 'record_json')}
+ORDER BY z.fips, r.release_year, r.rowid
+"""
+
+# Same join for every (zip, measure_name) pair in a batch; both lists are passed as JSON arrays
+BATCH_QUERY = f"""
+SELECT z.zip AS batch_zip, h.*
+FROM zip_county z
+JOIN health_rankings h ON h.fips = z.fips
+WHERE z.zip IN (SELECT value FROM json_each(?))
+  AND h.Measure_name IN (SELECT value FROM json_each(?)){year_filter('h')}
+ORDER BY z.zip, z.fips, h.release_year, h.rowid
+"""
+
+# Every valid measure for one ZIP, grouped by measure
+ZIP_DATA_QUERY = f"""
+SELECT h.*
+FROM zip_county z
+JOIN health_rankings h ON h.fips = z.fips
+WHERE z.zip = ? AND h.Measure_name IN (SELECT value FROM json_each(?)){year_filter('h')}
+ORDER BY h.Measure_name, z.fips, h.release_year, h.rowid
+"""
+
+# One page of the ZIPs in a county, keyed on zip
+COUNTY_ZIPS_QUERY = """
+SELECT zip, default_city, state_abbreviation, zip_pop, zip_pop_in_county, n_counties
+FROM zip_county
+WHERE fips = ? AND zip > ?
+ORDER BY zip
+LIMIT ?
+"""
+
+# One page of a measure across a state's counties, keyed on (fips, release_year, rowid);
+# state-level rows (county code 0) are left out
+STATE_DATA_QUERY = f"""
+SELECT h.fips, h.release_year, h.rowid AS row_id, h.*
+FROM health_rankings h
+WHERE h.State = ? AND h.Measure_name = ? AND h.fips % 1000 != 0
+  AND (h.fips, h.release_year, h.rowid) > (?, ?, ?){year_filter('h')}
+ORDER BY h.fips, h.release_year, h.rowid
+LIMIT ?
+"""
+
+# Population-weighted estimate for a ZIP, from the latest release year
+WEIGHTED_QUERY = """
+SELECT *
+FROM zip_measure_weighted
+WHERE zip = ? AND Measure_name = ?
+ORDER BY CAST(Data_Release_Year AS INTEGER) DESC
+LIMIT 1
+"""
+
+# Closest known ZIP with the same 3-digit prefix: the nearest one at or below the
+# requested number and the nearest one above it, two zip_locator primary key probes
+NEAREST_ZIP_QUERY = """
+SELECT zip, default_state, default_city, abs(zip_number - ?) AS distance
+FROM (
+    SELECT * FROM (SELECT zip_number, zip, default_state, default_city FROM zip_locator
+                   WHERE prefix = ? AND zip_number <= ? ORDER BY zip_number DESC LIMIT 1)
+    UNION ALL
+    SELECT * FROM (SELECT zip_number, zip, default_state, default_city FROM zip_locator
+                   WHERE prefix = ? AND zip_number > ? ORDER BY zip_number LIMIT 1)
+)
+ORDER BY distance, zip_number
+LIMIT 1
+"""
+
+# Closest known ZIP under any prefix, for a prefix with no known ZIPs at all; zip_locator's
+# (prefix, zip_number) key is in ZIP order, so this is the same two probes without the prefix bound
+NEAREST_ANY_ZIP_QUERY = """
+SELECT zip, default_state, default_city, abs(zip_number - ?) AS distance
+FROM (
+    SELECT * FROM (SELECT zip_number, zip, default_state, default_city FROM zip_locator
+                   WHERE (prefix, zip_number) <= (?, ?) ORDER BY prefix DESC, zip_number DESC LIMIT 1)
+    UNION ALL
+    SELECT * FROM (SELECT zip_number, zip, default_state, default_city FROM zip_locator
+                   WHERE (prefix, zip_number) > (?, ?) ORDER BY prefix, zip_number LIMIT 1)
+)
+ORDER BY distance, zip_number
+LIMIT 1
+"""
+
+# Values accepted by /county_data?aggregate=
+AGGREGATE_MODES = {'weighted'}
+
+# Values accepted by /county_data?fallback=; nearest answers an unknown ZIP from its closest known neighbor
+FALLBACK_MODES = {'nearest'}
+
+# Values accepted by /county_data?format=; series returns one array per field per county,
+# columns one list of field names and one array of values per record
+FORMATS = {'records', 'series', 'columns'}
+
+# Values accepted by /county_data/batch?format=
+BATCH_FORMATS = {'records', 'columns'}
+
+YEARS_ERROR = "Invalid years; use 'latest', 'all', a year or a range such as '2021-2023'"
+
+# Record fields that vary by release year, which the series format collects into arrays
+SERIES_FIELDS = (
+    'confidence_interval_lower_bound',
+    'confidence_interval_upper_bound',
+    'data_release_year',
+    'denominator',
+    'numerator',
+    'raw_value',
+    'year_span'
+)
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# Endpoints whose response format is negotiated from the Accept header
+NEGOTIATED_ENDPOINTS = ('county_data', 'county_data_batch')
+
+# Response body encodings, chosen by the Accept header
+ENCODING_MIMETYPES = {'json': 'application/json', 'msgpack': MSGPACK_MIMETYPE}
+
+# Content codings, in order of preference when the client accepts several
+CONTENT_CODINGS = ('gzip', 'deflate')
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+# Default number of cached /county_data responses
+RESPONSE_CACHE_SIZE = 4096
+
+# Upper bound on zips x measure_names in one batch request
+MAX_BATCH_ITEMS = 50000
+
+# Page sizes for the cursor-paginated endpoints
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+# Endpoints that read health data, which are timed, counted and subject to admission control
+DATA_ENDPOINTS = ('county_data', 'county_data_batch', 'zip_data', 'county_zips', 'state_data')
+
+# Retry-After seconds for a request shed over the in-flight cap or aborted at its deadline
+BUSY_RETRY_AFTER = 1
+
+# SQLite virtual machine instructions between deadline checks
+DEADLINE_CHECK_STEPS = 1000
+
+app.config['DATABASE_PATH'] = DATABASE_PATH
+# Answer from the in-memory lookup engine; set to False to query SQLite per request
+app.config['USE_LOOKUP_ENGINE'] = True
+# Serve lookups from a memory-mapped snapshot written by prepare_db.py --snapshot
+app.config['SNAPSHOT_PATH'] = os.environ.get('HEALTH_SNAPSHOT_PATH')
+# Cached /county_data responses (0 disables the cache) and optional expiry in seconds
+app.config['RESPONSE_CACHE_SIZE'] = RESPONSE_CACHE_SIZE
+app.config['RESPONSE_CACHE_TTL'] = None
+# Compress responses of at least this many bytes when the client accepts it (None disables)
+app.config['COMPRESS_MIN_SIZE'] = COMPRESS_MIN_SIZE
+# Log requests slower than this many milliseconds, with their query plans (None disables)
+app.config['SLOW_QUERY_MS'] = float(os.environ['HEALTH_SLOW_QUERY_MS']) if os.environ.get('HEALTH_SLOW_QUERY_MS') else None
+# Per-client token bucket for the data endpoints: requests per second and burst size (None disables);
+# the burst defaults to one second's worth
+app.config['RATE_LIMIT'] = float(os.environ['HEALTH_RATE_LIMIT']) if os.environ.get('HEALTH_RATE_LIMIT') else None
+app.config['RATE_LIMIT_BURST'] = None
+# Header identifying the client behind a trusted proxy, e.g. X-Forwarded-For; the peer address otherwise
+app.config['CLIENT_ID_HEADER'] = None
+# Trusted proxies in front of the app, each appending one address to CLIENT_ID_HEADER
+app.config['TRUSTED_PROXY_HOPS'] = 1
+# Data requests served at once; more are shed with a 503 (None disables)
+app.config['MAX_IN_FLIGHT'] = int(os.environ['HEALTH_MAX_IN_FLIGHT']) if os.environ.get('HEALTH_MAX_IN_FLIGHT') else None
+# Abort SQLite queries still running this many milliseconds after the request started (None disables)
+app.config['QUERY_TIMEOUT_MS'] = float(os.environ['HEALTH_QUERY_TIMEOUT_MS']) if os.environ.get('HEALTH_QUERY_TIMEOUT_MS') else None
+
+app.extensions['metrics'] = metrics.Metrics()
+slow_query_log = logging.getLogger('health_api.slow_queries')
+
 def get_db_connection():
-    """Create a database connection"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row  # This enables column access by name
+    """Check out a pooled, read-only database connection, bound by this request's deadline"""
+    # Pooled connections use sqlite3.Row, which enables column access by name
+    return watch_deadline(db_pool.get_pool(app.config['DATABASE_PATH']).acquire())
+
+def release_db_connection(conn):
+    """Return a connection from get_db_connection() to its pool"""
+    conn.set_progress_handler(None, 0)
+    db_pool.get_pool(app.config['DATABASE_PATH']).release(conn)
+
+class QueryDeadlineExceeded(sqlite3.OperationalError):
+    """A query was interrupted because its request ran past QUERY_TIMEOUT_MS"""
+
+def request_deadline():
+    """perf_counter() time this request's queries must finish by, or None without a timeout.
+
+    Measured from the start of the request, or from its first query outside one.
+    """
+    timeout_ms = app.config['QUERY_TIMEOUT_MS']
+    if timeout_ms is None or not has_app_context():
+        return None
+    if 'deadline' not in g:
+        g.deadline = g.get('request_start', time.perf_counter()) + timeout_ms / 1000
+    return g.deadline
+
+def watch_deadline(conn):
+    """Make conn interrupt any query still running past the request's deadline"""
+    deadline = request_deadline()
+    if deadline is None:
+        return conn
+
+    # Bound now: a streamed response keeps reading after the request context is gone
+    request_globals = g._get_current_object()
+    request_metrics = get_metrics()
+
+    def check():
+        if time.perf_counter() < deadline:
+            return 0
+        if not request_globals.get('deadline_exceeded'):
+            request_globals.deadline_exceeded = True
+            request_metrics.count_admission('deadline_exceeded')
+        # Non-zero interrupts the statement with sqlite3.OperationalError
+        return 1
+    conn.set_progress_handler(check, DEADLINE_CHECK_STEPS)
     return conn
 
-@app.route('/county_data', methods=['POST'])
-def county_data():
-    # Check content type
-    if not request.is_json:
-        return jsonify({"error": "Content-Type must be application/json"}), 400
+def normalize_row(row):
+    """Map a health_rankings row to the API's output field names"""
+    return {
+        'confidence_interval_lower_bound': row['Confidence_Interval_Lower_Bound'],
+        'confidence_interval_upper_bound': row['Confidence_Interval_Upper_Bound'],
+        'county': row['County'],
+        'county_code': row['County_code'],
+        'data_release_year': row['Data_Release_Year'],
+        'denominator': row['Denominator'],
+        'fipscode': row['State_code'] + row['County_code'],
+        'measure_id': row['Measure_id'],
+        'measure_name': row['Measure_name'],
+        'numerator': row['Numerator'],
+        'raw_value': row['Raw_value'],
+        'state': row['State'],
+        'state_code': row['State_code'],
+        'year_span': row['Year_span']
+    }
+
+def normalize_weighted_row(row):
+    """Map a zip_measure_weighted row to the API's output field names"""
+    return {
+        'confidence_interval_lower_bound': row['Confidence_Interval_Lower_Bound'],
+        'confidence_interval_upper_bound': row['Confidence_Interval_Upper_Bound'],
+        'counties': row['counties'],
+        'data_release_year': row['Data_Release_Year'],
+        'measure_id': row['Measure_id'],
+        'measure_name': row['Measure_name'],
+        'population_coverage': row['population_coverage'],
+        'raw_value': row['Raw_value'],
+        'year_span': row['Year_span'],
+        'zip': row['zip']
+    }
+
+def is_valid_zip(zip_code):
+    """ZIP codes must be 5-digit strings"""
+    return isinstance(zip_code, str) and zip_code.isdigit() and len(zip_code) == 5
+
+def parse_years(value, default='latest'):
+    """Return the release years a request's "years" field selects, or None if it is invalid.
+
+    Accepts "latest" (the most recent year each county has), "all", a year
+    such as 2023 or "2023", and an inclusive range of four-digit years such
+    as "2021-2023" or [2021, 2023]. Returns 'latest' or a (first, last) tuple.
+    """
+    if value is None:
+        value = default
+    if value == 'latest':
+        return 'latest'
+    if value == 'all':
+        return lookup.ALL_YEARS
+    if isinstance(value, str):
+        match = re.fullmatch(r'(\d{4})(?:-(\d{4}))?', value)
+        if not match:
+            return None
+        value = [int(match.group(1)), int(match.group(2) or match.group(1))]
+    elif isinstance(value, int) and not isinstance(value, bool):
+        value = [value, value]
+    if not (isinstance(value, list) and len(value) == 2 and
+            all(isinstance(year, int) and not isinstance(year, bool) for year in value)):
+        return None
+    first, last = value
+    if not 1000 <= first <= last <= 9999:
+        return None
+    return first, last
+
+def year_params(years):
+    """Bind parameters for a year_filter() clause"""
+    if years == 'latest':
+        return lookup.ALL_YEARS + (1,)
+    return tuple(years) + (0,)
+
+def to_series(zip_code, measure_name, records):
+    """Pivot records into one entry per county with an array, oldest release first, per SERIES_FIELDS"""
+    counties = {}
+    for record in records:
+        entry = counties.get(record['fipscode'])
+        if entry is None:
+            entry = counties[record['fipscode']] = {field: [] for field in SERIES_FIELDS}
+        for field, value in record.items():
+            if field in SERIES_FIELDS:
+                entry[field].append(value)
+            elif field != 'measure_name':
+                # Descriptive fields come from the latest release
+                entry[field] = value
+    return {"zip": zip_code, "measure_name": measure_name, "counties": list(counties.values())}
+
+def column_rows(records, fields):
+    """One array of values per record, in the order of fields"""
+    return [[record[field] for field in fields] for record in records]
+
+def to_columns(records):
+    """Pivot records into one list of field names and one array of values per record"""
+    fields = sorted(records[0]) if records else []
+    return {"fields": fields, "rows": column_rows(records, fields)}
+
+def response_encoding(accept_mimetypes):
+    """'msgpack' when the client prefers MessagePack to JSON, otherwise 'json'"""
+    best = accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE])
+    return 'msgpack' if best == MSGPACK_MIMETYPE else 'json'
 
-    data = request.get_json()
+def encode_body(result, encoding='json'):
+    """Serialize a response body; JSON bytes are exactly what jsonify produces"""
+    if encoding == 'msgpack':
+        return msgpack_lite.packb(result)
+    return jsonify(result).get_data()
 
+def content_coding(accept_encodings, size):
+    """Return the coding to compress a body of size bytes with, or None to send it as is"""
+    threshold = app.config['COMPRESS_MIN_SIZE']
+    if threshold is None or size < threshold:
+        return None
+    return accept_encodings.best_match(CONTENT_CODINGS)
+
+def compress(body, coding):
+    if coding == 'gzip':
+        return gzip.compress(body, COMPRESS_LEVEL, mtime=0)
+    return zlib.compress(body, COMPRESS_LEVEL)
+
+def get_snapshot():
+    """Return the mapped snapshot the engine path serves from, or None without one"""
+    snapshot_path = app.config['SNAPSHOT_PATH']
+    if not snapshot_path or not app.config['USE_LOOKUP_ENGINE']:
+        return None
+    try:
+        return snapshot.get_snapshot(snapshot_path)
+    except (OSError, ValueError) as e:
+        raise sqlite3.OperationalError(f"unable to open snapshot: {snapshot_path}") from e
+
+def data_version():
+    """Version stamp of the data being served, used to invalidate caches"""
+    mapped = get_snapshot()
+    if mapped is not None:
+        return mapped.version
+    return db_pool.get_pool(app.config['DATABASE_PATH']).data_version()
+
+def get_engine():
+    """Return the snapshot or lookup engine, reloading it when the data is rebuilt"""
+    mapped = get_snapshot()
+    if mapped is not None:
+        return mapped
+    db_path = app.config['DATABASE_PATH']
+    return lookup.get_engine(db_path, db_pool.get_pool(db_path).data_version())
+
+def preload_engine():
+    """Load the snapshot or lookup engine at server startup, so the first request does not pay for it.
+
+    Reads the version over a short-lived connection, so it is safe to call
+    before forking workers. Does nothing when the engine is off; if the data
+    cannot be opened yet, the first request loads it instead.
+    """
+    if not app.config['USE_LOOKUP_ENGINE']:
+        return None
+    try:
+        mapped = get_snapshot()
+        if mapped is not None:
+            return mapped
+        db_path = app.config['DATABASE_PATH']
+        return lookup.get_engine(db_path, snapshot.database_version(db_path))
+    except sqlite3.Error as e:
+        logging.getLogger('health_api').warning("Lookup engine not preloaded: %s", e)
+        return None
+
+def get_metrics():
+    return app.extensions['metrics']
+
+def span(stage):
+    """Time a block into the stage histograms, and into this request's spans for the slow query log"""
+    return get_metrics().span(stage, g.setdefault('spans', []) if has_app_context() else None)
+
+def record_query(query, params):
+    """Remember a query this request ran, so a slow request can log its plan"""
+    if app.config['SLOW_QUERY_MS'] is not None and has_app_context():
+        g.setdefault('queries', []).append((query, params))
+
+def explain(query, params):
+    """Return the EXPLAIN QUERY PLAN details for a query"""
+    conn = get_db_connection()
+    # Plans are logged after the request, so they may need to run past its deadline
+    conn.set_progress_handler(None, 0)
+    try:
+        return [row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params)]
+    finally:
+        release_db_connection(conn)
+
+def log_slow_request(elapsed):
+    """Log a slow request's stage timings and the plan of every query it ran"""
+    get_metrics().count_slow_request()
+    stages = ', '.join(f"{stage} {seconds * 1000:.2f} ms" for stage, seconds in g.get('spans', []))
+    lines = [f"slow {request.method} {request.full_path.rstrip('?')}: {elapsed * 1000:.2f} ms ({stages})"]
+    for query, params in g.get('queries', []):
+        lines.append(f"  query: {' '.join(query.split())}")
+        lines.append(f"  params: {params!r}")
+        try:
+            lines.extend(f"  plan: {detail}" for detail in explain(query, params))
+        except sqlite3.Error as e:
+            lines.append(f"  plan unavailable: {e}")
+    slow_query_log.warning('\n'.join(lines))
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+def get_rate_limiter():
+    """Return the shared per-client rate limiter, or None when rate limiting is off"""
+    if not app.config['RATE_LIMIT']:
+        return None
+    limiter = app.extensions.get('rate_limiter')
+    if (limiter is None
+            or limiter.rate != app.config['RATE_LIMIT']
+            or limiter.burst != (app.config['RATE_LIMIT_BURST'] or max(1, app.config['RATE_LIMIT']))):
+        limiter = admission.RateLimiter(app.config['RATE_LIMIT'], app.config['RATE_LIMIT_BURST'])
+        app.extensions['rate_limiter'] = limiter
+    return limiter
+
+def get_in_flight_limiter():
+    """Return the shared in-flight cap, or None when it is off"""
+    if not app.config['MAX_IN_FLIGHT']:
+        return None
+    limiter = app.extensions.get('in_flight_limiter')
+    if limiter is None or limiter.limit != app.config['MAX_IN_FLIGHT']:
+        limiter = admission.InFlightLimiter(app.config['MAX_IN_FLIGHT'])
+        app.extensions['in_flight_limiter'] = limiter
+    return limiter
+
+def client_id():
+    header = app.config['CLIENT_ID_HEADER']
+    if header and request.headers.get(header):
+        # Earlier addresses are whatever the client sent; only those our proxies appended can be trusted
+        addresses = request.headers[header].split(',')
+        hops = max(1, app.config['TRUSTED_PROXY_HOPS'])
+        return addresses[max(0, len(addresses) - hops)].strip()
+    return request.remote_addr
+
+def overloaded(status, message, retry_after):
+    response = jsonify({"error": message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def database_error():
+    """Response for a failed query: a 503 if it was aborted at the request's deadline, else a 404"""
+    if g.get('deadline_exceeded'):
+        return overloaded(503, "Query deadline exceeded", BUSY_RETRY_AFTER)
+    return jsonify({"error": "Database error"}), 404
+
+@app.before_request
+def admit_request():
+    """Turn away data requests over the client's rate limit (429) or the in-flight cap (503)"""
+    if request.endpoint not in DATA_ENDPOINTS:
+        return None
+    rate_limiter = get_rate_limiter()
+    if rate_limiter is not None:
+        wait = rate_limiter.acquire(client_id())
+        if wait:
+            get_metrics().count_admission('rate_limited')
+            return overloaded(429, "Too many requests", wait)
+    in_flight = get_in_flight_limiter()
+    if in_flight is not None:
+        if not in_flight.try_acquire():
+            get_metrics().count_admission('shed')
+            return overloaded(503, "Server busy", BUSY_RETRY_AFTER)
+        g.in_flight = in_flight
+    return None
+
+@app.teardown_request
+def release_in_flight(exc):
+    in_flight = g.pop('in_flight', None)
+    if in_flight is not None:
+        in_flight.release()
+
+def measure_label(measure_name):
+    """measure_name label for the request counters; anything but a known measure counts under ''"""
+    return measure_name if isinstance(measure_name, str) and measure_name in VALID_MEASURES else ''
+
+@app.after_request
+def record_request(response):
+    """Count data requests and time them end to end"""
+    if request.endpoint in DATA_ENDPOINTS:
+        elapsed = time.perf_counter() - g.request_start
+        get_metrics().observe('total', elapsed)
+        get_metrics().count_request(request.endpoint, response.status_code, measure_label(g.get('measure_name')))
+        threshold = app.config['SLOW_QUERY_MS']
+        if threshold is not None and elapsed * 1000 >= threshold:
+            log_slow_request(elapsed)
+    return response
+
+@app.after_request
+def vary_on_accept(response):
+    """Mark responses whose format Accept picks (NDJSON, MessagePack or JSON), so shared caches key on it"""
+    if request.endpoint in NEGOTIATED_ENDPOINTS:
+        response.vary.add('Accept')
+    return response
+
+@app.after_request
+def compress_response(response):
+    """gzip or deflate JSON and MessagePack bodies above COMPRESS_MIN_SIZE, as Accept-Encoding allows"""
+    if (response.mimetype not in ENCODING_MIMETYPES.values() or response.is_streamed
+            or response.direct_passthrough or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200:
+        return response
+    body = response.get_data()
+    coding = content_coding(request.accept_encodings, len(body))
+    if coding is None:
+        return response
+    with span('compress'):
+        response.set_data(compress(body, coding))
+    response.headers['Content-Encoding'] = coding
+    # The compressed bytes differ, but they are semantically the same representation
+    etag, _ = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+def get_response_cache():
+    """Return the shared response cache, or None when it is disabled"""
+    if not app.config['RESPONSE_CACHE_SIZE']:
+        return None
+    response_cache = app.extensions.get('response_cache')
+    if (response_cache is None
+            or response_cache.max_entries != app.config['RESPONSE_CACHE_SIZE']
+            or response_cache.ttl != app.config['RESPONSE_CACHE_TTL']):
+        response_cache = cache.ResponseCache(app.config['RESPONSE_CACHE_SIZE'],
+                                             app.config['RESPONSE_CACHE_TTL'])
+        app.extensions['response_cache'] = response_cache
+    return response_cache
+
+def admission_stats():
+    """Admission control counts and the limits currently configured"""
+    rate_limiter = get_rate_limiter()
+    in_flight = get_in_flight_limiter()
+    return dict(get_metrics().admission_counts(),
+                rate_limit=rate_limiter.stats() if rate_limiter else None,
+                in_flight=in_flight.stats() if in_flight else None,
+                query_timeout_ms=app.config['QUERY_TIMEOUT_MS'])
+
+@app.route('/health', methods=['GET'])
+def health():
+    response_cache = get_response_cache()
+    return jsonify({
+        "status": "ok",
+        "pool": db_pool.get_pool(app.config['DATABASE_PATH']).stats(),
+        "cache": response_cache.stats() if response_cache else None,
+        "admission": admission_stats()
+    })
+
+def validate_county_request(data, aggregate=None, response_format=None, fallback=None):
+    """Return an (error body, status) pair for an invalid /county_data request, or None.
+
+    Shared by the Flask app and the ASGI app so both answer identically; the
+    teapot easter egg has an empty body.
+    """
     # Check for teapot easter egg
     if data.get('coffee') == 'teapot':
-        return '', 418
+        return None, 418
 
     # Validate required fields
     zip_code = data.get('zip')
     measure_name = data.get('measure_name')
 
     if not zip_code or not measure_name:
-        return jsonify({"error": "Both 'zip' and 'measure_name' are required"}), 400
+        return {"error": "Both 'zip' and 'measure_name' are required"}, 400
 
     # Validate zip code format
-    if not (zip_code.isdigit() and len(zip_code) == 5):
-        return jsonify({"error": "Invalid ZIP code format"}), 400
+    if not is_valid_zip(zip_code):
+        return {"error": "Invalid ZIP code format"}, 400
 
     # Validate measure_name
+    if not isinstance(measure_name, str):
+        return {"error": "'measure_name' must be a string"}, 400
     if measure_name not in VALID_MEASURES:
-        return jsonify({"error": "Invalid measure_name"}), 404
+        return {"error": "Invalid measure_name"}, 404
+
+    if aggregate is not None and aggregate not in AGGREGATE_MODES:
+        return {"error": "Invalid aggregate"}, 400
+
+    if response_format is not None and response_format not in FORMATS:
+        return {"error": "Invalid format"}, 400
+
+    if fallback is not None and fallback not in FALLBACK_MODES:
+        return {"error": "Invalid fallback"}, 400
 
+    years = county_request_years(data, response_format)
+    if years is None:
+        return {"error": YEARS_ERROR}, 400
+
+    if aggregate is not None and (years != 'latest' or response_format == 'series'):
+        return {"error": "aggregate only supports the latest release year"}, 400
+    return None
+
+def county_request_years(data, response_format=None):
+    """Release years a /county_data request selects; series default to every year, records to the latest"""
+    return parse_years(data.get('years'), 'all' if response_format == 'series' else 'latest')
+
+def cached_county_data(zip_code, measure_name, aggregate=None, years='latest', response_format='records',
+                       fallback=None, encoding='json'):
+    """Return the (body, status, etag) triple for a request, from the response cache if possible"""
+    version = data_version()
+    response_cache = get_response_cache()
+    key = (zip_code, measure_name, aggregate, years, response_format, fallback, encoding)
+    with span('cache'):
+        cached = response_cache.get(key, version) if response_cache else None
+    if cached is None:
+        if fallback:
+            cached = render_nearest_county_data(zip_code, measure_name, aggregate, years, response_format, encoding)
+        else:
+            cached = render_county_data(zip_code, measure_name, aggregate, years, response_format, encoding)
+        if response_cache:
+            response_cache.put(key, version, cached)
+    return cached
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Stage histograms and request counters in the Prometheus text format"""
+    return Response(get_metrics().render(), content_type=metrics.PROMETHEUS_MIMETYPE)
+
+@app.route('/county_data', methods=['POST'])
+def county_data():
+    data, error = read_json_request()
+    if error:
+        return error
+    aggregate = request.args.get('aggregate')
+    response_format = request.args.get('format')
+    fallback = request.args.get('fallback')
+    g.measure_name = data.get('measure_name')
+
+    with span('validate'):
+        error = validate_county_request(data, aggregate, response_format, fallback)
+    if error:
+        body, status = error
+        return (jsonify(body) if body else ''), status
+
+    zip_code = data['zip']
+    measure_name = data['measure_name']
+    years = county_request_years(data, response_format)
+    response_format = response_format or 'records'
+
+    if wants_ndjson() and not aggregate and response_format == 'records' and not fallback:
+        try:
+            return stream_county_data(zip_code, measure_name, years)
+        except sqlite3.Error:
+            return database_error()
+
+    encoding = response_encoding(request.accept_mimetypes)
     try:
+        cached = cached_county_data(zip_code, measure_name, aggregate, years, response_format, fallback, encoding)
+    except sqlite3.Error:
+        return database_error()
+
+    body, status, etag = cached
+    # Compressed responses carry a weak ETag, which a conditional request may echo back
+    if etag and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        # Errors are always JSON
+        response = Response(body, status, mimetype=ENCODING_MIMETYPES[encoding if status == 200 else 'json'])
+    if etag:
+        response.set_etag(etag)
+    return response
+
+def fetch_county_data(zip_code, measure_name, years='latest'):
+    """Return the normalized records for one (zip, measure_name) pair in the selected release years"""
+    if app.config['USE_LOOKUP_ENGINE']:
+        with span('lookup'):
+            return get_engine().lookup_dicts(zip_code, measure_name, years)
+
+    params = (zip_code, measure_name) + year_params(years)
+    with span('connect'):
         conn = get_db_connection()
-        cursor = conn.cursor()
-
-
-        # Query to get all health data for counties in the given ZIP code
-        # JOINs on county_code, which is 5 digits in zip_county (2 digits for state + 3 for county)
-        query = """
-        SELECT h.*
-        FROM health_rankings h
-        JOIN zip_county z ON
-            CAST(h.State_code AS INTEGER) = CAST(substr(CAST(z.county_code AS TEXT), 1, 2) AS INTEGER)
-            AND CAST(h.County_code AS INTEGER) = CAST(substr(CAST(z.county_code AS TEXT), 3) AS INTEGER)
-        WHERE z.zip = ? AND h.Measure_name = ?
-        """
-        
-        cursor.execute(query, (zip_code, measure_name))
-        rows = cursor.fetchall()
-        
-        # Return 404 if not found in db
-        if not rows:
-            return jsonify({"error": "No data found"}), 404
-
-        # Convert rows to list of dictionaries with all columns
-        result = []
-        for row in rows:
-            row_dict = dict(row)
-            normalized_dict = {
-                'confidence_interval_lower_bound': row_dict['Confidence_Interval_Lower_Bound'],
-                'confidence_interval_upper_bound': row_dict['Confidence_Interval_Upper_Bound'],
-                'county': row_dict['County'],
-                'county_code': row_dict['County_code'],
-                'data_release_year': row_dict['Data_Release_Year'],
-                'denominator': row_dict['Denominator'],
-                'fipscode': row_dict['State_code'] + row_dict['County_code'],
-                'measure_id': row_dict['Measure_id'],
-                'measure_name': row_dict['Measure_name'],
-                'numerator': row_dict['Numerator'],
-                'raw_value': row_dict['Raw_value'],
-                'state': row_dict['State'],
-                'state_code': row_dict['State_code'],
-                'year_span': row_dict['Year_span']
-            }
-            result.append(normalized_dict)
-            
-        return jsonify(result)
+    try:
+        record_query(COUNTY_DATA_QUERY, params)
+        with span('query'):
+            cursor = conn.cursor()
+            cursor.execute(COUNTY_DATA_QUERY, params)
+            rows = cursor.fetchall()
+    finally:
+        release_db_connection(conn)
 
-    except sqlite3.Error as e:
-        return jsonify({"error": "Database error"}), 404
+    # Convert rows to list of dictionaries with all columns
+    with span('normalize'):
+        return [normalize_row(row) for row in rows]
+
+def fetch_weighted(zip_code, measure_name):
+    """Return the population-weighted estimate for one (zip, measure_name) pair, or None"""
+    with span('connect'):
+        conn = get_db_connection()
+    try:
+        record_query(WEIGHTED_QUERY, (zip_code, measure_name))
+        with span('query'):
+            row = conn.execute(WEIGHTED_QUERY, (zip_code, measure_name)).fetchone()
+    finally:
+        release_db_connection(conn)
+    return normalize_weighted_row(row) if row is not None else None
+
+def fetch_county_json(zip_code, measure_name, years='latest'):
+    """Return the pre-serialized records for one (zip, measure_name) pair in the selected release years.
+
+    Returns None when the data source has no fragments (a snapshot, or a
+    database built before record_json existed).
+    """
+    if app.config['USE_LOOKUP_ENGINE']:
+        engine = get_engine()
+        if not hasattr(engine, 'lookup_json'):
+            return None
+        with span('lookup'):
+            return engine.lookup_json(zip_code, measure_name, years)
+
+    params = (zip_code, measure_name) + year_params(years)
+    with span('connect'):
+        conn = get_db_connection()
+    try:
+        record_query(COUNTY_JSON_QUERY, params)
+        with span('query'):
+            try:
+                return [row[0] for row in conn.execute(COUNTY_JSON_QUERY, params)]
+            except sqlite3.OperationalError as e:
+                # Only a missing record_json table means no fragments; an
+                # interrupted query must fail the request, not be retried
+                if not str(e).startswith('no such '):
+                    raise
+                return None
+    finally:
+        release_db_connection(conn)
+
+def splice_json(fragments):
+    """Join pre-serialized records into the body jsonify would produce for the list"""
+    return b'[' + b','.join(fragments) + b']\n'
+
+def compact_json():
+    """Whether jsonify emits compact JSON, which the pre-serialized records match"""
+    return app.json.compact or (app.json.compact is None and not app.debug)
+
+def county_result(zip_code, measure_name, aggregate=None, years='latest', response_format='records'):
+    """Return the response body for a request as Python objects, or None when there is no data"""
+    if aggregate:
+        result = fetch_weighted(zip_code, measure_name)
+        if result is not None and response_format == 'columns':
+            result = to_columns([result])
+        return result
+    records = fetch_county_data(zip_code, measure_name, years)
+    if not records:
+        return None
+    if response_format == 'series':
+        return to_series(zip_code, measure_name, records)
+    if response_format == 'columns':
+        return to_columns(records)
+    return records
+
+def not_found():
+    response = jsonify({"error": "No data found"})
+    return response.get_data(), 404, None
+
+def render_county_data(zip_code, measure_name, aggregate=None, years='latest', response_format='records',
+                       encoding='json'):
+    """Build the (body, status, etag) triple the response cache stores"""
+    if not aggregate and response_format == 'records' and encoding == 'json' and compact_json():
+        fragments = fetch_county_json(zip_code, measure_name, years)
+        if fragments:
+            with span('serialize'):
+                body = splice_json(fragments)
+            return body, 200, generate_etag(body)
+        if fragments is not None:
+            # Return 404 if not found in db
+            return not_found()
+
+    result = county_result(zip_code, measure_name, aggregate, years, response_format)
+    if not result:
+        return not_found()
+
+    with span('serialize'):
+        body = encode_body(result, encoding)
+    return body, 200, generate_etag(body)
+
+def resolve_zip(zip_code):
+    """Return (zip, default_state, default_city, distance) for the known ZIP nearest zip_code, or None"""
+    with span('resolve'):
+        if app.config['USE_LOOKUP_ENGINE']:
+            engine = get_engine()
+            if hasattr(engine, 'nearest_zip'):
+                return engine.nearest_zip(zip_code)
+
+        zip_number = int(zip_code)
+        prefix = zip_code[:3]
+        params = (zip_number, prefix, zip_number, prefix, zip_number)
+        conn = get_db_connection()
+        try:
+            record_query(NEAREST_ZIP_QUERY, params)
+            row = conn.execute(NEAREST_ZIP_QUERY, params).fetchone()
+            if row is None:
+                record_query(NEAREST_ANY_ZIP_QUERY, params)
+                row = conn.execute(NEAREST_ANY_ZIP_QUERY, params).fetchone()
+        finally:
+            release_db_connection(conn)
+        return tuple(row) if row is not None else None
+
+def render_nearest_county_data(zip_code, measure_name, aggregate=None, years='latest', response_format='records',
+                               encoding='json'):
+    """Render a request for the ZIP nearest zip_code, wrapped in an envelope naming the ZIP used.
+
+    fallback is null when zip_code itself is known; otherwise it describes
+    the neighbor the data came from.
+    """
+    nearest = resolve_zip(zip_code)
+    if nearest is None:
+        return not_found()
+
+    resolved_zip, default_state, default_city, distance = nearest
+    result = county_result(resolved_zip, measure_name, aggregate, years, response_format)
+    if not result:
+        return not_found()
+
+    fallback = None
+    if distance:
+        fallback = {"method": "nearest", "default_state": default_state,
+                    "default_city": default_city, "distance": distance}
+    with span('serialize'):
+        body = encode_body({"zip": zip_code, "resolved_zip": resolved_zip, "fallback": fallback, "data": result},
+                           encoding)
+    return body, 200, generate_etag(body)
+
+def iter_query(query, params):
+    """Yield normalized records from a pooled connection as the cursor produces them"""
+    pool = db_pool.get_pool(app.config['DATABASE_PATH'])
+    conn = pool.acquire()
+    watch_deadline(conn)
+    record_query(query, params)
+    try:
+        for row in conn.execute(query, params):
+            yield row, normalize_row(row)
     finally:
-        if conn:
-            conn.close()
+        conn.set_progress_handler(None, 0)
+        pool.release(conn)
+
+def iter_batch(zips, measure_names, years='latest'):
+    """Yield (zip, measure_name, record) for every pair that has data, grouped by zip"""
+    if not zips or not measure_names:
+        return
+
+    if app.config['USE_LOOKUP_ENGINE']:
+        engine = get_engine()
+        for zip_code in sorted(zips):
+            for measure_name in measure_names:
+                for record in engine.lookup_dicts(zip_code, measure_name, years):
+                    yield zip_code, measure_name, record
+        return
+
+    rows = iter_query(BATCH_QUERY, (json.dumps(zips), json.dumps(measure_names)) + year_params(years))
+    try:
+        for row, record in rows:
+            yield row['batch_zip'], row['Measure_name'], record
+    finally:
+        rows.close()
+
+def fetch_batch(zips, measure_names, years='latest'):
+    """Return {(zip, measure_name): [records]} for every pair that has data"""
+    found = {}
+    for zip_code, measure_name, record in iter_batch(zips, measure_names, years):
+        found.setdefault((zip_code, measure_name), []).append(record)
+    return found
+
+def wants_ndjson():
+    """Streaming is opt-in via ?stream=1 or Accept: application/x-ndjson"""
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def ndjson_line(record):
+    return json.dumps(record, sort_keys=True, separators=(',', ':')) + '\n'
+
+def ndjson_response(lines):
+    """Stream already-serialized lines, closing the source if the client goes away.
+
+    A query that fails once the 200 is sent ends the stream with an error
+    line, so a client can tell a cut-off body from a complete one. The
+    request's in-flight slot is held until the body is closed.
+    """
+    # Bound now: the body is read after the request context is gone
+    request_globals = g._get_current_object()
+
+    def generate():
+        try:
+            yield from lines
+        except sqlite3.Error:
+            if request_globals.get('deadline_exceeded'):
+                yield ndjson_line({"error": "Query deadline exceeded", "status": 503})
+            else:
+                yield ndjson_line({"error": "Database error", "status": 404})
+        finally:
+            lines.close()
+    response = Response(generate(), mimetype=NDJSON_MIMETYPE)
+    in_flight = g.pop('in_flight', None)
+    if in_flight is not None:
+        response.call_on_close(in_flight.release)
+    return response
+
+def stream_county_data(zip_code, measure_name, years='latest'):
+    """NDJSON variant of /county_data: one record per line"""
+    if app.config['USE_LOOKUP_ENGINE']:
+        engine = get_engine()
+        records = (record for record in engine.lookup_dicts(zip_code, measure_name, years))
+    else:
+        records = (record for _, record in iter_query(COUNTY_DATA_QUERY,
+                                                      (zip_code, measure_name) + year_params(years)))
+
+    # Look at the first record so a miss can still return a plain 404
+    first = next(records, None)
+    if first is None:
+        return jsonify({"error": "No data found"}), 404
+
+    def lines():
+        try:
+            yield ndjson_line(first)
+            for record in records:
+                yield ndjson_line(record)
+        finally:
+            records.close()
+    return ndjson_response(lines())
+
+def stream_batch(zips, measure_names, years='latest'):
+    """NDJSON variant of /county_data/batch.
+
+    Every record carries its zip; errors are emitted as lines with "error"
+    and "status" keys after the records for their zip.
+    """
+    valid_zips = [z for z in zips if is_valid_zip(z)]
+    valid_measures = [m for m in measure_names if m in VALID_MEASURES]
+    items = iter_batch(valid_zips, valid_measures, years)
+    # Start the query now so database errors still get a normal error response
+    first = next(items, None)
+
+    def zip_errors(zip_code, seen):
+        for measure_name in measure_names:
+            if measure_name not in VALID_MEASURES:
+                yield ndjson_line({"zip": zip_code, "measure_name": measure_name,
+                                   "error": "Invalid measure_name", "status": 404})
+            elif measure_name not in seen:
+                yield ndjson_line({"zip": zip_code, "measure_name": measure_name,
+                                   "error": "No data found", "status": 404})
+
+    def lines():
+        try:
+            for zip_code in zips:
+                if not is_valid_zip(zip_code):
+                    yield ndjson_line({"zip": zip_code, "error": "Invalid ZIP code format", "status": 400})
+
+            # items arrive grouped by zip in sorted order, so merge them with the sorted request
+            pending = iter(sorted(valid_zips))
+            current, seen = next(pending, None), set()
+            for zip_code, measure_name, record in itertools.chain([first] if first else [], items):
+                while current != zip_code:
+                    yield from zip_errors(current, seen)
+                    current, seen = next(pending), set()
+                seen.add(measure_name)
+                record = dict(record, zip=zip_code)
+                yield ndjson_line(record)
+            while current is not None:
+                yield from zip_errors(current, seen)
+                current, seen = next(pending, None), set()
+        finally:
+            items.close()
+    return ndjson_response(lines())
+
+@app.route('/county_data/batch', methods=['POST'])
+def county_data_batch():
+    """Resolve many zips x measure_names in one request.
+
+    Errors are reported per ZIP or per (ZIP, measure_name) pair instead of
+    failing the whole batch.
+    """
+    data, error = read_json_request()
+    if error:
+        return error
+
+    zips = data.get('zips')
+    measure_names = data.get('measure_names')
+
+    if not zips or not measure_names:
+        return jsonify({"error": "Both 'zips' and 'measure_names' are required"}), 400
+
+    if not all(isinstance(items, list) and all(isinstance(item, str) for item in items)
+               for items in (zips, measure_names)):
+        return jsonify({"error": "'zips' and 'measure_names' must be lists of strings"}), 400
+
+    # Drop duplicates but keep the order the client asked for
+    zips = list(dict.fromkeys(zips))
+    measure_names = list(dict.fromkeys(measure_names))
+
+    if len(zips) * len(measure_names) > MAX_BATCH_ITEMS:
+        return jsonify({"error": f"Batch exceeds {MAX_BATCH_ITEMS} zip/measure_name pairs"}), 400
+
+    years = parse_years(data.get('years'))
+    if years is None:
+        return years_error()
+
+    response_format = request.args.get('format', 'records')
+    if response_format not in BATCH_FORMATS:
+        return jsonify({"error": "Invalid format"}), 400
+
+    if wants_ndjson() and response_format == 'records':
+        try:
+            return stream_batch(zips, measure_names, years)
+        except sqlite3.Error:
+            return database_error()
+
+    try:
+        with span('batch'):
+            found = fetch_batch([z for z in zips if is_valid_zip(z)],
+                                [m for m in measure_names if m in VALID_MEASURES], years)
+    except sqlite3.Error:
+        return database_error()
+
+    results = {}
+    for zip_code in zips:
+        if not is_valid_zip(zip_code):
+            results[zip_code] = {"error": "Invalid ZIP code format", "status": 400}
+            continue
+
+        entry = {"data": {}, "errors": {}}
+        for measure_name in measure_names:
+            if measure_name not in VALID_MEASURES:
+                entry["errors"][measure_name] = {"error": "Invalid measure_name", "status": 404}
+            elif (zip_code, measure_name) in found:
+                records = found[(zip_code, measure_name)]
+                entry["data"][measure_name] = (column_rows(records, lookup.RECORD_FIELDS)
+                                               if response_format == 'columns' else records)
+            else:
+                entry["errors"][measure_name] = {"error": "No data found", "status": 404}
+        results[zip_code] = entry
+
+    body = {"results": results}
+    if response_format == 'columns':
+        # One field list for the whole batch; each data entry is just its value arrays
+        body["fields"] = list(lookup.RECORD_FIELDS)
+    encoding = response_encoding(request.accept_mimetypes)
+    with span('serialize'):
+        return Response(encode_body(body, encoding), mimetype=ENCODING_MIMETYPES[encoding])
+
+def encode_cursor(key):
+    """Opaque pagination cursor for the last key on a page"""
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, types):
+    """Return the key a cursor encodes, or None if it is not a cursor of the given field types"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (AttributeError, ValueError, UnicodeError):
+        return None
+    if not isinstance(key, list) or len(key) != len(types):
+        return None
+    if not all(isinstance(value, t) and not isinstance(value, bool) for value, t in zip(key, types)):
+        return None
+    return key
+
+def page_params(data, types, start):
+    """Return (limit, after key, error) from a request's "limit" and "cursor" fields"""
+    limit = data.get('limit', DEFAULT_PAGE_SIZE)
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= MAX_PAGE_SIZE:
+        return None, None, ({"error": f"'limit' must be an integer from 1 to {MAX_PAGE_SIZE}"}, 400)
+    cursor = data.get('cursor')
+    if cursor is None:
+        return limit, start, None
+    key = decode_cursor(cursor, types)
+    if key is None:
+        return None, None, ({"error": "Invalid cursor"}, 400)
+    return limit, key, None
+
+def fetch_page(query, params, limit, key):
+    """Run a keyset query for limit + 1 rows; return (rows, cursor for the next page or None)"""
+    with span('connect'):
+        conn = get_db_connection()
+    try:
+        record_query(query, params + (limit + 1,))
+        with span('query'):
+            rows = conn.execute(query, params + (limit + 1,)).fetchall()
+    finally:
+        release_db_connection(conn)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
+
+def years_error():
+    return jsonify({"error": YEARS_ERROR}), 400
+
+def read_json_request():
+    """Return (data, error response) for a JSON object request body"""
+    if not request.is_json:
+        return None, (jsonify({"error": "Content-Type must be application/json"}), 400)
+    with span('parse'):
+        data = request.get_json()
+    if not isinstance(data, dict):
+        return None, (jsonify({"error": "Request body must be a JSON object"}), 400)
+    if data.get('coffee') == 'teapot':
+        return None, ('', 418)
+    return data, None
+
+@app.route('/zip_data', methods=['POST'])
+def zip_data():
+    """Every measure for one ZIP: {"zip": ..., "data": {measure_name: [records]}}"""
+    data, error = read_json_request()
+    if error:
+        return error
+
+    zip_code = data.get('zip')
+    if not zip_code:
+        return jsonify({"error": "'zip' is required"}), 400
+    if not is_valid_zip(zip_code):
+        return jsonify({"error": "Invalid ZIP code format"}), 400
+    years = parse_years(data.get('years'))
+    if years is None:
+        return years_error()
+
+    measure_names = sorted(VALID_MEASURES)
+    found = {}
+    try:
+        if app.config['USE_LOOKUP_ENGINE']:
+            engine = get_engine()
+            with span('lookup'):
+                for measure_name in measure_names:
+                    records = engine.lookup_dicts(zip_code, measure_name, years)
+                    if records:
+                        found[measure_name] = records
+        else:
+            params = (zip_code, json.dumps(measure_names)) + year_params(years)
+            for row, record in iter_query(ZIP_DATA_QUERY, params):
+                found.setdefault(row['Measure_name'], []).append(record)
+    except sqlite3.Error:
+        return database_error()
+
+    if not found:
+        return jsonify({"error": "No data found"}), 404
+    with span('serialize'):
+        return jsonify({"zip": zip_code, "data": found})
+
+@app.route('/county_zips', methods=['POST'])
+def county_zips():
+    """ZIPs in one county FIPS code, a page at a time"""
+    data, error = read_json_request()
+    if error:
+        return error
+
+    fips = data.get('fips')
+    if not fips:
+        return jsonify({"error": "'fips' is required"}), 400
+    if not (isinstance(fips, str) and fips.isdigit() and len(fips) == 5):
+        return jsonify({"error": "Invalid county FIPS code format"}), 400
+
+    limit, after, error = page_params(data, (str,), [''])
+    if error:
+        body, status = error
+        return jsonify(body), status
+
+    try:
+        rows, next_cursor = fetch_page(COUNTY_ZIPS_QUERY, (int(fips), after[0]), limit, lambda row: [row['zip']])
+    except sqlite3.Error:
+        return database_error()
+
+    if not rows and data.get('cursor') is None:
+        return jsonify({"error": "No data found"}), 404
+    with span('serialize'):
+        return jsonify({
+            "fips": fips,
+            "results": [dict(row) for row in rows],
+            "next_cursor": next_cursor
+        })
+
+@app.route('/state_data', methods=['POST'])
+def state_data():
+    """One measure across every county in a state, a page at a time"""
+    data, error = read_json_request()
+    if error:
+        return error
+
+    state = data.get('state')
+    measure_name = data.get('measure_name')
+    if not state or not measure_name:
+        return jsonify({"error": "Both 'state' and 'measure_name' are required"}), 400
+    if not (isinstance(state, str) and len(state) == 2 and state.isalpha() and state.isupper()):
+        return jsonify({"error": "Invalid state; use a two-letter abbreviation such as 'MA'"}), 400
+    if not isinstance(measure_name, str):
+        return jsonify({"error": "'measure_name' must be a string"}), 400
+    if measure_name not in VALID_MEASURES:
+        return jsonify({"error": "Invalid measure_name"}), 404
+    years = parse_years(data.get('years'))
+    if years is None:
+        return years_error()
+
+    limit, after, error = page_params(data, (int, int, int), [0, 0, 0])
+    if error:
+        body, status = error
+        return jsonify(body), status
+
+    try:
+        rows, next_cursor = fetch_page(STATE_DATA_QUERY, (state, measure_name, *after) + year_params(years), limit,
+                                       lambda row: [row['fips'], row['release_year'], row['row_id']])
+    except sqlite3.Error:
+        return database_error()
+
+    if not rows and data.get('cursor') is None:
+        return jsonify({"error": "No data found"}), 404
+    with span('normalize'):
+        results = [normalize_row(row) for row in rows]
+    with span('serialize'):
+        return jsonify({
+            "state": state,
+            "measure_name": measure_name,
+            "results": results,
+            "next_cursor": next_cursor
+        })
 
 if __name__ == '__main__':
     # Only run the development server if running locally
-    import os
     if os.environ.get('VERCEL_ENV') != 'production':
+        preload_engine()
         app.run(debug=True, port=9000, host='0.0.0.0')
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""ASGI variant of the /county_data endpoint.
+
+Serves the same JSON contract as app.py from an asyncio event loop. SQLite
+reads run on a bounded thread pool so slow lookups never block the loop,
+and identical requests that arrive while a lookup is in flight share its
+result instead of each running their own query. QUERY_TIMEOUT_MS deadlines
+apply as in app.py; per-client rate limits and the in-flight cap are
+enforced by the Flask app only, since here the executor queues excess work.
+
+Run with any ASGI server, e.g.:
+
+    uvicorn asgi_app:app --port 9000
+"""
+import asyncio
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qs
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags
+
+import app as flask_module
+
+# Threads running SQLite reads; requests beyond this wait in the executor queue
+EXECUTOR_WORKERS = int(os.environ.get('HEALTH_ASGI_WORKERS', 8))
+
+
+class CountyDataApp:
+    """ASGI application serving POST /county_data, GET /health and GET /metrics"""
+
+    def __init__(self, flask_app=flask_module.app, max_workers=EXECUTOR_WORKERS):
+        # Configuration, the connection pool and the response cache are shared with flask_app
+        self.flask_app = flask_app
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # cached_county_data arguments -> future of the lookup serving it
+        self._in_flight = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {'requests': 0, 'lookups': 0, 'coalesced': 0}
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        self.max_workers, thread_name_prefix='county-data')
+        return self._executor
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['in_flight'] = len(self._in_flight)
+        stats['max_workers'] = self.max_workers
+        return stats
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            status, headers, body = await self.handle(scope, receive)
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': body})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await asyncio.get_running_loop().run_in_executor(self.executor, flask_module.preload_engine)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, scope, receive):
+        """Return (status, headers, body) for one HTTP request"""
+        path, method = scope['path'], scope['method']
+        if path == '/county_data':
+            if method != 'POST':
+                return text_response(405, 'Method Not Allowed')
+            return await self.county_data(scope, await read_body(receive))
+        if path == '/health':
+            if method != 'GET':
+                return text_response(405, 'Method Not Allowed')
+            return await self.health()
+        if path == '/metrics':
+            if method != 'GET':
+                return text_response(405, 'Method Not Allowed')
+            body = flask_module.get_metrics().render().encode('utf-8')
+            return 200, [(b'content-type', flask_module.metrics.PROMETHEUS_MIMETYPE.encode('latin-1'))], body
+        return text_response(404, 'Not Found')
+
+    async def county_data(self, scope, body):
+        """Answer one /county_data request, counted and timed like the Flask app's"""
+        start = time.perf_counter()
+        labels = {}
+        response = await self._county_data(scope, body, labels)
+        recorder = flask_module.get_metrics()
+        recorder.observe('total', time.perf_counter() - start)
+        recorder.count_request('county_data', response[0], flask_module.measure_label(labels.get('measure_name')))
+        return response
+
+    async def _county_data(self, scope, body, labels):
+        self._count('requests')
+        headers = request_headers(scope)
+        if not is_json(headers.get('content-type', '')):
+            return json_response(400, {"error": "Content-Type must be application/json"})
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return json_response(400, {"error": "Invalid JSON body"})
+        if not isinstance(data, dict):
+            return json_response(400, {"error": "Request body must be a JSON object"})
+        labels['measure_name'] = data.get('measure_name')
+
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        aggregate = query.get('aggregate', [None])[-1]
+        response_format = query.get('format', [None])[-1]
+        fallback = query.get('fallback', [None])[-1]
+        error = flask_module.validate_county_request(data, aggregate, response_format, fallback)
+        if error:
+            payload, status = error
+            return json_response(status, payload) if payload else text_response(status, '')
+
+        years = flask_module.county_request_years(data, response_format)
+        encoding = flask_module.response_encoding(parse_accept_header(headers.get('accept'), MIMEAccept))
+        try:
+            body, status, etag = await self.lookup(data['zip'], data['measure_name'], aggregate,
+                                                   years, response_format or 'records', fallback, encoding)
+        except flask_module.QueryDeadlineExceeded:
+            status, response_headers, body = json_response(503, {"error": "Query deadline exceeded"})
+            return status, response_headers + [(b'retry-after', str(flask_module.BUSY_RETRY_AFTER).encode('latin-1'))], body
+        except sqlite3.Error:
+            return json_response(404, {"error": "Database error"})
+
+        mimetype = flask_module.ENCODING_MIMETYPES[encoding if status == 200 else 'json']
+        response_headers = [(b'content-type', mimetype.encode('latin-1')), (b'vary', b'Accept-Encoding, Accept')]
+        coding = None
+        if status == 200:
+            coding = flask_module.content_coding(parse_accept_header(headers.get('accept-encoding')), len(body))
+        if etag:
+            response_headers.append((b'etag', (f'W/"{etag}"' if coding else f'"{etag}"').encode('latin-1')))
+            if parse_etags(headers.get('if-none-match')).contains_weak(etag):
+                return 304, response_headers, b''
+        if coding:
+            body = flask_module.compress(body, coding)
+            response_headers.append((b'content-encoding', coding.encode('latin-1')))
+        return status, response_headers + [(b'content-length', str(len(body)).encode('latin-1'))], body
+
+    async def lookup(self, zip_code, measure_name, aggregate, years='latest', response_format='records',
+                     fallback=None, encoding='json'):
+        """Run the cached lookup on the executor, sharing it with identical in-flight requests"""
+        key = (zip_code, measure_name, aggregate, years, response_format, fallback, encoding)
+        future = self._in_flight.get(key)
+        if future is None:
+            self._count('lookups')
+            future = asyncio.get_running_loop().run_in_executor(self.executor, self._cached_county_data, *key)
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self._count('coalesced')
+        # A cancelled request must not cancel the lookup other requests are waiting on
+        return await asyncio.shield(future)
+
+    def _cached_county_data(self, *key):
+        # The QUERY_TIMEOUT_MS deadline runs from the lookup's first query
+        with self.flask_app.app_context():
+            try:
+                return flask_module.cached_county_data(*key)
+            except sqlite3.Error as e:
+                if flask_module.g.get('deadline_exceeded'):
+                    raise flask_module.QueryDeadlineExceeded(str(e)) from e
+                raise
+
+    def _health(self):
+        with self.flask_app.app_context():
+            response_cache = flask_module.get_response_cache()
+            return {
+                "status": "ok",
+                "pool": flask_module.db_pool.get_pool(self.flask_app.config['DATABASE_PATH']).stats(),
+                "cache": response_cache.stats() if response_cache else None,
+                "admission": flask_module.admission_stats(),
+                "asgi": self.stats()
+            }
+
+    async def health(self):
+        payload = await asyncio.get_running_loop().run_in_executor(self.executor, self._health)
+        return json_response(200, payload)
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def request_headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+
+def is_json(content_type):
+    """Same rule as Flask's request.is_json"""
+    mimetype = content_type.split(';', 1)[0].strip().lower()
+    return mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))
+
+
+def json_response(status, payload):
+    # Same separators and key order as Flask's jsonify
+    body = (json.dumps(payload, indent=None, separators=(',', ':'), sort_keys=True) + '\n').encode('utf-8')
+    return status, [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode('latin-1'))], body
+
+
+def text_response(status, text):
+    body = text.encode('utf-8')
+    return status, [(b'content-type', b'text/html; charset=utf-8'),
+                    (b'content-length', str(len(body)).encode('latin-1'))], body
+
+
+app = CountyDataApp()
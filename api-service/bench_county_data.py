@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Benchmark the /county_data join before and after the fips join key.
+
+Runs the old CAST-based join and the endpoint's current query
+(app.COUNTY_DATA_QUERY, bound for the default latest release) against the
+same health_data.db for a sample of ZIP codes and reports per-request latency.
+"""
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+from app import COUNTY_DATA_QUERY, year_params
+
+OLD_QUERY = """
+SELECT h.*
+FROM health_rankings h
+JOIN zip_county z ON
+    CAST(h.State_code AS INTEGER) = CAST(substr(CAST(z.county_code AS TEXT), 1, 2) AS INTEGER)
+    AND CAST(h.County_code AS INTEGER) = CAST(substr(CAST(z.county_code AS TEXT), 3) AS INTEGER)
+WHERE z.zip = ? AND h.Measure_name = ?
+"""
+
+
+def time_query(conn, query, params, extra_params=()):
+    """Return per-request latencies in milliseconds"""
+    latencies = []
+    for zip_code, measure_name in params:
+        start = time.perf_counter()
+        conn.execute(query, (zip_code, measure_name) + extra_params).fetchall()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:>6}: mean {statistics.mean(latencies):8.3f} ms  "
+          f"p50 {statistics.median(latencies):8.3f} ms  p99 {p99:8.3f} ms")
+
+
+def main(db_path='health_data.db', requests=200, seed=0):
+    conn = sqlite3.connect(db_path)
+    zips = [row[0] for row in conn.execute("SELECT DISTINCT zip FROM zip_county")]
+    measures = [row[0] for row in conn.execute("SELECT DISTINCT Measure_name FROM health_rankings")]
+    rng = random.Random(seed)
+    params = [(rng.choice(zips), rng.choice(measures)) for _ in range(requests)]
+
+    print(f"{requests} requests against {db_path}")
+    report('before', time_query(conn, OLD_QUERY, params))
+    report('after', time_query(conn, COUNTY_DATA_QUERY, params, year_params('latest')))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Benchmark response size and encode time for each negotiable encoding.
+
+Compares, against the current jsonify output of the records shape:
+
+    shape     records (one object per record) or columns (one field list, one value array per record)
+    encoding  JSON or MessagePack (Accept: application/msgpack)
+    coding    none, gzip or deflate (Accept-Encoding), at the app's compression level
+
+for two workloads: single /county_data responses for random (zip,
+measure_name) pairs, and /county_data/batch responses for --batch-zips
+random ZIPs times every measure. Encode time covers the shape pivot, the
+serializer and the compressor, for one response.
+
+Usage: python bench_encoding.py [health_data.db] [--requests N] [--batch-zips N]
+"""
+import argparse
+import random
+import statistics
+import time
+
+import app as app_module
+import lookup
+from app import app
+
+SHAPES = {
+    'records': lambda records: records,
+    'columns': app_module.to_columns
+}
+
+
+def time_encode(func, bodies, repeat=5):
+    """Return the best per-response time in microseconds over repeat passes"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            func(body)
+        elapsed = (time.perf_counter() - start) / len(bodies) * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def encoder(shape, encoding, coding):
+    """Return a function from a workload item to the encoded response body"""
+    def encode(item):
+        if isinstance(item, list):
+            result = SHAPES[shape](item)
+        elif shape == 'records':
+            result = item
+        else:
+            # A columns batch has one field list; each data entry is just its value arrays
+            fields = lookup.RECORD_FIELDS
+            result = {"fields": list(fields),
+                      "results": {zip_code: {"data": {measure_name: app_module.column_rows(records, fields)
+                                                      for measure_name, records in entry["data"].items()},
+                                             "errors": entry["errors"]}
+                                  for zip_code, entry in item["results"].items()}}
+        body = app_module.encode_body(result, encoding)
+        return app_module.compress(body, coding) if coding else body
+    return encode
+
+
+def report(name, items, repeat):
+    rows = []
+    for shape in SHAPES:
+        for encoding in ('json', 'msgpack'):
+            for coding in (None, 'gzip', 'deflate'):
+                encode = encoder(shape, encoding, coding)
+                size = statistics.mean(len(encode(item)) for item in items)
+                rows.append((f"{encoding} {shape}" + (f" + {coding}" if coding else ''),
+                             size, time_encode(encode, items, repeat)))
+    base_size, base_time = rows[0][1], rows[0][2]
+    print(f"{name}:")
+    print(f"  {'encoding':<26} {'bytes':>10} {'size':>7} {'us/resp':>10} {'time':>7}")
+    for label, size, micros in rows:
+        print(f"  {label:<26} {size:>10.0f} {size / base_size:>6.2f}x {micros:>10.1f} {micros / base_time:>6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare response encodings by size and encode time")
+    parser.add_argument('db_path', nargs='?', default='health_data.db')
+    parser.add_argument('--requests', type=int, default=2000, help="single responses to encode")
+    parser.add_argument('--batch-zips', type=int, default=100, help="ZIPs per batch response")
+    parser.add_argument('--batches', type=int, default=20, help="batch responses to encode")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    engine = lookup.LookupEngine.from_database(args.db_path)
+    zips = sorted(engine.zip_to_fips)
+    measures = sorted(app_module.VALID_MEASURES)
+    rng = random.Random(args.seed)
+
+    # Look everything up front so only encoding is timed
+    singles = []
+    while len(singles) < args.requests:
+        records = engine.lookup_dicts(rng.choice(zips), rng.choice(measures), 'latest')
+        if records:
+            singles.append(records)
+    batches = []
+    for _ in range(args.batches):
+        results = {}
+        for zip_code in rng.sample(zips, args.batch_zips):
+            data = {measure_name: engine.lookup_dicts(zip_code, measure_name, 'latest') for measure_name in measures}
+            results[zip_code] = {"data": {name: records for name, records in data.items() if records},
+                                 "errors": {name: {"error": "No data found", "status": 404}
+                                            for name, records in data.items() if not records}}
+        batches.append({"results": results})
+
+    with app.app_context():
+        # The records shape must be exactly what the endpoints send today
+        assert encoder('records', 'json', None)(singles[0]) == app_module.jsonify(singles[0]).get_data()
+        report(f"single ({args.requests} responses, {statistics.mean(map(len, singles)):.1f} records each)",
+               singles, args.repeat)
+        report(f"batch ({args.batches} responses, {args.batch_zips} ZIPs x {len(measures)} measures each)",
+               batches, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
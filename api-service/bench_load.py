@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""Load test /county_data and report throughput and tail latency.
+
+Starts the API in a subprocess against health_data.db (or a synthetic
+database when there is none), replays one or more workloads and prints
+requests/sec and p50/p95/p99 latency for each:
+
+    uniform  ZIPs and measures drawn uniformly from the database
+    zipf     ZIPs drawn from a Zipf-skewed distribution, so a hot set dominates
+    errors   the request mix from test_local_api.py, including every error path
+
+Requests run closed-loop at a fixed concurrency, or open-loop at a fixed
+--rate. In open-loop mode latency is measured from each request's scheduled
+send time, so a stalled server is not hidden by the client slowing down.
+Results can be saved with --output and compared with --compare:
+
+    python3 bench_load.py --requests 5000 --concurrency 16 --output before.json
+    python3 bench_load.py --requests 5000 --concurrency 16 --compare before.json
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from app import VALID_MEASURES
+from test_local_api import TEST_CASES
+
+WORKLOADS = ('uniform', 'zipf', 'errors')
+
+
+def uniform_workload(zips, measures, rng):
+    while True:
+        yield {'zip': rng.choice(zips), 'measure_name': rng.choice(measures)}, None
+
+
+def zipf_workload(zips, measures, rng, s=1.1):
+    """ZIP popularity falls off as 1 / rank**s over a shuffled ranking"""
+    ranked = list(zips)
+    rng.shuffle(ranked)
+    cum_weights = list(itertools.accumulate(1 / rank ** s for rank in range(1, len(ranked) + 1)))
+    while True:
+        for zip_code in rng.choices(ranked, cum_weights=cum_weights, k=1024):
+            yield {'zip': zip_code, 'measure_name': rng.choice(measures)}, None
+
+
+def errors_workload(zips, measures, rng):
+    for case in itertools.cycle(TEST_CASES):
+        yield case['payload'], case['expected_status']
+
+
+WORKLOAD_FUNCTIONS = {
+    'uniform': uniform_workload,
+    'zipf': zipf_workload,
+    'errors': errors_workload
+}
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def summarize(latencies, statuses, unexpected, failures, elapsed):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies) + failures,
+        'failures': failures,
+        'unexpected_status': unexpected,
+        'status_counts': {str(status): count for status, count in sorted(statuses.items())},
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'mean': ms(statistics.mean(latencies)) if latencies else None,
+            'p50': ms(percentile(latencies, 0.50)),
+            'p95': ms(percentile(latencies, 0.95)),
+            'p99': ms(percentile(latencies, 0.99)),
+            'max': ms(latencies[-1]) if latencies else None
+        }
+    }
+
+
+def warm_up(url, zips, measures, count, seed):
+    """Send count untimed lookups so a cold start is not measured as the first workload's tail"""
+    rng = random.Random(seed)
+    with requests.Session() as session:
+        for payload, _ in itertools.islice(uniform_workload(zips, measures, rng), count):
+            session.post(url, json=payload, timeout=60)
+
+
+def run_workload(url, workload, total, concurrency, rate=None):
+    """Send total requests from workload; return the summary dict"""
+    requests_iter = iter(workload)
+    lock = threading.Lock()
+    local = threading.local()
+    latencies = []
+    statuses = {}
+    counts = {'unexpected': 0, 'failures': 0}
+
+    def send(i, start):
+        with lock:
+            payload, expected = next(requests_iter)
+        if rate:
+            # Open loop: wait for the scheduled send time and measure from it
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            scheduled = time.perf_counter()
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        try:
+            response = session.post(url, json=payload, timeout=30)
+        except requests.RequestException:
+            with lock:
+                counts['failures'] += 1
+            return
+        latency = time.perf_counter() - scheduled
+        with lock:
+            latencies.append(latency)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if expected is not None and response.status_code != expected:
+                counts['unexpected'] += 1
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(send, i, start) for i in range(total)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, statuses, counts['unexpected'], counts['failures'], elapsed)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve(db_path, port, server, cache_size):
+    """Run the API in this process (used for the benchmark's server subprocess)"""
+    import app as app_module
+    app_module.app.config['DATABASE_PATH'] = db_path
+    app_module.app.config['RESPONSE_CACHE_SIZE'] = cache_size
+    if server == 'asgi':
+        import uvicorn
+        import asgi_app
+        uvicorn.run(asgi_app.app, host='127.0.0.1', port=port, log_level='warning')
+    else:
+        from werkzeug.serving import run_simple
+        app_module.preload_engine()
+        run_simple('127.0.0.1', port, app_module.app, threaded=True)
+
+
+def start_server(db_path, server, cache_size):
+    """Start the API in a subprocess; return (process, base_url) once it answers /health"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', '--db', db_path, '--port', str(port),
+         '--server', server, '--cache-size', str(cache_size)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{server} server exited with status {process.returncode}")
+        try:
+            requests.get(f'{base_url}/health', timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{server} server did not start within 30s")
+
+
+def ensure_database(db_path, tmp_dir):
+    """Return db_path, or a synthetic database built in tmp_dir if it does not exist"""
+    if os.path.exists(db_path):
+        return db_path
+    import prepare_db
+    import synthetic_data
+    health_csv = os.path.join(tmp_dir, 'county_health_rankings.csv')
+    db_path = os.path.join(tmp_dir, 'health_data.db')
+    print("No database found; building a synthetic one")
+    synthetic_data.write_health_rankings_csv(health_csv, '../zip_county.csv')
+    prepare_db.prepare_databases(db_path, health_csv, '../zip_county.csv')
+    return db_path
+
+
+def load_zips(db_path):
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        return [row[0] for row in conn.execute("SELECT DISTINCT zip FROM zip_county ORDER BY zip")]
+    finally:
+        conn.close()
+
+
+def report(name, result):
+    latency = result['latency_ms']
+    print(f"{name:>8}: {result['requests_per_s']:8.1f} req/s  "
+          f"p50 {latency['p50']:8.3f} ms  p95 {latency['p95']:8.3f} ms  p99 {latency['p99']:8.3f} ms  "
+          f"failures {result['failures']}  unexpected {result['unexpected_status']}")
+
+
+def compare(previous, current, threshold):
+    """Print changes against a previous run; return the names of regressed workloads"""
+    regressed = []
+    for name, result in current['workloads'].items():
+        before = previous.get('workloads', {}).get(name)
+        if before is None:
+            continue
+        rps_change = result['requests_per_s'] / before['requests_per_s'] - 1
+        p99_change = result['latency_ms']['p99'] / before['latency_ms']['p99'] - 1
+        flag = ''
+        if rps_change < -threshold or p99_change > threshold:
+            regressed.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:>8}: req/s {rps_change:+7.1%}  p99 {p99_change:+7.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the /county_data endpoint")
+    parser.add_argument('--db', default='health_data.db',
+                        help="database to serve (a synthetic one is built if it does not exist)")
+    parser.add_argument('--url', help="benchmark an already running server instead of starting one")
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask',
+                        help="app to start; asgi needs uvicorn installed")
+    parser.add_argument('--workload', action='append', choices=WORKLOADS,
+                        help="workload to run (repeatable, default all)")
+    parser.add_argument('--requests', type=int, default=2000, help="requests per workload")
+    parser.add_argument('--concurrency', type=int, default=8, help="concurrent client connections")
+    parser.add_argument('--rate', type=float, help="open-loop requests/sec instead of closed-loop")
+    parser.add_argument('--warmup', type=int, default=50,
+                        help="untimed /county_data requests sent before the first workload")
+    parser.add_argument('--zipf-s', type=float, default=1.1, help="Zipf exponent for the zipf workload")
+    parser.add_argument('--cache-size', type=int, default=4096,
+                        help="response cache size for the started server (0 disables it)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', metavar='RESULTS', help="compare against a previous --output file")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="fractional req/s drop or p99 rise counted as a regression")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.db, args.port, args.server, args.cache_size)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = ensure_database(args.db, tmp_dir)
+        database = args.db if db_path == args.db else 'synthetic'
+        zips = load_zips(db_path)
+        measures = sorted(VALID_MEASURES)
+
+        process = None
+        base_url = args.url
+        if base_url is None:
+            process, base_url = start_server(db_path, args.server, args.cache_size)
+        try:
+            # A different seed, so the warm-up does not pre-fill the cache with the workloads' first keys
+            warm_up(f'{base_url}/county_data', zips, measures, args.warmup, args.seed + 1)
+            mode = f"{args.rate:g} req/s open loop" if args.rate else "closed loop"
+            print(f"{args.requests} requests per workload, concurrency {args.concurrency}, {mode}")
+            results = {}
+            for name in args.workload or WORKLOADS:
+                rng = random.Random(args.seed)
+                if name == 'zipf':
+                    workload = zipf_workload(zips, measures, rng, args.zipf_s)
+                else:
+                    workload = WORKLOAD_FUNCTIONS[name](zips, measures, rng)
+                results[name] = run_workload(f'{base_url}/county_data', workload,
+                                             args.requests, args.concurrency, args.rate)
+                report(name, results[name])
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    output = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'server': args.url or args.server,
+            'database': database,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'warmup': args.warmup,
+            'rate': args.rate,
+            'zipf_s': args.zipf_s,
+            'cache_size': args.cache_size,
+            'seed': args.seed,
+            'python': platform.python_version(),
+            'cpus': os.cpu_count()
+        },
+        'workloads': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(json.load(f), output, args.threshold)
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
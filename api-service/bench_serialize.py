@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Benchmark the /county_data serialization stage.
+
+Compares, for the same sample of (zip, measure_name) requests:
+
+    rows     normalize sqlite3.Row results into dicts, then jsonify (the SQL path before record_json)
+    dicts    jsonify the lookup engine's dicts
+    spliced  join the pre-serialized record_json fragments into the response body
+
+Usage: python bench_serialize.py [health_data.db]
+"""
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+import app as app_module
+import lookup
+from app import app
+
+
+def time_stage(func, params, repeat=5):
+    """Return the best per-request time in microseconds over repeat passes"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for args in params:
+            func(*args)
+        elapsed = (time.perf_counter() - start) / len(params) * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(db_path='health_data.db', requests=2000, seed=0):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    zips = [row[0] for row in conn.execute("SELECT DISTINCT zip FROM zip_county")]
+    measures = sorted(app_module.VALID_MEASURES)
+    rng = random.Random(seed)
+    pairs = [(rng.choice(zips), rng.choice(measures)) for _ in range(requests)]
+    engine = lookup.LookupEngine.from_database(db_path)
+
+    # Fetch everything up front so only serialization is timed
+    latest = app_module.year_params('latest')
+    rows = [(conn.execute(app_module.COUNTY_DATA_QUERY, pair + latest).fetchall(),) for pair in pairs]
+    dicts = [(engine.lookup_dicts(*pair, 'latest'),) for pair in pairs]
+    fragments = [(engine.lookup_json(*pair, 'latest'),) for pair in pairs]
+    conn.close()
+    records = statistics.mean(len(r[0]) for r in rows)
+
+    with app.app_context():
+        for (row_list,), (fragment_list,) in zip(rows, fragments):
+            assert app_module.jsonify([app_module.normalize_row(r) for r in row_list]).get_data() == \
+                app_module.splice_json(fragment_list)
+
+        print(f"{requests} requests, {records:.1f} records per response")
+        results = {
+            'rows': time_stage(lambda r: app_module.jsonify([app_module.normalize_row(row) for row in r]).get_data(), rows),
+            'dicts': time_stage(lambda d: app_module.jsonify(d).get_data(), dicts),
+            'spliced': time_stage(app_module.splice_json, fragments)
+        }
+    for name, micros in results.items():
+        print(f"{name:>8}: {micros:8.2f} us/request  ({results['rows'] / micros:5.1f}x)")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Benchmark cold-start time to the first /county_data answer.
+
+Compares three ways of getting a worker ready to serve:
+
+    snapshot  map health_data.snap and answer one lookup
+    sqlite    open health_data.db, load the lookup engine and answer one lookup
+    rebuild   rebuild health_data.db from the CSVs, as a fresh container would
+
+Usage: python bench_startup.py [health_data.db] [health_data.snap]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import lookup
+import prepare_db
+import snapshot
+
+ZIP_CODE = '02138'
+MEASURE_NAME = 'Adult obesity'
+
+
+def time_call(func, repeat):
+    """Return the best wall time of func() in milliseconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def snapshot_start(snapshot_path):
+    mapped = snapshot.Snapshot(snapshot_path)
+    mapped.lookup(ZIP_CODE, MEASURE_NAME)
+    mapped.close()
+
+
+def sqlite_start(db_path):
+    lookup.LookupEngine.from_database(db_path).lookup(ZIP_CODE, MEASURE_NAME)
+
+
+def rebuild_start(tmp_dir):
+    db_path = os.path.join(tmp_dir, 'health_data.db')
+    prepare_db.prepare_databases(db_path)
+    sqlite_start(db_path)
+
+
+def main(db_path='health_data.db', snapshot_path='health_data.snap', repeat=5):
+    if not os.path.exists(snapshot_path):
+        snapshot.export_snapshot(db_path, snapshot_path)
+    print(f"snapshot {os.path.getsize(snapshot_path) / 2**20:.1f} MiB, "
+          f"database {os.path.getsize(db_path) / 2**20:.1f} MiB")
+    print(f"{'snapshot':>8}: {time_call(lambda: snapshot_start(snapshot_path), repeat):10.2f} ms")
+    print(f"{'sqlite':>8}: {time_call(lambda: sqlite_start(db_path), repeat):10.2f} ms")
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        elapsed = time_call(lambda: rebuild_start(tmp_dir), 1)
+    finally:
+        shutil.rmtree(tmp_dir)
+    print(f"{'rebuild':>8}: {elapsed:10.2f} ms")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Measure memory per worker and throughput of serve_workers.py from 1 to 16 workers.
+
+For each --source and worker count, starts serve_workers.py against
+health_data.db (or a synthetic database when there is none), warms every
+worker up with a uniform random workload, times a second run of it and
+then reads each worker's memory from /proc/<pid>/smaps_rollup:
+
+    RSS  resident pages, counting shared pages in full in every worker
+    PSS  resident pages with each shared page split between its sharers
+
+Total PSS is what the server really costs: with the shared snapshot it
+stays nearly flat as workers are added, while sqlite and engine workers
+each hold their own copy of the data.
+
+    python3 bench_workers.py --workers 1 2 4 8 16 --source snapshot engine sqlite
+
+The response cache is off so every request reaches the lookup tables.
+Throughput only scales while there are idle cores for the extra workers,
+and the load generator runs on the same machine.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+import serve_workers
+from app import VALID_MEASURES
+from bench_load import ensure_database, free_port, load_zips, run_workload, uniform_workload
+
+
+def child_pids(pid):
+    """Pids of pid's direct children, from /proc"""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name can contain spaces and parentheses; the fields after it cannot
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def process_memory(pid):
+    """Return {'rss': kB, 'pss': kB} for a process"""
+    memory = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('Rss', 'Pss'):
+                memory[name.lower()] = int(value.split()[0])
+    return memory
+
+
+def start_workers(source, workers, db_path, snapshot_path):
+    """Start serve_workers.py; return (process, base_url) once every worker answers /health"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, serve_workers.__file__, '--workers', str(workers), '--port', str(port),
+         '--source', source, '--db', db_path, '--snapshot', snapshot_path, '--cache-size', '0'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"serve_workers.py exited with status {process.returncode}")
+        try:
+            if len(child_pids(process.pid)) == workers:
+                requests.get(f'{base_url}/health', timeout=1)
+                return process, base_url
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("serve_workers.py did not start within 60s")
+
+
+def run(source, workers, db_path, snapshot_path, zips, total, concurrency, seed):
+    """Benchmark one configuration; returns its result dict"""
+    measures = sorted(VALID_MEASURES)
+    process, base_url = start_workers(source, workers, db_path, snapshot_path)
+    try:
+        url = f'{base_url}/county_data'
+        run_workload(url, uniform_workload(zips, measures, random.Random(seed)), total, concurrency)
+        result = run_workload(url, uniform_workload(zips, measures, random.Random(seed + 1)), total, concurrency)
+        memory = [process_memory(pid) for pid in child_pids(process.pid)]
+        parent = process_memory(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+    return {
+        'source': source,
+        'workers': workers,
+        'requests_per_s': result['requests_per_s'],
+        'p99_ms': result['latency_ms']['p99'],
+        'failures': result['failures'],
+        'rss_per_worker_mib': round(sum(m['rss'] for m in memory) / len(memory) / 1024, 1),
+        'pss_per_worker_mib': round(sum(m['pss'] for m in memory) / len(memory) / 1024, 1),
+        'total_pss_mib': round((parent['pss'] + sum(m['pss'] for m in memory)) / 1024, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark memory and throughput of pre-forked workers")
+    parser.add_argument('--db', default='health_data.db',
+                        help="database to serve (a synthetic one is built if it does not exist)")
+    parser.add_argument('--source', nargs='+', choices=serve_workers.SOURCES, default=list(serve_workers.SOURCES))
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--requests', type=int, default=2000, help="timed requests per configuration")
+    parser.add_argument('--concurrency', type=int, default=32, help="concurrent client connections")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.abspath(ensure_database(args.db, tmp_dir))
+        snapshot_path = os.path.join(tmp_dir, 'health_data.snap')
+        zips = load_zips(db_path)
+        print(f"{args.requests} requests per run, concurrency {args.concurrency}, {os.cpu_count()} CPUs")
+        print(f"{'source':>8} {'workers':>7} {'req/s':>9} {'p99 ms':>8} "
+              f"{'RSS/worker':>11} {'PSS/worker':>11} {'total PSS':>10}  (MiB)")
+        results = []
+        for source in args.source:
+            for workers in args.workers:
+                result = run(source, workers, db_path, snapshot_path, zips,
+                             args.requests, max(args.concurrency, workers), args.seed)
+                results.append(result)
+                print(f"{source:>8} {workers:>7} {result['requests_per_s']:>9.1f} {result['p99_ms']:>8.2f} "
+                      f"{result['rss_per_worker_mib']:>11.1f} {result['pss_per_worker_mib']:>11.1f} "
+                      f"{result['total_pss_mib']:>10.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cpus': os.cpu_count(), 'results': results}, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Pooled, read-only SQLite connections for the API.
+
+Connections open health_data.db in read-only, immutable URI mode so SQLite
+skips locking and change detection, and keep their page cache and prepared
+statements between requests. Each connection is used by one thread at a
+time. Rebuilding the database changes the file on disk, so the pool checks
+the file on every checkout and reopens connections when it has changed.
+"""
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+CACHE_SIZE_KIB = 16 * 1024
+MMAP_SIZE = 64 * 1024 * 1024
+CACHED_STATEMENTS = 256
+MAX_IDLE = 16
+
+VERSION_QUERY = "SELECT value FROM build_metadata WHERE key = 'db_version'"
+
+
+def database_signature(db_path):
+    """Identify the current database file so rebuilds can be detected"""
+    st = os.stat(db_path)
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class ConnectionPool:
+    """A LIFO pool of read-only connections to one database file"""
+
+    def __init__(self, db_path, max_idle=MAX_IDLE):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.hits = 0
+        self.misses = 0
+        self.reopens = 0
+        self._idle = []
+        self._opened_at = {}
+        self._signature = None
+        self._version = None
+        self._version_signature = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro&immutable=1"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=CACHED_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    def _close(self, conn):
+        self._opened_at.pop(id(conn), None)
+        conn.close()
+
+    def acquire(self):
+        """Check out a connection for the calling thread"""
+        try:
+            signature = database_signature(self.db_path)
+        except OSError as e:
+            raise sqlite3.OperationalError(f"unable to open database file: {self.db_path}") from e
+        with self._lock:
+            if signature != self._signature:
+                if self._signature is not None:
+                    self.reopens += 1
+                for conn in self._idle:
+                    self._close(conn)
+                self._idle = []
+                self._signature = signature
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            self.misses += 1
+
+        conn = self._connect()
+        with self._lock:
+            self._opened_at[id(conn)] = (time.monotonic(), signature)
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, closing it if it is stale"""
+        with self._lock:
+            opened = self._opened_at.get(id(conn))
+            if opened is None or opened[1] != self._signature or len(self._idle) >= self.max_idle:
+                self._close(conn)
+            else:
+                self._idle.append(conn)
+
+    def data_version(self):
+        """Return the version stamp prepare_db.py wrote into the database.
+
+        The stamp is only re-read when the file on disk changes. Databases
+        built before version stamps fall back to the file signature.
+        """
+        try:
+            signature = database_signature(self.db_path)
+        except OSError as e:
+            raise sqlite3.OperationalError(f"unable to open database file: {self.db_path}") from e
+        if signature == self._version_signature:
+            return self._version
+
+        conn = self.acquire()
+        try:
+            row = conn.execute(VERSION_QUERY).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        finally:
+            self.release(conn)
+
+        version = row[0] if row else '-'.join(str(part) for part in signature)
+        with self._lock:
+            self._version, self._version_signature = version, signature
+        return version
+
+    def close(self):
+        with self._lock:
+            for conn in self._idle:
+                self._close(conn)
+            self._idle = []
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            ages = [now - opened for opened, _ in self._opened_at.values()]
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reopens': self.reopens,
+                'open': len(self._opened_at),
+                'idle': len(self._idle),
+                'max_connection_age_seconds': round(max(ages), 3) if ages else 0,
+                'mean_connection_age_seconds': round(sum(ages) / len(ages), 3) if ages else 0
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path):
+    """Return the pool for db_path, creating it on first use"""
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = ConnectionPool(db_path)
+                _pools[db_path] = pool
+    return pool
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""In-memory ZIP -> county -> measure lookup engine.
+
+health_data.db is small and read-only, so the engine loads both tables once
+and answers /county_data without touching SQLite.
+"""
+import bisect
+import json
+import sqlite3
+import threading
+
+# Output field names, in the order records are stored
+RECORD_FIELDS = (
+    'confidence_interval_lower_bound',
+    'confidence_interval_upper_bound',
+    'county',
+    'county_code',
+    'data_release_year',
+    'denominator',
+    'fipscode',
+    'measure_id',
+    'measure_name',
+    'numerator',
+    'raw_value',
+    'state',
+    'state_code',
+    'year_span'
+)
+
+# Position of data_release_year in a record tuple
+YEAR_FIELD = RECORD_FIELDS.index('data_release_year')
+
+# Range of release years that stands for "every year"
+ALL_YEARS = (0, 9999)
+
+ZIP_QUERY = "SELECT zip, fips FROM zip_county ORDER BY zip, fips"
+
+# health_rankings expressions for each of RECORD_FIELDS
+RECORD_COLUMNS = """
+       Confidence_Interval_Lower_Bound, Confidence_Interval_Upper_Bound,
+       County, County_code, Data_Release_Year, Denominator,
+       State_code || County_code, Measure_id, Measure_name, Numerator,
+       Raw_value, State, State_code, Year_span
+"""
+
+# Records come out oldest release first, so each (fips, measure_name) group is sorted by year
+RECORD_QUERY = f"""
+SELECT fips, {RECORD_COLUMNS}
+FROM health_rankings
+ORDER BY release_year, rowid
+"""
+
+# Records pre-serialized by prepare_db.py, in the same order
+FRAGMENT_QUERY = "SELECT fips, Measure_name, json FROM record_json ORDER BY release_year, rowid"
+
+# Every known ZIP, grouped by 3-digit prefix in ascending numeric order
+LOCATOR_QUERY = "SELECT prefix, zip_number, zip, default_state, default_city FROM zip_locator ORDER BY prefix, zip_number"
+
+
+def release_year(value):
+    """Integer release year of a Data_Release_Year value, or 0 if it is not a year"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def year_slice(years, selected):
+    """Return the (start, end) slice of an ascending list of release years that selected picks.
+
+    selected is 'latest' for the most recent year present, or an inclusive
+    (first, last) range of years.
+    """
+    if not years:
+        return 0, 0
+    if selected == 'latest':
+        return bisect.bisect_left(years, years[-1]), len(years)
+    first, last = selected
+    start = bisect.bisect_left(years, first)
+    return start, bisect.bisect_right(years, last, start)
+
+
+def nearest_in(numbers, entries, zip_number):
+    """Return the entry whose number is closest to zip_number, plus the distance.
+
+    numbers is ascending; of two equally close neighbors the lower ZIP wins.
+    """
+    i = bisect.bisect_left(numbers, zip_number)
+    best = min((j for j in (i - 1, i) if 0 <= j < len(numbers)),
+               key=lambda j: (abs(numbers[j] - zip_number), numbers[j]), default=None)
+    if best is None:
+        return None
+    return entries[best] + (abs(numbers[best] - zip_number),)
+
+
+def record_json(record):
+    """Serialize a record tuple exactly as jsonify would, as UTF-8 bytes"""
+    return json.dumps(dict(zip(RECORD_FIELDS, record)), sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+class LookupEngine:
+    """Read-only lookup tables built from health_data.db"""
+
+    __slots__ = ('zip_to_fips', 'records', 'fragments', 'years', 'locator', 'all_zips')
+
+    def __init__(self, zip_to_fips, records, fragments=None, locator=None):
+        # zip -> tuple of county fips codes, ascending
+        self.zip_to_fips = zip_to_fips
+        # (fips, measure_name) -> tuple of record tuples laid out as RECORD_FIELDS, oldest release first
+        self.records = records
+        # (fips, measure_name) -> ascending release year of each record
+        self.years = {key: tuple(release_year(record[YEAR_FIELD]) for record in rows)
+                      for key, rows in records.items()}
+        # (fips, measure_name) -> tuple of the same records serialized as JSON objects
+        if fragments is None:
+            fragments = {key: tuple(record_json(record) for record in rows) for key, rows in records.items()}
+        self.fragments = fragments
+        # 3-digit prefix -> (ascending ZIP numbers, matching (zip, default_state, default_city) tuples)
+        self.locator = locator
+        # The same for every ZIP, for prefixes with none; prefixes are leading digits, so this stays ascending
+        self.all_zips = None
+        if locator is not None:
+            prefixes = sorted(locator)
+            self.all_zips = (tuple(number for prefix in prefixes for number in locator[prefix][0]),
+                             tuple(entry for prefix in prefixes for entry in locator[prefix][1]))
+
+    @classmethod
+    def from_database(cls, db_path):
+        """Load both tables from a prepared health_data.db"""
+        conn = sqlite3.connect(db_path)
+        try:
+            zip_to_fips = {}
+            for zip_code, fips in conn.execute(ZIP_QUERY):
+                zip_to_fips.setdefault(zip_code, []).append(fips)
+
+            records = {}
+            for row in conn.execute(RECORD_QUERY):
+                records.setdefault((row[0], row[9]), []).append(row[1:])
+
+            # Databases built before record_json existed get their fragments serialized here
+            fragments = {}
+            try:
+                for fips, measure_name, fragment in conn.execute(FRAGMENT_QUERY):
+                    fragments.setdefault((fips, measure_name), []).append(fragment)
+            except sqlite3.OperationalError:
+                fragments = None
+
+            # Databases built before zip_locator existed have no nearest-ZIP fallback
+            locator = {}
+            try:
+                for prefix, zip_number, *entry in conn.execute(LOCATOR_QUERY):
+                    numbers, entries = locator.setdefault(prefix, ([], []))
+                    numbers.append(zip_number)
+                    entries.append(tuple(entry))
+            except sqlite3.OperationalError:
+                locator = None
+        finally:
+            conn.close()
+
+        return cls(
+            {zip_code: tuple(codes) for zip_code, codes in zip_to_fips.items()},
+            {key: tuple(rows) for key, rows in records.items()},
+            {key: tuple(rows) for key, rows in fragments.items()} if fragments is not None else None,
+            {prefix: (tuple(numbers), tuple(entries)) for prefix, (numbers, entries) in locator.items()}
+            if locator is not None else None
+        )
+
+    def _select(self, table, zip_code, measure_name, years):
+        result = []
+        for fips in self.zip_to_fips.get(zip_code, ()):
+            key = (fips, measure_name)
+            rows = table.get(key, ())
+            if years is None:
+                result.extend(rows)
+            elif rows:
+                start, end = year_slice(self.years[key], years)
+                result.extend(rows[start:end])
+        return result
+
+    def lookup(self, zip_code, measure_name, years=None):
+        """Return record tuples for every county the ZIP maps to.
+
+        years is 'latest' or an inclusive (first, last) range; None returns every year.
+        """
+        return self._select(self.records, zip_code, measure_name, years)
+
+    def lookup_dicts(self, zip_code, measure_name, years=None):
+        """Return records shaped like the /county_data JSON response"""
+        return [dict(zip(RECORD_FIELDS, record)) for record in self.lookup(zip_code, measure_name, years)]
+
+    def lookup_json(self, zip_code, measure_name, years=None):
+        """Return the records as pre-serialized JSON objects, ready to splice into a response"""
+        return self._select(self.fragments, zip_code, measure_name, years)
+
+    def nearest_zip(self, zip_code):
+        """Return (zip, default_state, default_city, distance) for the known ZIP closest to zip_code.
+
+        ZIPs sharing the first three digits are the candidates; only when
+        there is none under that prefix is every known ZIP one. A known ZIP
+        resolves to itself at distance 0. Returns None when there are no
+        ZIPs or the database predates zip_locator.
+        """
+        if self.locator is None:
+            return None
+        numbers, entries = self.locator.get(zip_code[:3]) or self.all_zips
+        return nearest_in(numbers, entries, int(zip_code))
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(db_path, version=None):
+    """Return the engine for db_path, loading it on first use.
+
+    Passing the database version reloads the engine after a rebuild.
+    """
+    loaded = _engines.get(db_path)
+    if loaded is None or loaded[0] != version:
+        with _engines_lock:
+            loaded = _engines.get(db_path)
+            if loaded is None or loaded[0] != version:
+                loaded = (version, LookupEngine.from_database(db_path))
+                _engines[db_path] = loaded
+    return loaded[1]
+
+
+def clear_engines():
+    """Drop loaded engines so the next request reloads from disk"""
+    with _engines_lock:
+        _engines.clear()
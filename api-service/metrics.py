@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""In-process request metrics for the API.
+
+Stage timings go into fixed-bucket histograms and requests are counted by
+endpoint, status code and measure_name, and requests turned away by
+admission control by outcome. Everything is rendered in the
+Prometheus text exposition format for /metrics.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds; the last bucket is +Inf
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# rate_limited: 429 from a client's token bucket; shed: 503 over the in-flight cap;
+# deadline_exceeded: 503 after a query was aborted at the request's deadline
+ADMISSION_OUTCOMES = ('rate_limited', 'shed', 'deadline_exceeded')
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative(self):
+        """[(upper bound label, count of observations <= bound)], ending with +Inf"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append(('+Inf' if bound == float('inf') else repr(bound), total))
+        return result
+
+
+class Metrics:
+    """Stage histograms and request counters, safe to share between threads"""
+
+    def __init__(self):
+        self.stages = {}
+        self.requests = {}
+        self.slow_requests = 0
+        self.admission = dict.fromkeys(ADMISSION_OUTCOMES, 0)
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, stage, spans=None):
+        """Time the block into the stage histogram, and append (stage, seconds) to spans if given"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(stage, elapsed)
+            if spans is not None:
+                spans.append((stage, elapsed))
+
+    def count_request(self, endpoint, status, measure_name=''):
+        key = (endpoint, str(status), measure_name or '')
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def count_slow_request(self):
+        with self._lock:
+            self.slow_requests += 1
+
+    def count_admission(self, outcome):
+        """Count a request rate limited, shed or aborted at its query deadline"""
+        with self._lock:
+            self.admission[outcome] += 1
+
+    def admission_counts(self):
+        with self._lock:
+            return dict(self.admission)
+
+    def render(self):
+        """Prometheus text exposition of every metric"""
+        with self._lock:
+            stages = {name: (list(h.cumulative()), h.sum, h.count) for name, h in self.stages.items()}
+            requests = dict(self.requests)
+            slow_requests = self.slow_requests
+            admission = dict(self.admission)
+
+        lines = [
+            '# HELP health_api_stage_seconds Time spent in each stage of a request.',
+            '# TYPE health_api_stage_seconds histogram'
+        ]
+        for name in sorted(stages):
+            buckets, total, count = stages[name]
+            stage = label('stage', name)
+            for bound, cumulative in buckets:
+                lines.append(f'health_api_stage_seconds_bucket{{{stage},le="{bound}"}} {cumulative}')
+            lines.append(f'health_api_stage_seconds_sum{{{stage}}} {total!r}')
+            lines.append(f'health_api_stage_seconds_count{{{stage}}} {count}')
+
+        lines += [
+            '# HELP health_api_requests_total Requests by endpoint, status code and measure_name.',
+            '# TYPE health_api_requests_total counter'
+        ]
+        for (endpoint, status, measure_name), count in sorted(requests.items()):
+            labels = ','.join((label('endpoint', endpoint), label('status', status),
+                               label('measure_name', measure_name)))
+            lines.append(f'health_api_requests_total{{{labels}}} {count}')
+
+        lines += [
+            '# HELP health_api_slow_requests_total Requests over the slow query threshold.',
+            '# TYPE health_api_slow_requests_total counter',
+            f'health_api_slow_requests_total {slow_requests}',
+            '# HELP health_api_admission_total Requests turned away by admission control, by outcome.',
+            '# TYPE health_api_admission_total counter'
+        ]
+        for outcome in ADMISSION_OUTCOMES:
+            lines.append(f'health_api_admission_total{{{label("outcome", outcome)}}} {admission[outcome]}')
+        return '\n'.join(lines) + '\n'
+
+
+def label(name, value):
+    escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'{name}="{escaped}"'
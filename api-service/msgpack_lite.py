@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Minimal MessagePack encoder and decoder for API responses.
+
+Covers the types the API returns: None, bools, ints, floats, strings,
+lists and dicts. Output is standard MessagePack that any msgpack library
+can read; integers and strings use their smallest encoding, floats are
+always float 64, and dict keys are sorted so identical data always
+produces identical bytes (and ETags), as jsonify's sort_keys does for JSON.
+"""
+import struct
+
+_UINT8 = struct.Struct('>B')
+_UINT16 = struct.Struct('>H')
+_UINT32 = struct.Struct('>I')
+_UINT64 = struct.Struct('>Q')
+_INT8 = struct.Struct('>b')
+_INT16 = struct.Struct('>h')
+_INT32 = struct.Struct('>i')
+_INT64 = struct.Struct('>q')
+_FLOAT64 = struct.Struct('>d')
+
+
+def _pack_int(value, out):
+    if 0 <= value < 0x80:
+        out.append(value)
+    elif -32 <= value < 0:
+        out.append(value & 0xFF)
+    elif value >= 0:
+        if value <= 0xFF:
+            out += b'\xcc' + _UINT8.pack(value)
+        elif value <= 0xFFFF:
+            out += b'\xcd' + _UINT16.pack(value)
+        elif value <= 0xFFFFFFFF:
+            out += b'\xce' + _UINT32.pack(value)
+        elif value <= 0xFFFFFFFFFFFFFFFF:
+            out += b'\xcf' + _UINT64.pack(value)
+        else:
+            raise OverflowError(f"integer out of MessagePack range: {value}")
+    elif value >= -0x80:
+        out += b'\xd0' + _INT8.pack(value)
+    elif value >= -0x8000:
+        out += b'\xd1' + _INT16.pack(value)
+    elif value >= -0x80000000:
+        out += b'\xd2' + _INT32.pack(value)
+    elif value >= -0x8000000000000000:
+        out += b'\xd3' + _INT64.pack(value)
+    else:
+        raise OverflowError(f"integer out of MessagePack range: {value}")
+
+
+def _pack_header(length, fix_base, fix_limit, codes, out):
+    """Append a str, array or map header; codes are the 8-, 16- and 32-bit length markers"""
+    if length < fix_limit:
+        out.append(fix_base | length)
+    elif codes[0] is not None and length <= 0xFF:
+        out += codes[0] + _UINT8.pack(length)
+    elif length <= 0xFFFF:
+        out += codes[1] + _UINT16.pack(length)
+    else:
+        out += codes[2] + _UINT32.pack(length)
+
+
+def _pack(value, out):
+    if value is None:
+        out.append(0xc0)
+    elif value is True:
+        out.append(0xc3)
+    elif value is False:
+        out.append(0xc2)
+    elif isinstance(value, int):
+        _pack_int(value, out)
+    elif isinstance(value, float):
+        out += b'\xcb' + _FLOAT64.pack(value)
+    elif isinstance(value, str):
+        encoded = value.encode('utf-8')
+        _pack_header(len(encoded), 0xa0, 32, (b'\xd9', b'\xda', b'\xdb'), out)
+        out += encoded
+    elif isinstance(value, (list, tuple)):
+        _pack_header(len(value), 0x90, 16, (None, b'\xdc', b'\xdd'), out)
+        for item in value:
+            _pack(item, out)
+    elif isinstance(value, dict):
+        _pack_header(len(value), 0x80, 16, (None, b'\xde', b'\xdf'), out)
+        for key in sorted(value):
+            _pack(key, out)
+            _pack(value[key], out)
+    else:
+        raise TypeError(f"cannot encode {type(value).__name__} as MessagePack")
+
+
+def packb(value):
+    """Encode value as MessagePack bytes"""
+    out = bytearray()
+    _pack(value, out)
+    return bytes(out)
+
+
+def _unpack(data, pos):
+    code = data[pos]
+    pos += 1
+    if code < 0x80:
+        return code, pos
+    if code >= 0xe0:
+        return code - 0x100, pos
+    if 0x80 <= code <= 0x8f:
+        return _unpack_map(data, pos, code & 0x0f)
+    if 0x90 <= code <= 0x9f:
+        return _unpack_array(data, pos, code & 0x0f)
+    if 0xa0 <= code <= 0xbf:
+        length = code & 0x1f
+        return data[pos:pos + length].decode('utf-8'), pos + length
+    if code == 0xc0:
+        return None, pos
+    if code in (0xc2, 0xc3):
+        return code == 0xc3, pos
+    fixed = {0xcc: _UINT8, 0xcd: _UINT16, 0xce: _UINT32, 0xcf: _UINT64,
+             0xd0: _INT8, 0xd1: _INT16, 0xd2: _INT32, 0xd3: _INT64, 0xcb: _FLOAT64,
+             0xca: struct.Struct('>f')}.get(code)
+    if fixed is not None:
+        return fixed.unpack_from(data, pos)[0], pos + fixed.size
+    lengths = {0xd9: _UINT8, 0xda: _UINT16, 0xdb: _UINT32, 0xdc: _UINT16, 0xdd: _UINT32,
+               0xde: _UINT16, 0xdf: _UINT32}
+    if code not in lengths:
+        raise ValueError(f"unsupported MessagePack type 0x{code:02x}")
+    length = lengths[code].unpack_from(data, pos)[0]
+    pos += lengths[code].size
+    if code <= 0xdb:
+        return data[pos:pos + length].decode('utf-8'), pos + length
+    if code <= 0xdd:
+        return _unpack_array(data, pos, length)
+    return _unpack_map(data, pos, length)
+
+
+def _unpack_array(data, pos, length):
+    items = []
+    for _ in range(length):
+        item, pos = _unpack(data, pos)
+        items.append(item)
+    return items, pos
+
+
+def _unpack_map(data, pos, length):
+    result = {}
+    for _ in range(length):
+        key, pos = _unpack(data, pos)
+        result[key], pos = _unpack(data, pos)
+    return result, pos
+
+
+def unpackb(data):
+    """Decode MessagePack bytes produced by packb (arrays come back as lists)"""
+    data = bytes(data)
+    value, pos = _unpack(data, 0)
+    if pos != len(data):
+        raise ValueError("extra bytes after MessagePack value")
+    return value
@@ -1,63 +1,675 @@
 #!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import csv
+import hashlib
+import io
+import itertools
+import multiprocessing
 import os
+import queue
+import shutil
 import sqlite3
-import subprocess
-
-def prepare_databases():
-    # First, create the health rankings database using csv_to_sqlite
-    subprocess.run([
-        'python3', 
-        '../csv_to_sqlite.py',
-        'health_rankings.db',
-        '../county_health_rankings.csv'
-    ], check=True)
-    
-    # Create zip county database
-    subprocess.run([
-        'python3',
-        '../csv_to_sqlite.py',
-        'zip_county.db',
-        '../zip_county.csv'
-    ], check=True)
-    
-    # Now create our final database with both tables
-    conn = sqlite3.connect('health_data.db')
+import time
+import uuid
+
+import lookup
+import snapshot
+
+# Rows per message from a parser process to the writer
+CHUNK_SIZE = 10000
+# Bound on chunks in flight so parsers cannot run far ahead of the writer
+QUEUE_CHUNKS = 16
+
+BUILD_PRAGMAS = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",  # 256 MiB
+    "PRAGMA temp_store = MEMORY"
+]
+
+INDEXES = [
+    "CREATE INDEX idx_zip_fips ON zip_county(zip, fips)",
+    # Ends in release_year so a county's rows come out by year and the latest is one probe away
+    "CREATE INDEX idx_fips_measure ON health_rankings(fips, Measure_name, release_year)",
+    # /state_data pages through a measure across a state by (fips, release_year, rowid)
+    "CREATE INDEX idx_state_measure ON health_rankings(State, Measure_name, fips, release_year)",
+    # /county_zips pages through a county's ZIPs
+    "CREATE INDEX idx_fips_zip ON zip_county(fips, zip)"
+]
+
+# Indexes older builds created that no statement uses; a refresh drops them
+RETIRED_INDEXES = ['idx_county_code', 'idx_measure']
+
+# Columns that identify a row when applying an incremental refresh; the
+# first also scopes which derived rows the refresh updates
+KEY_COLUMNS = {
+    'health_rankings': ('fips', 'Measure_id', 'Data_Release_Year'),
+    'zip_county': ('zip', 'county_code')
+}
+
+# Rows per index ANALYZE samples after an incremental refresh, instead of reading every table in full
+REFRESH_ANALYSIS_LIMIT = 1000
+
+# One population-weighted estimate per (zip, measure, release year)
+ZIP_AGGREGATES_TABLE = """
+CREATE TABLE zip_measure_weighted (
+    zip TEXT, Measure_name TEXT, Data_Release_Year TEXT, Measure_id TEXT, Year_span TEXT,
+    Raw_value REAL, Confidence_Interval_Lower_Bound REAL, Confidence_Interval_Upper_Bound REAL,
+    counties INTEGER, population_coverage REAL,
+    PRIMARY KEY (zip, Measure_name, Data_Release_Year)
+) WITHOUT ROWID
+"""
+
+# Every known ZIP keyed by its 3-digit prefix and numeric value, for the nearest-ZIP fallback
+ZIP_LOCATOR_TABLE = """
+CREATE TABLE zip_locator (
+    prefix TEXT, zip_number INTEGER, zip TEXT, default_state TEXT, default_city TEXT,
+    PRIMARY KEY (prefix, zip_number)
+) WITHOUT ROWID
+"""
+
+_queue = None
+
+
+class ColumnsChanged(ValueError):
+    """A CSV's columns no longer match its table, so its rows cannot be diffed"""
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def health_fips(row, columns):
+    """County FIPS for a health_rankings row, which splits it into State_code and County_code"""
+    state_code = to_int(row[columns['State_code']])
+    county_code = to_int(row[columns['County_code']])
+    if state_code is None or county_code is None:
+        return None
+    return state_code * 1000 + county_code
+
+
+def zip_county_fips(row, columns):
+    """County FIPS for a zip_county row, which stores it as one number"""
+    return to_int(row[columns['county_code']])
+
+
+def health_release_year(row, columns):
+    """Integer release year for a health_rankings row, 0 if Data_Release_Year is not a year"""
+    return lookup.release_year(row[columns['Data_Release_Year']])
+
+
+# Every table gets its source CSV columns plus integer columns derived from
+# them: a fips join key, so the API can join the tables with a plain indexed
+# equi-join, and for health_rankings the release year its indexes sort by
+DERIVED_COLUMNS = {
+    'health_rankings': (('fips', health_fips), ('release_year', health_release_year)),
+    'zip_county': (('fips', zip_county_fips),)
+}
+
+
+class HashingReader(io.RawIOBase):
+    """Binary file wrapper that hashes everything read through it"""
+
+    def __init__(self, raw, digest):
+        self._raw = raw
+        self.digest = digest
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self._raw.readinto(buffer)
+        if n:
+            self.digest.update(memoryview(buffer)[:n])
+        return n
+
+    def close(self):
+        self._raw.close()
+        super().close()
+
+
+def file_stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _init_worker(chunk_queue):
+    global _queue
+    _queue = chunk_queue
+
+
+def parse_csv(table, csv_file):
+    """Parse one CSV in a worker process and stream (table, kind, payload) messages to the writer.
+
+    Sends the header first, then row chunks, and always finishes with 'done'.
+    Returns (rows, seconds spent parsing, sha256 of the file), hashing the
+    file as it is parsed rather than in a second pass.
+    """
+    start = time.perf_counter()
+    rows = 0
+    digest = hashlib.sha256()
+    try:
+        raw = HashingReader(open(csv_file, 'rb'), digest)
+        with io.TextIOWrapper(io.BufferedReader(raw), encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            headers = next(reader)
+            _queue.put((table, 'header', headers))
+
+            columns = {name: i for i, name in enumerate(headers)}
+            derived = [derive for _, derive in DERIVED_COLUMNS[table]]
+            chunk = []
+            for row in reader:
+                for derive in derived:
+                    row.append(derive(row, columns))
+                chunk.append(row)
+                if len(chunk) >= CHUNK_SIZE:
+                    _queue.put((table, 'rows', chunk))
+                    rows += len(chunk)
+                    chunk = []
+            if chunk:
+                _queue.put((table, 'rows', chunk))
+                rows += len(chunk)
+    finally:
+        _queue.put((table, 'done', None))
+    return rows, time.perf_counter() - start, digest.hexdigest()
+
+
+def load_tables(conn, sources, targets=None):
+    """Parse every (table, csv_file) source concurrently and insert rows as they arrive.
+
+    targets optionally maps a table to the name to load it into, e.g. a
+    staging table. Returns {table: (rows, parse seconds, sha256)}.
+    """
+    targets = targets or {}
     cursor = conn.cursor()
-    
-    # Drop existing tables if they exist
-    cursor.execute("DROP TABLE IF EXISTS health_rankings")
-    cursor.execute("DROP TABLE IF EXISTS zip_county")
-    
-    # Attach both databases
-    cursor.execute("ATTACH 'health_rankings.db' as health")
-    cursor.execute("ATTACH 'zip_county.db' as zip")
-    
-    # Create health rankings table
+    inserts = {}
+    ctx = multiprocessing.get_context()
+    chunk_queue = ctx.Queue(QUEUE_CHUNKS)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(sources), mp_context=ctx,
+                                                initializer=_init_worker,
+                                                initargs=(chunk_queue,)) as pool:
+        futures = {table: pool.submit(parse_csv, table, csv_file) for table, csv_file in sources}
+        pending = len(futures)
+        while pending:
+            try:
+                table, kind, payload = chunk_queue.get(timeout=1)
+            except queue.Empty:
+                # A worker that died without reporting done breaks the pool
+                if any(f.done() and f.exception() for f in futures.values()):
+                    break
+                continue
+
+            if kind == 'header':
+                target = targets.get(table, table)
+                derived = [name for name, _ in DERIVED_COLUMNS[table]]
+                columns = ','.join([f'"{name}"' for name in payload] + [f'{name} INTEGER' for name in derived])
+                cursor.execute(f'DROP TABLE IF EXISTS {target}')
+                cursor.execute(f'CREATE TABLE {target} ({columns})')
+                placeholders = ','.join('?' * (len(payload) + len(derived)))
+                inserts[table] = f'INSERT INTO {target} VALUES ({placeholders})'
+            elif kind == 'rows':
+                cursor.executemany(inserts[table], payload)
+            else:
+                pending -= 1
+
+        # Re-raise any parser error
+        return {table: future.result() for table, future in futures.items()}
+
+
+def write_build_metadata(cursor):
+    """Stamp the database with a fresh version so the API can invalidate caches"""
+    cursor.execute("DROP TABLE IF EXISTS build_metadata")
+    cursor.execute("CREATE TABLE build_metadata (key TEXT PRIMARY KEY, value TEXT)")
+    cursor.executemany("INSERT INTO build_metadata VALUES (?, ?)", [
+        ('db_version', uuid.uuid4().hex),
+        ('built_at', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()))
+    ])
+
+
+def write_source_files(cursor, fingerprints):
+    """Record {table: (path, size, mtime_ns, sha256, rows)} for the next incremental refresh"""
     cursor.execute("""
-    CREATE TABLE health_rankings AS 
-    SELECT * FROM health.data
+    CREATE TABLE IF NOT EXISTS source_files (
+        table_name TEXT PRIMARY KEY, path TEXT, size INTEGER, mtime_ns INTEGER, sha256 TEXT, rows INTEGER
+    )
     """)
-    
-    # Create zip county table
-    cursor.execute("""
-    CREATE TABLE zip_county AS 
-    SELECT * FROM zip.data
+    cursor.executemany("INSERT OR REPLACE INTO source_files VALUES (?, ?, ?, ?, ?, ?)",
+                       [(table,) + tuple(fingerprint) for table, fingerprint in fingerprints.items()])
+
+
+def read_source_files(db_path):
+    """Return the recorded {table: (path, size, mtime_ns, sha256, rows)}, or None if there are none"""
+    if not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT table_name, path, size, mtime_ns, sha256, rows FROM source_files").fetchall()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+    return {row[0]: row[1:] for row in rows}
+
+
+def apply_delta(cursor, table, staging):
+    """Replace only the rows of table that differ from staging; return (added, removed, scope).
+
+    Rows are compared on every column, with NULL equal to NULL, and counted:
+    a row with more copies in table than in staging loses the extra copies,
+    one with more copies in staging gains the missing ones, in staging
+    order. A changed row is one removal and one addition; identical rows
+    are left alone. scope is the set of first key column values (fips or
+    zip) of the rows added or removed.
+    """
+    columns = [row[1] for row in cursor.execute(f"PRAGMA main.table_info({table})")]
+    staged = [row[1] for row in cursor.execute(f"PRAGMA temp.table_info({staging})")]
+    if columns != staged:
+        raise ColumnsChanged(f"{table} columns changed")
+
+    keys = KEY_COLUMNS[table]
+    cursor.execute(f"CREATE INDEX temp.idx_{staging}_key ON {staging} ({','.join(keys)})")
+    names = ','.join(f'"{c}"' for c in columns)
+
+    def same_row(a, b):
+        # Key columns first, so the join can probe an index on them
+        return ' AND '.join(f'{a}."{c}" IS {b}."{c}"' for c in list(keys) + [c for c in columns if c not in keys])
+
+    # Copies of each distinct row in staging minus copies in table, where they differ
+    cursor.execute(f"""
+    CREATE TABLE temp.{staging}_delta AS
+    SELECT {names}, SUM(copies) AS delta_copies FROM (
+        SELECT {names}, 1 AS copies FROM temp.{staging}
+        UNION ALL
+        SELECT {names}, -1 AS copies FROM main.{table}
+    )
+    GROUP BY {names}
+    HAVING SUM(copies) != 0
+    """)
+    cursor.execute(f"""
+    DELETE FROM main.{table} WHERE rowid IN (
+        SELECT row_id FROM (
+            SELECT t.rowid AS row_id, -d.delta_copies AS extra,
+                   ROW_NUMBER() OVER (PARTITION BY d.rowid ORDER BY t.rowid DESC) AS copy
+            FROM temp.{staging}_delta d JOIN main.{table} t ON {same_row('t', 'd')}
+            WHERE d.delta_copies < 0
+        )
+        WHERE copy <= extra
+    )
+    """)
+    removed = cursor.rowcount
+    cursor.execute(f"""
+    INSERT INTO main.{table}
+    SELECT {names} FROM (
+        SELECT s.*, s.rowid AS row_id, d.delta_copies AS missing,
+               ROW_NUMBER() OVER (PARTITION BY d.rowid ORDER BY s.rowid) AS copy
+        FROM temp.{staging}_delta d JOIN temp.{staging} s ON {same_row('s', 'd')}
+        WHERE d.delta_copies > 0
+    )
+    WHERE copy <= missing
+    ORDER BY row_id
+    """)
+    added = cursor.rowcount
+    scope = {row[0] for row in cursor.execute(f'SELECT DISTINCT "{keys[0]}" FROM temp.{staging}_delta')
+             if row[0] is not None}
+    cursor.execute(f"DROP TABLE temp.{staging}_delta")
+    cursor.execute(f"DROP TABLE temp.{staging}")
+    return added, removed, scope
+
+
+def scope_table(cursor, name, values):
+    """Load values into temp.{name}, for a rebuild restricted to the rows a refresh touched"""
+    cursor.execute(f"DROP TABLE IF EXISTS temp.{name}")
+    cursor.execute(f"CREATE TABLE temp.{name} (value PRIMARY KEY) WITHOUT ROWID")
+    cursor.executemany(f"INSERT INTO temp.{name} VALUES (?)", ((value,) for value in values))
+
+
+def weighted_estimates(zip_code, shares, values):
+    """Yield zip_measure_weighted rows for one ZIP.
+
+    shares is [(fips, share of the ZIP's population in that county)]. ZIPs
+    with no population shares weight their counties equally. For each value
+    column, counties without a value are left out and the remaining weights
+    renormalized; population_coverage is the share of the ZIP the raw value
+    estimate covers.
+    """
+    total = sum(share for _, share in shares)
+    if total <= 0:
+        shares = [(fips, 1.0) for fips, _ in shares]
+        total = float(len(shares))
+
+    # (measure, year) -> [measure_id, year_span, counties, [weighted sum, weight] per value column]
+    combined = {}
+    for fips, weight in shares:
+        if weight <= 0:
+            continue
+        for measure_name, year, measure_id, year_span, *measured in values.get(fips, ()):
+            entry = combined.get((measure_name, year))
+            if entry is None:
+                entry = combined[(measure_name, year)] = [measure_id, year_span, 0, [[0.0, 0.0] for _ in measured]]
+            if measured[0] is not None:
+                entry[2] += 1
+            for acc, value in zip(entry[3], measured):
+                if value is not None:
+                    acc[0] += weight * value
+                    acc[1] += weight
+
+    for (measure_name, year), (measure_id, year_span, counties, sums) in sorted(combined.items()):
+        estimates = [weighted / weight if weight else None for weighted, weight in sums]
+        yield (zip_code, measure_name, year, measure_id, year_span, *estimates,
+               counties, sums[0][1] / total)
+
+
+def build_zip_aggregates(cursor, zips=None):
+    """(Re)build zip_measure_weighted from the loaded tables; returns its row count.
+
+    Each county is weighted by the share of the ZIP's population living in
+    it (zip_pop_in_county), so the API can answer a weighted request with one
+    primary key lookup. With zips, only those ZIPs' rows are replaced.
+    """
+    if zips is None:
+        zip_filter = fips_filter = ''
+    else:
+        scope_table(cursor, 'refresh_zips', zips)
+        zip_filter = 'AND zip IN temp.refresh_zips'
+        fips_filter = 'AND fips IN (SELECT fips FROM zip_county WHERE zip IN temp.refresh_zips)'
+
+    values = {}
+    for fips, *row in cursor.execute(f"""
+    SELECT fips, Measure_name, Data_Release_Year, Measure_id, Year_span,
+           Raw_value, Confidence_Interval_Lower_Bound, Confidence_Interval_Upper_Bound
+    FROM health_rankings
+    WHERE fips IS NOT NULL AND Measure_name IS NOT NULL {fips_filter}
+    ORDER BY rowid
+    """):
+        values.setdefault(fips, []).append(tuple(row[:4]) + tuple(to_float(v) for v in row[4:]))
+
+    shares = cursor.execute(f"""
+    SELECT zip, fips, zip_pop_in_county FROM zip_county WHERE fips IS NOT NULL {zip_filter} ORDER BY zip, fips
+    """).fetchall()
+
+    # Most ZIPs lie in one county, whose estimates do not depend on the ZIP
+    single_county = {}
+
+    def rows():
+        for zip_code, group in itertools.groupby(shares, key=lambda row: row[0]):
+            group = [(fips, max(to_float(share) or 0.0, 0.0)) for _, fips, share in group]
+            if len(group) > 1:
+                yield from weighted_estimates(zip_code, group, values)
+                continue
+            fips = group[0][0]
+            estimates = single_county.get(fips)
+            if estimates is None:
+                # A lone county carries the whole weight whatever its share, and a weight of 1
+                # keeps the estimates exact, the same whichever of the county's ZIPs comes first
+                estimates = single_county[fips] = [row[1:] for row in weighted_estimates(None, [(fips, 1.0)], values)]
+            for row in estimates:
+                yield (zip_code,) + row
+
+    if zips is None:
+        cursor.execute("DROP TABLE IF EXISTS zip_measure_weighted")
+        cursor.execute(ZIP_AGGREGATES_TABLE)
+    else:
+        cursor.execute("DELETE FROM zip_measure_weighted WHERE zip IN temp.refresh_zips")
+    cursor.executemany("INSERT INTO zip_measure_weighted VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows())
+    return cursor.execute("SELECT COUNT(*) FROM zip_measure_weighted").fetchone()[0]
+
+
+def build_record_json(cursor, fips=None):
+    """(Re)build record_json: every health_rankings row pre-serialized as its API JSON object.
+
+    Rows keep their health_rankings rowid and release_year, so ordering by
+    (release_year, rowid) matches the order the API returns records in. With
+    fips, only those counties' rows are replaced.
+    """
+    if fips is None:
+        fips_filter = ''
+        cursor.execute("DROP TABLE IF EXISTS record_json")
+        cursor.execute("CREATE TABLE record_json (fips INTEGER, Measure_name TEXT, release_year INTEGER, json BLOB)")
+    else:
+        scope_table(cursor, 'refresh_fips', fips)
+        fips_filter = 'AND fips IN temp.refresh_fips'
+        cursor.execute("DELETE FROM record_json WHERE fips IN temp.refresh_fips")
+    rows = cursor.execute(f"""
+    SELECT rowid, fips, Measure_name, release_year, {lookup.RECORD_COLUMNS}
+    FROM health_rankings
+    WHERE fips IS NOT NULL {fips_filter}
+    """).fetchall()
+    cursor.executemany("INSERT INTO record_json (rowid, fips, Measure_name, release_year, json) VALUES (?, ?, ?, ?, ?)",
+                       ((row[0], row[1], row[2], row[3], lookup.record_json(row[4:])) for row in rows))
+    if fips is None:
+        cursor.execute("CREATE INDEX idx_record_json ON record_json(fips, Measure_name, release_year)")
+
+
+def build_zip_locator(cursor, zips=None):
+    """(Re)build zip_locator from zip_county; returns its row count.
+
+    ZIPs sharing a 3-digit prefix are served by the same sectional center,
+    so the API falls back to a neighbor with the same prefix, and to the
+    nearest ZIP overall only when the prefix has none. Either way the
+    numerically nearest one is two primary key probes. With zips, only
+    those ZIPs' rows are replaced.
+    """
+    if zips is None:
+        zip_filter = ''
+        cursor.execute("DROP TABLE IF EXISTS zip_locator")
+        cursor.execute(ZIP_LOCATOR_TABLE)
+    else:
+        scope_table(cursor, 'refresh_zips', zips)
+        zip_filter = 'AND zip IN temp.refresh_zips'
+        cursor.execute("DELETE FROM zip_locator WHERE zip IN temp.refresh_zips")
+    cursor.execute(f"""
+    INSERT INTO zip_locator
+    SELECT substr(zip, 1, 3), CAST(zip AS INTEGER), zip, MIN(default_state), MIN(default_city)
+    FROM zip_county
+    WHERE length(zip) = 5 AND zip NOT GLOB '*[^0-9]*' {zip_filter}
+    GROUP BY zip
     """)
-    
-    # Create indices for better performance
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_zip ON zip_county(zip)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_county_code ON health_rankings(county_code)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_measure ON health_rankings(measure_name)")
-    
-    # Commit and cleanup
-    conn.commit()
+    return cursor.execute("SELECT COUNT(*) FROM zip_locator").fetchone()[0]
+
+
+def refresh_derived(cursor, fips, zips):
+    """Update the derived tables for the counties (fips) and crosswalk ZIPs (zips) a refresh changed.
+
+    A ZIP's weighted estimates depend on its own crosswalk rows and on every
+    county it lies in, so they are recomputed for changed ZIPs and for all
+    ZIPs of changed counties. Tables a database built before them lacks are
+    built in full.
+    """
+    tables = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    scope_table(cursor, 'refresh_fips', fips)
+    affected_zips = set(zips) | {row[0] for row in cursor.execute(
+        "SELECT DISTINCT zip FROM zip_county WHERE fips IN temp.refresh_fips")}
+
+    build_zip_aggregates(cursor, affected_zips if 'zip_measure_weighted' in tables else None)
+    build_record_json(cursor, fips if 'record_json' in tables else None)
+    build_zip_locator(cursor, zips if 'zip_locator' in tables else None)
+    cursor.execute("DROP TABLE IF EXISTS temp.refresh_fips")
+    cursor.execute("DROP TABLE IF EXISTS temp.refresh_zips")
+
+
+def prepare_databases(db_path='health_data.db',
+                      health_csv='../county_health_rankings.csv',
+                      zip_csv='../zip_county.csv'):
+    """Build health_data.db from both CSVs in one pass.
+
+    The database is built under a temporary name next to db_path and
+    renamed over it at the end, so a running API never sees a half-built
+    database.
+    """
+    timings = {}
+    start = time.perf_counter()
+    tmp_path = f"{db_path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        cursor = conn.cursor()
+        for pragma in BUILD_PRAGMAS:
+            cursor.execute(pragma)
+
+        # Parse both CSVs in parallel and stream their rows into the final tables
+        stage = time.perf_counter()
+        parsed = load_tables(conn, [('health_rankings', health_csv), ('zip_county', zip_csv)])
+        conn.commit()
+        timings['load'] = time.perf_counter() - stage
+        sources = {'health_rankings': health_csv, 'zip_county': zip_csv}
+        fingerprints = {}
+        for table, (rows, seconds, sha256) in parsed.items():
+            timings[f'  parse {table} ({rows} rows)'] = seconds
+            fingerprints[table] = (os.path.abspath(sources[table]),) + file_stat(sources[table]) + (sha256, rows)
+        write_source_files(cursor, fingerprints)
+
+        # Create indices once the data is in
+        stage = time.perf_counter()
+        for index_sql in INDEXES:
+            cursor.execute(index_sql)
+        conn.commit()
+        timings['index'] = time.perf_counter() - stage
+
+        # Materialize the population-weighted ZIP estimates, pre-serialized records and ZIP locator
+        stage = time.perf_counter()
+        build_zip_aggregates(cursor)
+        build_record_json(cursor)
+        build_zip_locator(cursor)
+        cursor.execute("ANALYZE")
+        write_build_metadata(cursor)
+        conn.commit()
+        timings['aggregate'] = time.perf_counter() - stage
+    except BaseException:
+        conn.close()
+        os.remove(tmp_path)
+        raise
     conn.close()
-    
-    # Remove temporary databases
-    os.remove('health_rankings.db')
-    os.remove('zip_county.db')
-    
+
+    # Swap the finished database into place
+    stage = time.perf_counter()
+    os.replace(tmp_path, db_path)
+    timings['swap'] = time.perf_counter() - stage
+    timings['total'] = time.perf_counter() - start
+
+    for name, seconds in timings.items():
+        print(f"{name:<40} {seconds:8.3f}s")
     print("Database preparation complete!")
 
+def refresh_databases(db_path='health_data.db',
+                      health_csv='../county_health_rankings.csv',
+                      zip_csv='../zip_county.csv'):
+    """Incrementally refresh health_data.db from changed CSVs.
+
+    Inputs whose size and mtime, or failing that whose sha256, match the
+    fingerprint recorded in source_files are skipped, so a rerun with no
+    changes does not parse anything. Changed inputs are loaded into staging
+    tables and only their new, changed or removed rows are applied to a copy
+    of the database, along with the derived rows of the counties and ZIPs
+    they touch; the copy is then swapped into place, since the API reads the
+    file as immutable. Falls back to a full build when there is no usable
+    database or a file's columns changed. Returns {table: (added, removed)}
+    for changed tables.
+    """
+    start = time.perf_counter()
+    recorded = read_source_files(db_path)
+    if recorded is None:
+        prepare_databases(db_path, health_csv, zip_csv)
+        return None
+
+    sources = {'health_rankings': health_csv, 'zip_county': zip_csv}
+    changed = {}
+    # Fingerprints to re-record for files that were touched but have the same content
+    touched = {}
+    for table, csv_file in sources.items():
+        path, size, mtime_ns, sha256, rows = recorded.get(table, (None,) * 5)
+        stat = file_stat(csv_file)
+        if (os.path.abspath(csv_file), stat) == (path, (size, mtime_ns)):
+            continue
+        if file_sha256(csv_file) != sha256:
+            changed[table] = csv_file
+        else:
+            touched[table] = (os.path.abspath(csv_file),) + stat + (sha256, rows)
+
+    if not changed and not touched:
+        print(f"Database is up to date ({(time.perf_counter() - start) * 1000:.1f} ms)")
+        return {}
+
+    tmp_path = f"{db_path}.tmp-{os.getpid()}"
+    shutil.copyfile(db_path, tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        cursor = conn.cursor()
+        for pragma in BUILD_PRAGMAS:
+            cursor.execute(pragma)
+
+        for index in RETIRED_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {index}")
+
+        targets = {table: f'temp.staging_{table}' for table in changed}
+        parsed = load_tables(conn, list(changed.items()), targets) if changed else {}
+        summary = {}
+        # First key column values (fips, zip) of the rows each table's delta touched
+        scopes = {table: set() for table in KEY_COLUMNS}
+        fingerprints = dict(touched)
+        for table, csv_file in changed.items():
+            rows, _, sha256 = parsed[table]
+            added, removed, scopes[table] = apply_delta(cursor, table, f'staging_{table}')
+            summary[table] = (added, removed)
+            fingerprints[table] = (os.path.abspath(csv_file),) + file_stat(csv_file) + (sha256, rows)
+        write_source_files(cursor, fingerprints)
+        if any(added or removed for added, removed in summary.values()):
+            refresh_derived(cursor, scopes['health_rankings'], scopes['zip_county'])
+            cursor.execute(f"PRAGMA analysis_limit = {REFRESH_ANALYSIS_LIMIT}")
+            cursor.execute("ANALYZE")
+            write_build_metadata(cursor)
+        conn.commit()
+    except ColumnsChanged:
+        # The CSV columns changed, so rows cannot be diffed
+        conn.close()
+        os.remove(tmp_path)
+        prepare_databases(db_path, health_csv, zip_csv)
+        return None
+    except BaseException:
+        conn.close()
+        os.remove(tmp_path)
+        raise
+    conn.close()
+    os.replace(tmp_path, db_path)
+
+    for table, (added, removed) in summary.items():
+        print(f"{table}: {added} rows added, {removed} rows removed")
+    print(f"Incremental refresh complete ({time.perf_counter() - start:.3f}s)")
+    return summary
+
 if __name__ == '__main__':
-    prepare_databases()
+    parser = argparse.ArgumentParser(description="Build health_data.db for the API")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only apply rows from CSVs that changed since the last build")
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help="also export a memory-mappable snapshot for fast cold starts")
+    args = parser.parse_args()
+    if args.incremental:
+        refresh_databases()
+    else:
+        prepare_databases()
+    if args.snapshot and snapshot.read_version(args.snapshot) != snapshot.database_version('health_data.db'):
+        start = time.perf_counter()
+        records = snapshot.export_snapshot('health_data.db', args.snapshot)
+        print(f"Exported {records} records to {args.snapshot} ({time.perf_counter() - start:.3f}s)")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Query plan checks and index advisor for health_data.db.
+
+Runs EXPLAIN QUERY PLAN for every statement the API issues against a
+prepared database and reports:
+
+- full scans of health_rankings or zip_county by a per-request statement
+- declared indexes that no statement uses
+- per-request access patterns no index serves (table scans, automatic indexes)
+- per-request sorts no index serves (temp B-trees)
+
+    python3 query_plans.py [health_data.db]
+
+Exits with status 1 when a per-request statement scans a guarded table.
+The lookup engine's load queries read whole tables once by design, so
+they count towards index usage but are never flagged.
+"""
+import argparse
+import json
+import re
+import sqlite3
+import sys
+
+import app as app_module
+import db_pool
+import lookup
+
+# Tables a request must only ever reach through an index
+GUARDED_TABLES = ('health_rankings', 'zip_county')
+
+# Parameters the statements are planned with; plans depend on the shape of the
+# parameters, not their values
+SAMPLE_ZIP = '02138'
+SAMPLE_MEASURE = 'Adult obesity'
+SAMPLE_STATE = 'MA'
+SAMPLE_FIPS = 25017
+SAMPLE_YEARS = {'latest': 'latest', 'range': (2020, 2023)}
+
+# "FROM table alias" and "JOIN table AS alias"
+TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+NOT_ALIASES = {'where', 'join', 'on', 'order', 'group', 'limit', 'left', 'inner', 'cross', 'natural', 'union'}
+
+SCAN_DETAIL = re.compile(r'^SCAN (\w+)')
+INDEX_DETAIL = re.compile(r'^(?:SEARCH|SCAN) (\w+) USING (?:COVERING )?INDEX (\w+)')
+AUTOMATIC_DETAIL = re.compile(r'^(?:SEARCH|SCAN) (\w+) USING AUTOMATIC')
+
+
+def request_statements():
+    """Return (name, sql, params) for every statement the API may run while serving a request.
+
+    Year-filtered queries are planned for the latest release and for a year range.
+    """
+    statements = [('db_pool.VERSION_QUERY', db_pool.VERSION_QUERY, ())]
+    for label, years in SAMPLE_YEARS.items():
+        year_params = app_module.year_params(years)
+        measures = json.dumps(sorted(app_module.VALID_MEASURES))
+        statements += [
+            (f'COUNTY_DATA_QUERY ({label})', app_module.COUNTY_DATA_QUERY,
+             (SAMPLE_ZIP, SAMPLE_MEASURE) + year_params),
+            (f'COUNTY_JSON_QUERY ({label})', app_module.COUNTY_JSON_QUERY,
+             (SAMPLE_ZIP, SAMPLE_MEASURE) + year_params),
+            (f'BATCH_QUERY ({label})', app_module.BATCH_QUERY,
+             (json.dumps([SAMPLE_ZIP, '35203']), json.dumps([SAMPLE_MEASURE])) + year_params),
+            (f'ZIP_DATA_QUERY ({label})', app_module.ZIP_DATA_QUERY, (SAMPLE_ZIP, measures) + year_params),
+            (f'STATE_DATA_QUERY ({label})', app_module.STATE_DATA_QUERY,
+             (SAMPLE_STATE, SAMPLE_MEASURE, 0, 0, 0) + year_params + (500,)),
+        ]
+    zip_number = int(SAMPLE_ZIP)
+    statements += [
+        ('COUNTY_ZIPS_QUERY', app_module.COUNTY_ZIPS_QUERY, (SAMPLE_FIPS, '', 500)),
+        ('WEIGHTED_QUERY', app_module.WEIGHTED_QUERY, (SAMPLE_ZIP, SAMPLE_MEASURE)),
+        ('NEAREST_ZIP_QUERY', app_module.NEAREST_ZIP_QUERY,
+         (zip_number, SAMPLE_ZIP[:3], zip_number, SAMPLE_ZIP[:3], zip_number)),
+        ('NEAREST_ANY_ZIP_QUERY', app_module.NEAREST_ANY_ZIP_QUERY,
+         (zip_number, SAMPLE_ZIP[:3], zip_number, SAMPLE_ZIP[:3], zip_number)),
+    ]
+    return statements
+
+
+def load_statements():
+    """Return (name, sql, params) for the queries the lookup engine loads its tables with"""
+    return [(f'lookup.{name}', getattr(lookup, name), ())
+            for name in ('ZIP_QUERY', 'RECORD_QUERY', 'FRAGMENT_QUERY', 'LOCATOR_QUERY')]
+
+
+def table_aliases(sql):
+    """Map every table name and alias in a statement's FROM and JOIN clauses to its table"""
+    aliases = {}
+    for table, alias in TABLE_REFERENCE.findall(sql):
+        aliases[table] = table
+        if alias and alias.lower() not in NOT_ALIASES:
+            aliases[alias] = table
+    return aliases
+
+
+def explain(conn, sql, params):
+    """Return the EXPLAIN QUERY PLAN detail lines for a statement"""
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def check_plan(sql, plan, tables):
+    """Summarize a plan: the tables it scans, the indexes it uses, its automatic indexes and its sorts.
+
+    tables is the set of real table names, so scans of subqueries and
+    table-valued functions such as json_each are ignored.
+    """
+    aliases = table_aliases(sql)
+    result = {'scans': [], 'indexes': [], 'automatic': [], 'sorts': 0}
+    for detail in plan:
+        index = INDEX_DETAIL.match(detail)
+        if index:
+            result['indexes'].append(index.group(2))
+        automatic = AUTOMATIC_DETAIL.match(detail)
+        scan = SCAN_DETAIL.match(detail)
+        if automatic:
+            result['automatic'].append(aliases.get(automatic.group(1), automatic.group(1)))
+        elif scan and aliases.get(scan.group(1), scan.group(1)) in tables:
+            result['scans'].append(aliases.get(scan.group(1), scan.group(1)))
+        if detail.startswith('USE TEMP B-TREE'):
+            result['sorts'] += 1
+    return result
+
+
+def advise(conn):
+    """Plan every API statement on conn and return the report as a dict"""
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    # Indexes created with CREATE INDEX; automatic and primary key indexes have no sql
+    declared = dict(conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"))
+
+    report = {'statements': [], 'full_scans': [], 'unindexed': [], 'sorts': [], 'unused_indexes': []}
+    used = set()
+    for kind, statements in (('request', request_statements()), ('load', load_statements())):
+        for name, sql, params in statements:
+            try:
+                plan = explain(conn, sql, params)
+            except sqlite3.OperationalError as e:
+                # A table this build does not have, e.g. record_json on an old database
+                plan = [f'unavailable: {e}']
+            checked = check_plan(sql, plan, tables)
+            used.update(checked['indexes'])
+            report['statements'].append(dict(checked, name=name, kind=kind, plan=plan))
+            if kind != 'request':
+                continue
+            report['full_scans'] += [(name, table) for table in checked['scans'] if table in GUARDED_TABLES]
+            report['unindexed'] += [(name, table, 'full scan') for table in checked['scans']]
+            report['unindexed'] += [(name, table, 'automatic index') for table in checked['automatic']]
+            if checked['sorts']:
+                report['sorts'].append(name)
+
+    report['unused_indexes'] = sorted((name, table) for name, table in declared.items() if name not in used)
+    return report
+
+
+def print_report(report, stream=sys.stdout):
+    for statement in report['statements']:
+        print(f"{statement['name']} [{statement['kind']}]", file=stream)
+        for detail in statement['plan']:
+            print(f"    {detail}", file=stream)
+
+    def listing(items):
+        return ', '.join(items) or 'none'
+
+    print(file=stream)
+    print(f"Full scans of {'/'.join(GUARDED_TABLES)}: "
+          f"{listing(f'{table} in {name}' for name, table in report['full_scans'])}", file=stream)
+    print(f"Unused indexes: {listing(f'{name} on {table}' for name, table in report['unused_indexes'])}",
+          file=stream)
+    print(f"Access patterns without an index: "
+          f"{listing(f'{table} in {name} ({reason})' for name, table, reason in report['unindexed'])}",
+          file=stream)
+    print(f"Sorts without an index: {listing(report['sorts'])}", file=stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the API's query plans and report index usage")
+    parser.add_argument('db_path', nargs='?', default='health_data.db')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(f'file:{args.db_path}?mode=ro', uri=True)
+    try:
+        report = advise(conn)
+    finally:
+        conn.close()
+    print_report(report)
+    return 1 if report['full_scans'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
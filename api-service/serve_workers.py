@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Pre-forked multi-process server that shares one copy of the lookup tables.
+
+The parent loads the lookup tables once, opens the listening socket and
+forks the workers. The workers accept connections on the shared socket, and
+the kernel spreads connections across them:
+
+    python3 serve_workers.py --workers 4 --port 9000
+
+--source picks what the parent loads:
+
+    snapshot  export health_data.snap if it is missing or stale, then map it.
+              The workers inherit the read-only mapping, so the ZIP -> fips
+              and (fips, measure) -> record arrays are in memory once, in the
+              page cache, however many workers run (the default)
+    engine    load the in-memory lookup engine. The workers share its pages
+              copy-on-write until reference counting dirties them
+    sqlite    load nothing; each worker opens its own connections and page cache
+
+bench_workers.py measures memory per worker and throughput for each source.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import app as app_module
+import lookup
+import snapshot
+
+SOURCES = ('snapshot', 'engine', 'sqlite')
+
+# A worker that exits this soon after starting is broken, not crashed, so it is not restarted
+STARTUP_GRACE = 1.0
+
+
+def prepare_source(source, db_path='health_data.db', snapshot_path='health_data.snap'):
+    """Configure the app for source and load the data the workers will share.
+
+    Runs in the parent before forking. SQLite connections must not be
+    carried across a fork, so the connection pool is left for each worker
+    to open; the versions are read over short-lived connections instead.
+    """
+    config = app_module.app.config
+    config['DATABASE_PATH'] = db_path
+    config['USE_LOOKUP_ENGINE'] = source != 'sqlite'
+    config['SNAPSHOT_PATH'] = None
+    if source == 'snapshot':
+        if snapshot.read_version(snapshot_path) != snapshot.database_version(db_path):
+            snapshot.export_snapshot(db_path, snapshot_path)
+        snapshot.get_snapshot(snapshot_path)
+        config['SNAPSHOT_PATH'] = snapshot_path
+    elif source == 'engine':
+        lookup.get_engine(db_path, snapshot.database_version(db_path))
+    # The collector would otherwise write to every preloaded object's header
+    # on its first full pass in each worker, copying the pages they live on
+    gc.freeze()
+
+
+def run_worker(sock):
+    """Serve requests on the inherited listening socket until terminated"""
+    from werkzeug.serving import make_server
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app_module.app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def spawn_worker(sock):
+    """Fork a worker; returns its pid in the parent and never returns in the worker"""
+    pid = os.fork()
+    if pid:
+        return pid
+    status = 0
+    try:
+        run_worker(sock)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def serve(workers, host='127.0.0.1', port=9000, source='snapshot', db_path='health_data.db',
+          snapshot_path='health_data.snap', cache_size=app_module.RESPONSE_CACHE_SIZE):
+    """Load the shared data, fork workers and restart any that crash, until SIGTERM or SIGINT"""
+    prepare_source(source, db_path, snapshot_path)
+    app_module.app.config['RESPONSE_CACHE_SIZE'] = cache_size
+    sock = socket.create_server((host, port), backlog=1024)
+
+    started = {}
+    for _ in range(workers):
+        started[spawn_worker(sock)] = time.monotonic()
+    print(f"Serving {source} on http://{host}:{sock.getsockname()[1]} with {workers} workers "
+          f"(parent {os.getpid()})", file=sys.stderr)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in started:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    failed = False
+    while started:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        start = started.pop(pid, None)
+        if start is None or stopping:
+            continue
+        print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}", file=sys.stderr)
+        if time.monotonic() - start < STARTUP_GRACE:
+            failed = True
+            stop(None, None)
+        else:
+            started[spawn_worker(sock)] = time.monotonic()
+    sock.close()
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API from pre-forked workers sharing the lookup tables")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--source', choices=SOURCES, default='snapshot')
+    parser.add_argument('--db', default='health_data.db')
+    parser.add_argument('--snapshot', default='health_data.snap',
+                        help="snapshot file to map, exported from --db when missing or stale")
+    parser.add_argument('--cache-size', type=int, default=app_module.RESPONSE_CACHE_SIZE,
+                        help="response cache entries per worker (0 disables it)")
+    args = parser.parse_args()
+    return serve(args.workers, args.host, args.port, args.source, args.db, args.snapshot, args.cache_size)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
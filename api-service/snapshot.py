@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""Compact columnar snapshot of health_data.db for fast cold starts.
+
+prepare_db.py can export the lookup tables into one binary file:
+
+    header        magic, version stamp and section offsets
+    zip_keys      uint32[n_zip]   5-digit ZIPs as integers, sorted
+    zip_fips      uint32[n_zip]   county fips for each zip_keys entry
+    record_keys   uint64[n_rec]   fips << 16 | measure index, sorted
+    columns       uint32[n_fields][n_rec]  string table index per value
+    measures      uint32[n_measures]       string table index per measure name
+    offsets       uint32[n_strings + 1]    string table offsets into the heap
+    heap          tagged values: b's' + UTF-8 text, b'i' integer, b'f' float
+
+The app maps the file with mmap and reads the arrays through memoryviews
+without copying them, resolving lookups by binary search.
+"""
+import array
+import bisect
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import threading
+
+from lookup import RECORD_FIELDS, YEAR_FIELD, release_year, year_slice
+
+MAGIC = b'HDSNAP1' + (b'L' if sys.byteorder == 'little' else b'B')
+# magic, db_version, n_zip, n_rec, n_measures, n_strings, n_fields, then 7 section offsets
+HEADER = struct.Struct('=8s32sIIIII7Q')
+NULL = 0xFFFFFFFF
+
+RECORD_QUERY = """
+SELECT fips, Measure_name, Confidence_Interval_Lower_Bound, Confidence_Interval_Upper_Bound,
+       County, County_code, Data_Release_Year, Denominator,
+       State_code || County_code, Measure_id, Measure_name, Numerator,
+       Raw_value, State, State_code, Year_span
+FROM health_rankings
+WHERE fips IS NOT NULL AND Measure_name IS NOT NULL
+ORDER BY fips, Measure_name, release_year, rowid
+"""
+
+
+class StringTable:
+    """Deduplicated, tagged value heap"""
+
+    def __init__(self):
+        self.index = {}
+        self.offsets = array.array('I', [0])
+        self.heap = bytearray()
+
+    def add(self, value):
+        if value is None:
+            return NULL
+        key = (type(value), value)
+        i = self.index.get(key)
+        if i is None:
+            if isinstance(value, str):
+                encoded = b's' + value.encode('utf-8')
+            elif isinstance(value, int):
+                encoded = b'i' + str(value).encode('ascii')
+            else:
+                encoded = b'f' + repr(float(value)).encode('ascii')
+            i = len(self.offsets) - 1
+            self.heap += encoded
+            self.offsets.append(len(self.heap))
+            self.index[key] = i
+        return i
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def export_snapshot(db_path, snapshot_path):
+    """Write a snapshot of db_path's lookup tables; returns the number of records"""
+    version = database_version(db_path)
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        zip_keys = array.array('I')
+        zip_fips = array.array('I')
+        for zip_code, fips in conn.execute(
+                "SELECT zip, fips FROM zip_county WHERE fips IS NOT NULL ORDER BY zip, fips"):
+            if isinstance(zip_code, str) and zip_code.isdigit() and len(zip_code) == 5:
+                zip_keys.append(int(zip_code))
+                zip_fips.append(fips)
+
+        strings = StringTable()
+        measure_names = sorted(row[0] for row in conn.execute(
+            "SELECT DISTINCT Measure_name FROM health_rankings WHERE Measure_name IS NOT NULL"))
+        measure_index = {name: i for i, name in enumerate(measure_names)}
+        measures = array.array('I', (strings.add(name) for name in measure_names))
+
+        record_keys = array.array('Q')
+        columns = [array.array('I') for _ in RECORD_FIELDS]
+        for row in conn.execute(RECORD_QUERY):
+            record_keys.append(row[0] << 16 | measure_index[row[1]])
+            for column, value in zip(columns, row[2:]):
+                column.append(strings.add(value))
+    finally:
+        conn.close()
+
+    sections = [zip_keys, zip_fips, record_keys] + columns + [measures, strings.offsets]
+    offset = _align(HEADER.size)
+    starts = []
+    for section in sections:
+        starts.append(offset)
+        offset = _align(offset + len(section) * section.itemsize)
+    heap_start = offset
+
+    # Section offsets in the header: zip_keys, zip_fips, record_keys, first column,
+    # measures, string offsets, heap
+    header = HEADER.pack(MAGIC, version.encode('ascii')[:32].ljust(32), len(zip_keys), len(record_keys),
+                         len(measures), len(strings.offsets) - 1, len(RECORD_FIELDS),
+                         starts[0], starts[1], starts[2], starts[3], starts[-2], starts[-1], heap_start)
+
+    tmp_path = f"{snapshot_path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for start, section in zip(starts, sections):
+            f.write(b'\0' * (start - f.tell()))
+            section.tofile(f)
+        f.write(b'\0' * (heap_start - f.tell()))
+        f.write(strings.heap)
+    os.replace(tmp_path, snapshot_path)
+    return len(record_keys)
+
+
+def read_version(snapshot_path):
+    """Return the database version a snapshot was exported from, or None if unreadable"""
+    try:
+        with open(snapshot_path, 'rb') as f:
+            magic, version = HEADER.unpack(f.read(HEADER.size))[:2]
+    except (OSError, struct.error):
+        return None
+    return version.rstrip(b' \0').decode('ascii') if magic == MAGIC else None
+
+
+def database_version(db_path):
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        return conn.execute("SELECT value FROM build_metadata WHERE key = 'db_version'").fetchone()[0]
+    except (sqlite3.OperationalError, TypeError):
+        return ''
+    finally:
+        conn.close()
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.signature = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        (magic, version, n_zip, n_rec, n_measures, n_strings, n_fields,
+         zip_keys, zip_fips, record_keys, columns, measures, offsets, heap) = HEADER.unpack_from(self._view)
+        if magic != MAGIC or n_fields != len(RECORD_FIELDS):
+            self.close()
+            raise ValueError(f"{path} is not a snapshot for this platform and app")
+
+        self.version = version.rstrip(b' \0').decode('ascii')
+        self.zip_keys = self._array(zip_keys, 'I', n_zip)
+        self.zip_fips = self._array(zip_fips, 'I', n_zip)
+        self.record_keys = self._array(record_keys, 'Q', n_rec)
+        self.columns = []
+        for _ in range(n_fields):
+            self.columns.append(self._array(columns, 'I', n_rec))
+            columns = _align(columns + n_rec * 4)
+        self.offsets = self._array(offsets, 'I', n_strings + 1)
+        self.heap = self._view[heap:]
+        self.measures = self._array(measures, 'I', n_measures)
+        self.measure_index = {self.value(i): m for m, i in enumerate(self.measures)}
+
+    def _array(self, start, typecode, count):
+        size = struct.calcsize(typecode)
+        return self._view[start:start + count * size].cast(typecode)
+
+    def value(self, i):
+        if i == NULL:
+            return None
+        encoded = self.heap[self.offsets[i]:self.offsets[i + 1]]
+        tag, body = encoded[0], bytes(encoded[1:])
+        if tag == ord('s'):
+            return body.decode('utf-8')
+        if tag == ord('i'):
+            return int(body)
+        return float(body)
+
+    def county_fips(self, zip_code):
+        """County fips codes for a ZIP, ascending"""
+        if not (zip_code.isdigit() and len(zip_code) == 5):
+            return []
+        key = int(zip_code)
+        lo = bisect.bisect_left(self.zip_keys, key)
+        hi = bisect.bisect_right(self.zip_keys, key, lo)
+        return [self.zip_fips[i] for i in range(lo, hi)]
+
+    def lookup(self, zip_code, measure_name, years=None):
+        """Return record tuples for every county the ZIP maps to.
+
+        years is 'latest' or an inclusive (first, last) range; None returns every year.
+        """
+        measure = self.measure_index.get(measure_name)
+        if measure is None:
+            return []
+        result = []
+        for fips in self.county_fips(zip_code):
+            key = fips << 16 | measure
+            lo = bisect.bisect_left(self.record_keys, key)
+            hi = bisect.bisect_right(self.record_keys, key, lo)
+            if years is not None and lo < hi:
+                # Each county's records are stored oldest release first
+                year_column = self.columns[YEAR_FIELD]
+                start, end = year_slice([release_year(self.value(year_column[i])) for i in range(lo, hi)], years)
+                lo, hi = lo + start, lo + end
+            for i in range(lo, hi):
+                result.append(tuple(self.value(column[i]) for column in self.columns))
+        return result
+
+    def lookup_dicts(self, zip_code, measure_name, years=None):
+        """Return records shaped like the /county_data JSON response"""
+        return [dict(zip(RECORD_FIELDS, record)) for record in self.lookup(zip_code, measure_name, years)]
+
+    def close(self):
+        for name in ('zip_keys', 'zip_fips', 'record_keys', 'measures', 'offsets', 'heap'):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        for view in self.__dict__.pop('columns', []):
+            view.release()
+        self._view.release()
+        self._mmap.close()
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def _is_current(snapshot, st):
+    return (snapshot is not None and
+            (snapshot.signature.st_ino, snapshot.signature.st_mtime_ns) == (st.st_ino, st.st_mtime_ns))
+
+
+def get_snapshot(path):
+    """Return the mapped snapshot at path, remapping it when the file is replaced"""
+    st = os.stat(path)
+    snapshot = _snapshots.get(path)
+    if not _is_current(snapshot, st):
+        with _snapshots_lock:
+            snapshot = _snapshots.get(path)
+            if not _is_current(snapshot, st):
+                # Old mappings are left for the garbage collector; requests may still be reading them
+                snapshot = Snapshot(path)
+                _snapshots[path] = snapshot
+    return snapshot
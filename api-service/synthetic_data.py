@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Generate a synthetic county_health_rankings.csv for tests and benchmarks.
+
+The real rankings file is not checked in, so this writes one with the same
+columns for every county found in zip_county.csv.
+"""
+import csv
+import random
+import sys
+
+HEALTH_HEADERS = [
+    'State', 'County', 'State_code', 'County_code', 'Year_span',
+    'Measure_name', 'Measure_id', 'Numerator', 'Denominator', 'Raw_value',
+    'Confidence_Interval_Lower_Bound', 'Confidence_Interval_Upper_Bound',
+    'Data_Release_Year', 'fipscode'
+]
+
+MEASURES = [
+    ('Violent crime rate', '43'),
+    ('Unemployment', '23'),
+    ('Children in poverty', '24'),
+    ('Diabetic screening', '7'),
+    ('Mammography screening', '50'),
+    ('Preventable hospital stays', '5'),
+    ('Uninsured', '85'),
+    ('Sexually transmitted infections', '45'),
+    ('Physical inactivity', '70'),
+    ('Adult obesity', '11'),
+    ('Premature Death', '1'),
+    ('Daily fine particulate matter', '125')
+]
+
+
+def read_counties(zip_csv):
+    """Return sorted (fips, county, state) tuples found in a ZIP crosswalk"""
+    counties = {}
+    with open(zip_csv, 'r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f):
+            counties[int(row['county_code'])] = (row['county'], row['state_abbreviation'])
+    return [(fips, county, state) for fips, (county, state) in sorted(counties.items())]
+
+
+def write_health_rankings_csv(path, zip_csv, years=(2023,), measures=MEASURES, seed=0):
+    """Write one row per (county, measure, year), plus state-level rows"""
+    rng = random.Random(seed)
+    counties = read_counties(zip_csv)
+    states = {}
+    for fips, _, state in counties:
+        states.setdefault(fips // 1000, state)
+
+    rows = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEALTH_HEADERS)
+        for year in years:
+            year_span = f'{year - 2}-{year}'
+            places = [(code * 1000, state, state) for code, state in sorted(states.items())]
+            places += counties
+            for fips, county, state in places:
+                state_code, county_code = divmod(fips, 1000)
+                for measure_name, measure_id in measures:
+                    denominator = rng.randint(1000, 500000)
+                    numerator = rng.randint(0, denominator)
+                    raw_value = round(numerator / denominator * 100, 1)
+                    spread = round(rng.uniform(0.1, 2.0), 1)
+                    writer.writerow([
+                        state, county, str(state_code), str(county_code), year_span,
+                        measure_name, measure_id, numerator, denominator, raw_value,
+                        round(raw_value - spread, 1), round(raw_value + spread, 1),
+                        year, f'{fips:05d}'
+                    ])
+                    rows += 1
+    return rows
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python3 synthetic_data.py <output_csv> <zip_county_csv>")
+        sys.exit(1)
+    count = write_health_rankings_csv(sys.argv[1], sys.argv[2])
+    print(f"Wrote {count} rows to {sys.argv[1]}")
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+import concurrent.futures
+import csv
+import json
+import os
+import subprocess
+import threading
+import unittest
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import admission
+import app as app_module
+import asgi_app
+import metrics
+from app import app
+from test_asgi import AsgiTestClient
+
+PAYLOAD = {'zip': '02138', 'measure_name': 'Adult obesity'}
+
+# A page large enough to run past DEADLINE_CHECK_STEPS
+STATE_PAYLOAD = {'state': 'TX', 'measure_name': 'Adult obesity', 'years': 'all'}
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_burst_then_refill(self):
+        clock = FakeClock()
+        limiter = admission.RateLimiter(2, burst=3, clock=clock)
+        self.assertEqual([limiter.acquire('a') for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(limiter.acquire('a'), 0.5)
+        # Other clients have their own bucket
+        self.assertEqual(limiter.acquire('b'), 0)
+        clock.now += 0.5
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertAlmostEqual(limiter.acquire('a'), 0.5)
+        # Tokens never accumulate past the burst
+        clock.now += 60
+        self.assertEqual([limiter.acquire('a') for _ in range(3)], [0, 0, 0])
+        self.assertGreater(limiter.acquire('a'), 0)
+
+    def test_forgets_least_recent_client(self):
+        limiter = admission.RateLimiter(1, burst=1, max_clients=2, clock=FakeClock())
+        for client in ('a', 'b', 'a', 'c'):
+            limiter.acquire(client)
+        self.assertEqual(list(limiter._buckets), ['a', 'c'])
+        self.assertEqual(limiter.stats(), {'rate': 1, 'burst': 1, 'clients': 2})
+
+    def test_in_flight_limiter(self):
+        limiter = admission.InFlightLimiter(2)
+        self.assertEqual([limiter.try_acquire() for _ in range(3)], [True, True, False])
+        limiter.release()
+        self.assertTrue(limiter.try_acquire())
+        self.assertEqual(limiter.stats(), {'limit': 2, 'in_flight': 2})
+
+
+class TestAdmissionControl(unittest.TestCase):
+    """The limits driven over HTTP by concurrent clients, against a threaded local server"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        if not os.path.exists('health_data.db'):
+            subprocess.run(['python3', 'prepare_db.py'], check=True)
+        cls.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.thread.join()
+
+    def setUp(self):
+        app.extensions['metrics'] = metrics.Metrics()
+        app.extensions.pop('rate_limiter', None)
+        app.extensions.pop('in_flight_limiter', None)
+        app.config['RESPONSE_CACHE_SIZE'] = 0
+        self.client = app.test_client()
+
+    def tearDown(self):
+        for name in ('RATE_LIMIT', 'RATE_LIMIT_BURST', 'CLIENT_ID_HEADER', 'MAX_IN_FLIGHT', 'QUERY_TIMEOUT_MS'):
+            app.config[name] = None
+        app.config['RESPONSE_CACHE_SIZE'] = app_module.RESPONSE_CACHE_SIZE
+        app.config['USE_LOOKUP_ENGINE'] = True
+        app.config['TRUSTED_PROXY_HOPS'] = 1
+
+    def post_concurrently(self, count, url='/county_data', payload=PAYLOAD, headers=None):
+        with concurrent.futures.ThreadPoolExecutor(count) as executor:
+            return list(executor.map(
+                lambda _: requests.post(self.base_url + url, json=payload, headers=headers, timeout=10),
+                range(count)))
+
+    def test_rate_limit(self):
+        # Slow enough a refill that only the burst is admitted while the test runs
+        app.config['RATE_LIMIT'] = 0.01
+        app.config['RATE_LIMIT_BURST'] = 5
+        responses = self.post_concurrently(20)
+        statuses = sorted(response.status_code for response in responses)
+        self.assertEqual(statuses, [200] * 5 + [429] * 15)
+        for response in responses:
+            if response.status_code == 429:
+                self.assertEqual(response.json(), {"error": "Too many requests"})
+                self.assertEqual(response.headers['Retry-After'], '100')
+
+        # Only data endpoints are limited
+        self.assertEqual(requests.get(self.base_url + '/health', timeout=10).status_code, 200)
+        admission_stats = self.client.get('/health').get_json()['admission']
+        self.assertEqual(admission_stats['rate_limited'], 15)
+        self.assertEqual(admission_stats['rate_limit'], {'rate': 0.01, 'burst': 5, 'clients': 1})
+        text = self.client.get('/metrics').text
+        self.assertIn('health_api_admission_total{outcome="rate_limited"} 15', text)
+        self.assertIn('health_api_requests_total{endpoint="county_data",status="429",measure_name=""} 15', text)
+
+    def test_rate_limit_per_client(self):
+        app.config['RATE_LIMIT'] = 0.01
+        app.config['RATE_LIMIT_BURST'] = 2
+        app.config['CLIENT_ID_HEADER'] = 'X-Forwarded-For'
+        for client in ('203.0.113.1', '10.0.0.1, 203.0.113.2'):
+            responses = self.post_concurrently(4, headers={'X-Forwarded-For': client})
+            self.assertEqual(sorted(r.status_code for r in responses), [200, 200, 429, 429], client)
+
+    def test_rate_limit_ignores_spoofed_addresses(self):
+        """A client cannot get a fresh bucket by making up the start of the forwarding chain"""
+        app.config['RATE_LIMIT'] = 0.01
+        app.config['RATE_LIMIT_BURST'] = 1
+        app.config['CLIENT_ID_HEADER'] = 'X-Forwarded-For'
+        statuses = [requests.post(self.base_url + '/county_data', json=PAYLOAD, timeout=10,
+                                  headers={'X-Forwarded-For': f'1.2.3.{i}, 203.0.113.9'}).status_code
+                    for i in range(4)]
+        self.assertEqual(statuses, [200, 429, 429, 429])
+        self.assertEqual(self.client.get('/health').get_json()['admission']['rate_limit']['clients'], 1)
+
+        # Behind two proxies the client is the address the outer one appended
+        app.config['TRUSTED_PROXY_HOPS'] = 2
+        statuses = [requests.post(self.base_url + '/county_data', json=PAYLOAD, timeout=10,
+                                  headers={'X-Forwarded-For': f'1.2.3.{i}, 203.0.113.10, 10.0.0.2'}).status_code
+                    for i in range(3)]
+        self.assertEqual(statuses, [200, 429, 429])
+
+    def test_in_flight_cap(self):
+        app.config['MAX_IN_FLIGHT'] = 2
+        entered = threading.Semaphore(0)
+        proceed = threading.Event()
+        render = app_module.render_county_data
+
+        def blocking_render(*args):
+            entered.release()
+            proceed.wait(10)
+            return render(*args)
+        app_module.render_county_data = blocking_render
+        self.addCleanup(setattr, app_module, 'render_county_data', render)
+
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            held = [executor.submit(requests.post, self.base_url + '/county_data', json=PAYLOAD, timeout=10)
+                    for _ in range(2)]
+            for _ in held:
+                self.assertTrue(entered.acquire(timeout=10))
+            # Both slots are taken, so everything else is shed without waiting
+            shed = self.post_concurrently(6)
+            proceed.set()
+            self.assertEqual([future.result().status_code for future in held], [200, 200])
+        for response in shed:
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json(), {"error": "Server busy"})
+            self.assertEqual(response.headers['Retry-After'], '1')
+
+        admission_stats = self.client.get('/health').get_json()['admission']
+        self.assertEqual(admission_stats['shed'], 6)
+        self.assertEqual(admission_stats['in_flight'], {'limit': 2, 'in_flight': 0})
+        self.assertEqual(requests.post(self.base_url + '/county_data', json=PAYLOAD, timeout=10).status_code, 200)
+
+    def test_query_deadline(self):
+        app.config['USE_LOOKUP_ENGINE'] = False
+        app.config['QUERY_TIMEOUT_MS'] = 0
+        for url, payload in (('/state_data', STATE_PAYLOAD),
+                             ('/county_data/batch', {'zips': ['02138', '39401'],
+                                                     'measure_names': sorted(app_module.VALID_MEASURES)})):
+            response = self.client.post(url, json=payload)
+            self.assertEqual(response.status_code, 503, url)
+            self.assertEqual(response.get_json(), {"error": "Query deadline exceeded"})
+            self.assertEqual(response.headers['Retry-After'], '1')
+
+        admission_stats = self.client.get('/health').get_json()['admission']
+        self.assertEqual(admission_stats['deadline_exceeded'], 2)
+        self.assertEqual(admission_stats['query_timeout_ms'], 0)
+        self.assertIn('health_api_admission_total{outcome="deadline_exceeded"} 2', self.client.get('/metrics').text)
+
+        # Pooled connections go back without the handler, and a generous deadline is never hit
+        for timeout in (None, 60000):
+            app.config['QUERY_TIMEOUT_MS'] = timeout
+            responses = self.post_concurrently(4, '/state_data', STATE_PAYLOAD)
+            self.assertEqual([r.status_code for r in responses], [200] * 4, timeout)
+        self.assertEqual(self.client.get('/health').get_json()['admission']['deadline_exceeded'], 2)
+
+    def test_query_deadline_skips_fallback(self):
+        """An interrupted record_json query fails the request instead of retrying without fragments"""
+        app.config['USE_LOOKUP_ENGINE'] = False
+        app.config['QUERY_TIMEOUT_MS'] = 0
+        self.addCleanup(setattr, app_module, 'DEADLINE_CHECK_STEPS', app_module.DEADLINE_CHECK_STEPS)
+        app_module.DEADLINE_CHECK_STEPS = 1
+        fallback_calls = []
+        county_result = app_module.county_result
+
+        def counting_county_result(*args):
+            fallback_calls.append(args)
+            return county_result(*args)
+        app_module.county_result = counting_county_result
+        self.addCleanup(setattr, app_module, 'county_result', county_result)
+
+        response = self.client.post('/county_data', json=PAYLOAD)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.get_json(), {"error": "Query deadline exceeded"})
+        self.assertEqual(fallback_calls, [])
+
+    def test_query_deadline_mid_stream(self):
+        """A deadline hit after the 200 is sent ends the NDJSON body with an error line"""
+        app.config['USE_LOOKUP_ENGINE'] = False
+        app.config['QUERY_TIMEOUT_MS'] = 0
+        # Sparse enough checks that the first rows are streamed before the deadline is noticed
+        self.addCleanup(setattr, app_module, 'DEADLINE_CHECK_STEPS', app_module.DEADLINE_CHECK_STEPS)
+        app_module.DEADLINE_CHECK_STEPS = 100000
+        with open('../zip_county.csv', encoding='utf-8-sig', newline='') as f:
+            zips = list(dict.fromkeys(row['zip'] for row in csv.DictReader(f)))[:2000]
+        response = self.client.post('/county_data/batch?stream=1', json={
+            'zips': zips, 'measure_names': sorted(app_module.VALID_MEASURES), 'years': 'all'})
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertGreater(len(lines), 1)
+        self.assertEqual(lines[-1], {"error": "Query deadline exceeded", "status": 503})
+        self.assertEqual(self.client.get('/health').get_json()['admission']['deadline_exceeded'], 1)
+
+    def test_stream_holds_in_flight_slot(self):
+        """A streamed body keeps its in-flight slot until it is closed"""
+        app.config['MAX_IN_FLIGHT'] = 1
+        response = self.client.post('/county_data?stream=1', json=PAYLOAD, buffered=False)
+        self.assertEqual(response.status_code, 200)
+        next(iter(response.response))
+        self.assertEqual(self.client.get('/health').get_json()['admission']['in_flight'],
+                         {'limit': 1, 'in_flight': 1})
+        self.assertEqual(self.client.post('/county_data', json=PAYLOAD).status_code, 503)
+        response.close()
+        self.assertEqual(self.client.get('/health').get_json()['admission']['in_flight'],
+                         {'limit': 1, 'in_flight': 0})
+        self.assertEqual(self.client.post('/county_data', json=PAYLOAD).status_code, 200)
+
+    def test_query_deadline_asgi(self):
+        app.config['USE_LOOKUP_ENGINE'] = False
+        app.config['QUERY_TIMEOUT_MS'] = 0
+        # Single lookups are too short to reach the default check interval
+        self.addCleanup(setattr, app_module, 'DEADLINE_CHECK_STEPS', app_module.DEADLINE_CHECK_STEPS)
+        app_module.DEADLINE_CHECK_STEPS = 1
+        application = asgi_app.CountyDataApp()
+        self.addCleanup(application.close)
+        response = AsgiTestClient(application).post('/county_data', json=PAYLOAD)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.get_json(), {"error": "Query deadline exceeded"})
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(self.client.post('/county_data', json=PAYLOAD).status_code, 503)
+        self.assertEqual(self.client.get('/health').get_json()['admission']['deadline_exceeded'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
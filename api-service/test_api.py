@@ -1,7 +1,19 @@
 #!/usr/bin/env python3
 import unittest
+import csv
+import gzip
+import json
 import os
-from app import app
+import shutil
+import subprocess
+import tempfile
+import tracemalloc
+import zlib
+import app as app_module
+import msgpack_lite
+import prepare_db
+import synthetic_data
+from app import app, VALID_MEASURES
 
 class TestCountyDataAPI(unittest.TestCase):
     @classmethod
@@ -60,6 +72,13 @@ class TestCountyDataAPI(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 404)
 
+    def test_measure_not_a_string(self):
+        """Test error when measure_name is a list or an object"""
+        for measure_name in (['Adult obesity'], {'name': 'Adult obesity'}):
+            response = self.client.post('/county_data', json={'zip': '02138', 'measure_name': measure_name})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json(), {"error": "'measure_name' must be a string"})
+
     def test_valid_request(self):
         """Test successful request with valid data"""
         response = self.client.post(
@@ -95,5 +114,584 @@ class TestCountyDataAPI(unittest.TestCase):
             self.assertEqual(first_record['county_code'], '17')
             self.assertEqual(first_record['state_code'], '25')
 
+    def test_four_digit_county_code(self):
+        """Test that ZIPs in states with a 1-digit state code join to the right county"""
+        response = self.client.post(
+            '/county_data',
+            json={'zip': '35203', 'measure_name': 'Adult obesity'}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertTrue(len(data) > 0)
+        for record in data:
+            self.assertEqual(record['county'], 'Jefferson County')
+            self.assertEqual(record['state'], 'AL')
+
+    def test_weighted_aggregate(self):
+        """Test that ?aggregate=weighted returns one estimate for a multi-county ZIP"""
+        response = self.client.post(
+            '/county_data?aggregate=weighted',
+            json={'zip': '00601', 'measure_name': 'Adult obesity'}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['zip'], '00601')
+        self.assertEqual(data['measure_name'], 'Adult obesity')
+        self.assertEqual(data['counties'], 2)
+        counties = self.client.post('/county_data', json={'zip': '00601', 'measure_name': 'Adult obesity'}).get_json()
+        raw_values = [float(record['raw_value']) for record in counties]
+        self.assertTrue(min(raw_values) <= data['raw_value'] <= max(raw_values))
+        self.assertLessEqual(data['confidence_interval_lower_bound'], data['raw_value'])
+        self.assertGreaterEqual(data['confidence_interval_upper_bound'], data['raw_value'])
+
+    def test_weighted_aggregate_errors(self):
+        response = self.client.post(
+            '/county_data?aggregate=weighted',
+            json={'zip': '00000', 'measure_name': 'Adult obesity'}
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(
+            '/county_data?aggregate=median',
+            json={'zip': '02138', 'measure_name': 'Adult obesity'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+class TestCountyDataBatchAPI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        cls.client = app.test_client()
+        if not os.path.exists('health_data.db'):
+            subprocess.run(['python3', 'prepare_db.py'], check=True)
+
+    def tearDown(self):
+        app.config['USE_LOOKUP_ENGINE'] = True
+
+    def post_batch(self, payload):
+        return self.client.post('/county_data/batch', json=payload)
+
+    def test_teapot(self):
+        response = self.post_batch({'coffee': 'teapot', 'zips': ['02138'], 'measure_names': ['Adult obesity']})
+        self.assertEqual(response.status_code, 418)
+
+    def test_missing_fields(self):
+        self.assertEqual(self.post_batch({'zips': ['02138']}).status_code, 400)
+        self.assertEqual(self.post_batch({'measure_names': ['Adult obesity']}).status_code, 400)
+
+    def test_non_list_fields(self):
+        response = self.post_batch({'zips': '02138', 'measure_names': ['Adult obesity']})
+        self.assertEqual(response.status_code, 400)
+
+    def test_body_not_an_object(self):
+        for payload in ([], 'x', 5):
+            response = self.post_batch(payload)
+            self.assertEqual(response.status_code, 400, payload)
+            self.assertEqual(response.get_json(), {"error": "Request body must be a JSON object"})
+
+    def test_batch_too_large(self):
+        zips = [f'{i:05d}' for i in range(app_module.MAX_BATCH_ITEMS + 1)]
+        response = self.post_batch({'zips': zips, 'measure_names': ['Adult obesity']})
+        self.assertEqual(response.status_code, 400)
+
+    def test_per_item_errors(self):
+        """Test that bad items are reported without failing the batch"""
+        response = self.post_batch({
+            'zips': ['02138', '2138', '00000'],
+            'measure_names': ['Adult obesity', 'NonexistentMeasure']
+        })
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertEqual(results['2138']['status'], 400)
+        self.assertIn('Adult obesity', results['02138']['data'])
+        self.assertEqual(results['02138']['errors']['NonexistentMeasure']['status'], 404)
+        self.assertEqual(results['00000']['data'], {})
+        self.assertEqual(results['00000']['errors']['Adult obesity']['error'], 'No data found')
+
+    def test_matches_single_requests(self):
+        """Test that each batch item equals the single /county_data response"""
+        zips = ['02138', '35203', '39401']
+        measure_names = ['Adult obesity', 'Unemployment']
+        for use_engine in (True, False):
+            app.config['USE_LOOKUP_ENGINE'] = use_engine
+            results = self.post_batch({'zips': zips, 'measure_names': measure_names}).get_json()['results']
+            for zip_code in zips:
+                for measure_name in measure_names:
+                    single = self.client.post(
+                        '/county_data',
+                        json={'zip': zip_code, 'measure_name': measure_name}
+                    ).get_json()
+                    self.assertEqual(results[zip_code]['data'][measure_name], single)
+
+class TestRangeQueries(unittest.TestCase):
+    """/zip_data, /county_zips and /state_data"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        cls.client = app.test_client()
+        if not os.path.exists('health_data.db'):
+            subprocess.run(['python3', 'prepare_db.py'], check=True)
+
+    def tearDown(self):
+        app.config['USE_LOOKUP_ENGINE'] = True
+
+    def pages(self, url, payload):
+        """Follow next_cursor to the end; return (results, number of pages)"""
+        results, pages = [], 0
+        while True:
+            response = self.client.post(url, json=payload)
+            self.assertEqual(response.status_code, 200)
+            body = response.get_json()
+            results.extend(body['results'])
+            pages += 1
+            if body['next_cursor'] is None:
+                return results, pages
+            payload = dict(payload, cursor=body['next_cursor'])
+
+    def test_zip_data(self):
+        """Test that every measure for a ZIP matches the single-measure endpoint"""
+        for use_engine in (True, False):
+            app.config['USE_LOOKUP_ENGINE'] = use_engine
+            response = self.client.post('/zip_data', json={'zip': '39401'})
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()['data']
+            self.assertEqual(set(data), VALID_MEASURES)
+            for measure_name, records in data.items():
+                single = self.client.post('/county_data', json={'zip': '39401', 'measure_name': measure_name})
+                self.assertEqual(records, single.get_json())
+
+    def test_zip_data_errors(self):
+        self.assertEqual(self.client.post('/zip_data', json={'zip': '00000'}).status_code, 404)
+        self.assertEqual(self.client.post('/zip_data', json={'zip': '0213'}).status_code, 400)
+        self.assertEqual(self.client.post('/zip_data', json={}).status_code, 400)
+        self.assertEqual(self.client.post('/zip_data', json={'coffee': 'teapot'}).status_code, 418)
+
+    def test_county_zips(self):
+        """Test that paging through a county's ZIPs returns each ZIP once, in order"""
+        with open('../zip_county.csv', encoding='utf-8-sig', newline='') as f:
+            expected = sorted(row['zip'] for row in csv.DictReader(f) if row['county_code'] == '25017')
+        results, pages = self.pages('/county_zips', {'fips': '25017', 'limit': 20})
+        self.assertEqual([row['zip'] for row in results], expected)
+        self.assertEqual(pages, len(expected) // 20 + 1)
+        self.assertEqual(results[0]['state_abbreviation'], 'MA')
+
+    def test_state_data(self):
+        """Test that small pages add up to the same records as one large page"""
+        payload = {'state': 'MA', 'measure_name': 'Adult obesity'}
+        everything, pages = self.pages('/state_data', dict(payload, limit=5000))
+        self.assertEqual(pages, 1)
+        paged, pages = self.pages('/state_data', dict(payload, limit=3))
+        self.assertEqual(paged, everything)
+        self.assertGreater(pages, 1)
+        self.assertTrue(all(record['state'] == 'MA' and record['county_code'] != '0' for record in paged))
+        self.assertIn('Middlesex County', {record['county'] for record in paged})
+
+    def test_state_data_errors(self):
+        post = lambda payload: self.client.post('/state_data', json=payload).status_code
+        self.assertEqual(post({'state': 'MA'}), 400)
+        self.assertEqual(post({'state': 'Massachusetts', 'measure_name': 'Adult obesity'}), 400)
+        self.assertEqual(post({'state': 'MA', 'measure_name': 'NonexistentMeasure'}), 404)
+        self.assertEqual(post({'state': 'MA', 'measure_name': ['Adult obesity']}), 400)
+        self.assertEqual(post({'state': 'MA', 'measure_name': {'name': 'Adult obesity'}}), 400)
+        self.assertEqual(post({'state': 'ZZ', 'measure_name': 'Adult obesity'}), 404)
+        self.assertEqual(post({'state': 'MA', 'measure_name': 'Adult obesity', 'limit': 0}), 400)
+        self.assertEqual(post({'state': 'MA', 'measure_name': 'Adult obesity', 'cursor': 'not a cursor'}), 400)
+        # A county_zips cursor is not a state_data cursor
+        cursor = self.client.post('/county_zips', json={'fips': '25017', 'limit': 1}).get_json()['next_cursor']
+        self.assertEqual(post({'state': 'MA', 'measure_name': 'Adult obesity', 'cursor': cursor}), 400)
+
+class TestStreamingAPI(unittest.TestCase):
+    """NDJSON streaming against a large synthetic database"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        cls.client = app.test_client()
+        cls.tmp_dir = tempfile.mkdtemp()
+        health_csv = os.path.join(cls.tmp_dir, 'county_health_rankings.csv')
+        cls.db_path = os.path.join(cls.tmp_dir, 'health_data.db')
+        synthetic_data.write_health_rankings_csv(health_csv, '../zip_county.csv', years=(2021, 2022, 2023))
+        prepare_db.prepare_databases(cls.db_path, health_csv, '../zip_county.csv')
+        with open('../zip_county.csv', encoding='utf-8-sig', newline='') as f:
+            cls.zips = list(dict.fromkeys(row['zip'] for row in csv.DictReader(f)))
+        cls.default_db_path = app.config['DATABASE_PATH']
+        app.config['DATABASE_PATH'] = cls.db_path
+
+    @classmethod
+    def tearDownClass(cls):
+        app.config['DATABASE_PATH'] = cls.default_db_path
+        shutil.rmtree(cls.tmp_dir)
+
+    def tearDown(self):
+        app.config['USE_LOOKUP_ENGINE'] = True
+
+    def stream_batch(self, zips):
+        """Consume a streamed batch chunk by chunk; return (peak bytes allocated, body bytes)"""
+        tracemalloc.start()
+        try:
+            response = self.client.post(
+                '/county_data/batch?stream=1',
+                json={'zips': zips, 'measure_names': sorted(VALID_MEASURES), 'years': 'all'},
+                buffered=False
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            size = 0
+            for chunk in response.response:
+                size += len(chunk)
+            response.close()
+            return tracemalloc.get_traced_memory()[1], size
+        finally:
+            tracemalloc.stop()
+
+    def test_memory_stays_flat(self):
+        """Test that peak memory does not grow with the streamed result size"""
+        app.config['USE_LOOKUP_ENGINE'] = False
+        small_peak, small_size = self.stream_batch(self.zips[::400])
+        large_peak, large_size = self.stream_batch(self.zips[::50])
+        self.assertGreater(large_size, small_size * 6)
+        self.assertLess(large_peak, small_peak * 3)
+        self.assertLess(large_peak, large_size / 20)
+
+    def test_stream_matches_json(self):
+        """Test that streamed lines carry the same records as the JSON response"""
+        zips = ['02138', '39401', '00000', '123']
+        measure_names = ['Adult obesity', 'NonexistentMeasure']
+        for use_engine in (True, False):
+            app.config['USE_LOOKUP_ENGINE'] = use_engine
+            payload = {'zips': zips, 'measure_names': measure_names}
+            results = self.client.post('/county_data/batch', json=payload).get_json()['results']
+            response = self.client.post('/county_data/batch', json=payload,
+                                        headers={'Accept': 'application/x-ndjson'})
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+            records = [line for line in lines if 'error' not in line]
+            expected = [dict(record, zip=zip_code)
+                        for zip_code in sorted(zips) if 'data' in results[zip_code]
+                        for record_list in results[zip_code]['data'].values()
+                        for record in record_list]
+            self.assertEqual(sorted(map(json.dumps, records)), sorted(map(json.dumps, expected)))
+
+            errors = {(line['zip'], line.get('measure_name')): line['status']
+                      for line in lines if 'error' in line}
+            self.assertEqual(errors[('123', None)], 400)
+            self.assertEqual(errors[('00000', 'Adult obesity')], 404)
+            self.assertEqual(errors[('02138', 'NonexistentMeasure')], 404)
+
+    def test_single_request_stream(self):
+        for use_engine in (True, False):
+            app.config['USE_LOOKUP_ENGINE'] = use_engine
+            payload = {'zip': '39401', 'measure_name': 'Adult obesity'}
+            expected = self.client.post('/county_data', json=payload).get_json()
+            response = self.client.post('/county_data?stream=1', json=payload)
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+            self.assertEqual(lines, expected)
+
+            response = self.client.post('/county_data?stream=1', json={'zip': '00000', 'measure_name': 'Adult obesity'})
+            self.assertEqual(response.status_code, 404)
+
+class TestReleaseYears(unittest.TestCase):
+    """Release year selection and the series format against a three-year database"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        cls.client = app.test_client()
+        cls.tmp_dir = tempfile.mkdtemp()
+        health_csv = os.path.join(cls.tmp_dir, 'county_health_rankings.csv')
+        cls.db_path = os.path.join(cls.tmp_dir, 'health_data.db')
+        synthetic_data.write_health_rankings_csv(health_csv, '../zip_county.csv', years=(2021, 2022, 2023))
+        prepare_db.prepare_databases(cls.db_path, health_csv, '../zip_county.csv')
+        cls.default_db_path = app.config['DATABASE_PATH']
+        app.config['DATABASE_PATH'] = cls.db_path
+
+    @classmethod
+    def tearDownClass(cls):
+        app.config['DATABASE_PATH'] = cls.default_db_path
+        app.config['SNAPSHOT_PATH'] = None
+        shutil.rmtree(cls.tmp_dir)
+
+    def tearDown(self):
+        app.config['USE_LOOKUP_ENGINE'] = True
+        app.config['SNAPSHOT_PATH'] = None
+
+    def post(self, payload, query=''):
+        return self.client.post('/county_data' + query,
+                                json=dict({'zip': '39401', 'measure_name': 'Adult obesity'}, **payload))
+
+    def each_source(self):
+        """Run the loop body against the engine, SQLite and a snapshot"""
+        snapshot_path = os.path.join(self.tmp_dir, 'health_data.snap')
+        app_module.snapshot.export_snapshot(self.db_path, snapshot_path)
+        for use_engine, snapshot_path in ((True, None), (False, None), (True, snapshot_path)):
+            app.config['USE_LOOKUP_ENGINE'] = use_engine
+            app.config['SNAPSHOT_PATH'] = snapshot_path
+            yield
+
+    def years_by_county(self, records):
+        counties = {}
+        for record in records:
+            counties.setdefault(record['fipscode'], []).append(record['data_release_year'])
+        return counties
+
+    def test_latest_by_default(self):
+        for _ in self.each_source():
+            records = self.post({}).get_json()
+            counties = self.years_by_county(records)
+            self.assertGreater(len(counties), 1)
+            self.assertTrue(all(years == ['2023'] for years in counties.values()))
+            self.assertEqual(self.post({'years': 'latest'}).get_json(), records)
+            self.assertEqual(self.post({'years': 2023}).get_json(), records)
+
+    def test_year_ranges(self):
+        """Test that every source returns the same years, oldest first within each county"""
+        expected = {}
+        for _ in self.each_source():
+            for years, county_years in ((['2021-2022', [2021, 2022]], ['2021', '2022']),
+                                        (['all', '2020-2030', [2021, 2023]], ['2021', '2022', '2023']),
+                                        (['2022'], ['2022']),
+                                        (['2024-2030'], None)):
+                responses = [self.post({'years': value}) for value in years]
+                if county_years is None:
+                    self.assertEqual({r.status_code for r in responses}, {404})
+                    continue
+                records = responses[0].get_json()
+                self.assertTrue(all(r.get_json() == records for r in responses), years)
+                self.assertTrue(all(found == county_years for found in self.years_by_county(records).values()))
+                self.assertEqual(expected.setdefault(years[0], records), records)
+
+    def test_series(self):
+        records = self.post({'years': 'all'}).get_json()
+        for _ in self.each_source():
+            response = self.post({}, '?format=series')
+            self.assertEqual(response.status_code, 200)
+            body = response.get_json()
+            self.assertEqual((body['zip'], body['measure_name']), ('39401', 'Adult obesity'))
+            self.assertEqual(len(body['counties']), len(self.years_by_county(records)))
+            for county in body['counties']:
+                county_records = [r for r in records if r['fipscode'] == county['fipscode']]
+                self.assertEqual(county['data_release_year'], ['2021', '2022', '2023'])
+                self.assertEqual(county['raw_value'], [r['raw_value'] for r in county_records])
+                self.assertEqual(county['county'], county_records[-1]['county'])
+                self.assertNotIn('measure_name', county)
+
+            latest = self.post({'years': 'latest'}, '?format=series').get_json()
+            self.assertTrue(all(county['data_release_year'] == ['2023'] for county in latest['counties']))
+            self.assertEqual(self.post({'zip': '00000'}, '?format=series').status_code, 404)
+
+    def test_invalid_years(self):
+        for years in ('yesterday', '2021-', [2023, 2021], [2021], True, 21, {'from': 2021}):
+            response = self.post({'years': years})
+            self.assertEqual(response.status_code, 400, years)
+            self.assertIn('Invalid years', response.get_json()['error'])
+        self.assertEqual(self.post({}, '?format=table').status_code, 400)
+        self.assertEqual(self.post({'years': 'all'}, '?aggregate=weighted').status_code, 400)
+        self.assertEqual(self.post({}, '?aggregate=weighted&format=series').status_code, 400)
+        self.assertEqual(self.post({'years': 'latest'}, '?aggregate=weighted').status_code, 200)
+        for url, payload in (('/zip_data', {'zip': '39401'}),
+                             ('/state_data', {'state': 'MA', 'measure_name': 'Adult obesity'}),
+                             ('/county_data/batch', {'zips': ['39401'], 'measure_names': ['Adult obesity']})):
+            self.assertEqual(self.client.post(url, json=dict(payload, years='soon')).status_code, 400, url)
+
+    def test_other_endpoints(self):
+        """Test that /zip_data, /county_data/batch and /state_data select years the same way"""
+        for years in ('latest', '2021-2022'):
+            single = self.post({'years': years}).get_json()
+            for use_engine in (True, False):
+                app.config['USE_LOOKUP_ENGINE'] = use_engine
+                zip_data = self.client.post('/zip_data', json={'zip': '39401', 'years': years}).get_json()
+                self.assertEqual(zip_data['data']['Adult obesity'], single)
+                batch = self.client.post('/county_data/batch', json={
+                    'zips': ['39401'], 'measure_names': ['Adult obesity'], 'years': years}).get_json()
+                self.assertEqual(batch['results']['39401']['data']['Adult obesity'], single)
+
+        payload = {'state': 'MA', 'measure_name': 'Adult obesity', 'years': 'all'}
+        everything = self.client.post('/state_data', json=dict(payload, limit=5000)).get_json()['results']
+        paged = []
+        while True:
+            body = self.client.post('/state_data', json=dict(payload, limit=7)).get_json()
+            paged.extend(body['results'])
+            if body['next_cursor'] is None:
+                break
+            payload['cursor'] = body['next_cursor']
+        self.assertEqual(paged, everything)
+        latest = self.client.post('/state_data', json={'state': 'MA', 'measure_name': 'Adult obesity',
+                                                       'limit': 5000}).get_json()['results']
+        self.assertEqual(len(everything), 3 * len(latest))
+        self.assertEqual({record['data_release_year'] for record in latest}, {'2023'})
+
+class TestNearestZipFallback(unittest.TestCase):
+    """The opt-in ?fallback=nearest lookup for ZIPs missing from zip_county"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        cls.client = app.test_client()
+        if not os.path.exists('health_data.db'):
+            subprocess.run(['python3', 'prepare_db.py'], check=True)
+
+    def tearDown(self):
+        app.config['USE_LOOKUP_ENGINE'] = True
+
+    def post(self, zip_code, query='?fallback=nearest', **payload):
+        return self.client.post('/county_data' + query,
+                                json=dict({'zip': zip_code, 'measure_name': 'Adult obesity'}, **payload))
+
+    def test_nearest_neighbor(self):
+        """Test that unknown ZIPs resolve to the closest known ZIP with the same prefix"""
+        # 02146 and 02147 are unassigned; 02145 and 02148 are their neighbors
+        for use_engine in (True, False):
+            app.config['USE_LOOKUP_ENGINE'] = use_engine
+            for zip_code, resolved_zip, distance in (('02146', '02145', 1), ('02147', '02148', 1),
+                                                     ('00502', '00501', 1)):
+                self.assertEqual(self.post(zip_code, query='').status_code, 404)
+                response = self.post(zip_code)
+                self.assertEqual(response.status_code, 200, zip_code)
+                body = response.get_json()
+                self.assertEqual((body['zip'], body['resolved_zip']), (zip_code, resolved_zip))
+                self.assertEqual(body['fallback']['method'], 'nearest')
+                self.assertEqual(body['fallback']['distance'], distance)
+                self.assertEqual(body['fallback']['default_state'], 'MA' if resolved_zip != '00501' else 'NY')
+                self.assertEqual(body['data'], self.post(resolved_zip, query='').get_json())
+
+    def test_known_zip(self):
+        """Test that a known ZIP resolves to itself with no fallback"""
+        for use_engine in (True, False):
+            app.config['USE_LOOKUP_ENGINE'] = use_engine
+            body = self.post('02138').get_json()
+            self.assertEqual((body['resolved_zip'], body['fallback']), ('02138', None))
+            self.assertEqual(body['data'], self.post('02138', query='').get_json())
+
+    def test_empty_prefix(self):
+        """Test that a ZIP with no known neighbor sharing its prefix resolves to the nearest ZIP overall"""
+        # No known ZIP starts 000 or 001; 00501 is the lowest known ZIP and 99929 the highest
+        for use_engine in (True, False):
+            app.config['USE_LOOKUP_ENGINE'] = use_engine
+            for zip_code, resolved_zip, distance in (('00000', '00501', 501), ('00100', '00501', 401),
+                                                     ('99999', '99929', 70)):
+                body = self.post(zip_code).get_json()
+                self.assertEqual(body['resolved_zip'], resolved_zip, (use_engine, zip_code))
+                self.assertEqual(body['fallback']['distance'], distance)
+                self.assertEqual(body['data'], self.post(resolved_zip, query='').get_json())
+
+    def test_with_other_options(self):
+        """Test that the fallback composes with years, series and aggregate, and rejects unknown modes"""
+        series = self.post('02146', query='?fallback=nearest&format=series').get_json()
+        self.assertEqual(series['data']['zip'], '02145')
+        weighted = self.post('02146', query='?fallback=nearest&aggregate=weighted').get_json()
+        self.assertEqual(weighted['data'], self.post('02145', query='?aggregate=weighted').get_json())
+        self.assertEqual(self.post('02146', query='?fallback=closest').status_code, 400)
+        response = self.post('02146', query='?fallback=nearest&stream=1')
+        self.assertEqual(response.mimetype, 'application/json')
+
+class TestResponseEncoding(unittest.TestCase):
+    """The columns shape, MessagePack bodies and gzip/deflate compression"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        cls.client = app.test_client()
+        if not os.path.exists('health_data.db'):
+            subprocess.run(['python3', 'prepare_db.py'], check=True)
+
+    def tearDown(self):
+        app.config['USE_LOOKUP_ENGINE'] = True
+        app.config['COMPRESS_MIN_SIZE'] = app_module.COMPRESS_MIN_SIZE
+
+    def post(self, query='', headers=None, **payload):
+        return self.client.post('/county_data' + query, headers=headers,
+                                json=dict({'zip': '39401', 'measure_name': 'Adult obesity'}, **payload))
+
+    def test_columns(self):
+        for use_engine in (True, False):
+            app.config['USE_LOOKUP_ENGINE'] = use_engine
+            records = self.post(years='all').get_json()
+            body = self.post('?format=columns', years='all').get_json()
+            self.assertEqual(body['fields'], sorted(records[0]))
+            self.assertEqual([dict(zip(body['fields'], row)) for row in body['rows']], records)
+            weighted = self.post('?aggregate=weighted&format=columns').get_json()
+            self.assertEqual([dict(zip(weighted['fields'], row)) for row in weighted['rows']],
+                             [self.post('?aggregate=weighted').get_json()])
+            self.assertEqual(self.post('?format=columns', zip='00000').status_code, 404)
+
+    def test_msgpack(self):
+        msgpack = {'Accept': 'application/msgpack'}
+        for query in ('', '?format=series', '?format=columns', '?aggregate=weighted', '?fallback=nearest'):
+            response = self.post(query, headers=msgpack)
+            self.assertEqual(response.status_code, 200, query)
+            self.assertEqual(response.mimetype, 'application/msgpack', query)
+            self.assertEqual(msgpack_lite.unpackb(response.data), self.post(query).get_json(), query)
+            self.assertNotEqual(response.headers['ETag'], self.post(query).headers['ETag'])
+
+        # JSON stays the default, and errors are always JSON
+        self.assertEqual(self.post(headers={'Accept': 'application/json, application/msgpack;q=0.5'}).mimetype,
+                         'application/json')
+        response = self.post(headers=msgpack, zip='00000')
+        self.assertEqual((response.status_code, response.mimetype), (404, 'application/json'))
+
+        # Shared caches must key on Accept as well as Accept-Encoding
+        for response in (self.post(), self.post(headers=msgpack),
+                         self.client.post('/county_data/batch', json={'zips': ['02138'], 'measure_names': ['Unemployment']},
+                                          headers=msgpack)):
+            self.assertEqual(response.headers['Vary'], 'Accept-Encoding, Accept')
+        # Streamed NDJSON is never compressed, so only Accept picks it
+        self.assertEqual(self.post(headers={'Accept': 'application/x-ndjson'}).headers['Vary'], 'Accept')
+        self.assertNotIn('Accept', self.client.post('/zip_data', json={'zip': '02138'}).vary)
+
+    def test_compression(self):
+        """Test that bodies above the threshold are compressed as Accept-Encoding allows"""
+        expected = self.client.post('/zip_data', json={'zip': '02138'}).data
+        self.assertGreater(len(expected), app_module.COMPRESS_MIN_SIZE)
+        for accept, coding, decompress in (('gzip', 'gzip', gzip.decompress),
+                                           ('deflate', 'deflate', zlib.decompress),
+                                           ('deflate;q=0.5, gzip', 'gzip', gzip.decompress),
+                                           ('br', None, bytes), ('gzip;q=0', None, bytes)):
+            response = self.client.post('/zip_data', json={'zip': '02138'}, headers={'Accept-Encoding': accept})
+            self.assertEqual(response.headers.get('Content-Encoding'), coding, accept)
+            self.assertIn('Accept-Encoding', response.headers['Vary'])
+            self.assertEqual(decompress(response.data), expected, accept)
+            if coding:
+                self.assertLess(len(response.data), len(expected) / 4)
+
+        # Small bodies and errors are sent as is
+        small = self.post(headers={'Accept-Encoding': 'gzip'}, zip='02138')
+        self.assertLess(len(small.data), app_module.COMPRESS_MIN_SIZE)
+        self.assertNotIn('Content-Encoding', small.headers)
+        app.config['COMPRESS_MIN_SIZE'] = 0
+        self.assertNotIn('Content-Encoding', self.post(headers={'Accept-Encoding': 'gzip'}, zip='00000').headers)
+        app.config['COMPRESS_MIN_SIZE'] = None
+        self.assertNotIn('Content-Encoding', self.client.post('/zip_data', json={'zip': '02138'},
+                                                              headers={'Accept-Encoding': 'gzip'}).headers)
+
+    def test_compressed_etag(self):
+        """Test that a compressed response has a weak ETag that still revalidates"""
+        app.config['COMPRESS_MIN_SIZE'] = 0
+        plain = self.post()
+        compressed = self.post(headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed.headers['ETag'], 'W/' + plain.headers['ETag'])
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        for etag in (plain.headers['ETag'], compressed.headers['ETag']):
+            response = self.post(headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304, etag)
+
+    def test_batch(self):
+        payload = {'zips': ['39401', '02138', '00000'], 'measure_names': ['Adult obesity', 'Unemployment']}
+        records = self.client.post('/county_data/batch', json=payload).get_json()
+        columns = self.client.post('/county_data/batch?format=columns', json=payload).get_json()
+        self.assertEqual(columns['fields'], list(app_module.lookup.RECORD_FIELDS))
+        self.assertNotIn('fields', records)
+        for zip_code, entry in records['results'].items():
+            self.assertEqual(columns['results'][zip_code]['errors'], entry['errors'])
+            for measure_name, expected in entry['data'].items():
+                rows = columns['results'][zip_code]['data'][measure_name]
+                self.assertEqual([dict(zip(columns['fields'], row)) for row in rows], expected)
+
+        response = self.client.post('/county_data/batch?format=columns', json=payload,
+                                    headers={'Accept': 'application/msgpack'})
+        self.assertEqual(response.mimetype, 'application/msgpack')
+        self.assertEqual(msgpack_lite.unpackb(response.data), columns)
+        self.assertEqual(self.client.post('/county_data/batch?format=series', json=payload).status_code, 400)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import threading
+import time
+import unittest
+from urllib.parse import urlsplit
+
+from werkzeug.datastructures import Headers
+
+import app as app_module
+import asgi_app
+import test_api
+from app import app
+
+
+class AsgiResponse:
+    """The parts of Flask's test response the API tests use"""
+
+    def __init__(self, status_code, headers, data):
+        self.status_code = status_code
+        self.headers = headers
+        self.data = data
+
+    def get_json(self):
+        return json.loads(self.data)
+
+
+class AsgiTestClient:
+    """Drive an ASGI app in-process with the same calls as Flask's test client"""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def request(self, method, url, json=None, headers=None, data=None, content_type=None):
+        parts = urlsplit(url)
+        body = data.encode('utf-8') if data is not None else b''
+        request_headers = dict(headers or {})
+        if content_type is not None:
+            request_headers.setdefault('Content-Type', content_type)
+        if json is not None:
+            body = encode_json(json)
+            request_headers.setdefault('Content-Type', 'application/json')
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': parts.path,
+            'query_string': parts.query.encode('latin-1'),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in request_headers.items()]
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        await self.application(scope, receive, send)
+        start, response_body = sent[0], sent[1]
+        response_headers = Headers([(name.decode('latin-1'), value.decode('latin-1'))
+                                    for name, value in start['headers']])
+        return AsgiResponse(start['status'], response_headers, response_body['body'])
+
+    def get(self, url, **kwargs):
+        return asyncio.run(self.request('GET', url, **kwargs))
+
+    def post(self, url, **kwargs):
+        return asyncio.run(self.request('POST', url, **kwargs))
+
+
+def encode_json(payload):
+    return json.dumps(payload).encode('utf-8')
+
+
+class TestCountyDataASGI(test_api.TestCountyDataAPI):
+    """Every /county_data contract test, run against the ASGI app"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        cls.client = AsgiTestClient(asgi_app.CountyDataApp())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.application.close()
+
+    def test_same_responses_as_flask(self):
+        """Test that both apps return byte-identical bodies and the same status codes"""
+        flask_client = app.test_client()
+        for payload in ({'zip': '02138', 'measure_name': 'Adult obesity'},
+                        {'zip': '35203', 'measure_name': 'Unemployment'},
+                        {'zip': '00000', 'measure_name': 'Adult obesity'},
+                        {'zip': '0213', 'measure_name': 'Adult obesity'},
+                        {'zip': '02138', 'measure_name': 'NonexistentMeasure'},
+                        {'zip': '02138'},
+                        {'coffee': 'teapot'}):
+            expected = flask_client.post('/county_data', json=payload)
+            actual = self.client.post('/county_data', json=payload)
+            self.assertEqual(actual.status_code, expected.status_code, payload)
+            self.assertEqual(actual.data, expected.data, payload)
+
+        # Bodies that are JSON but not an object
+        for body in ('[]', '"x"', '5', 'null'):
+            expected = flask_client.post('/county_data', data=body, content_type='application/json')
+            actual = self.client.post('/county_data', data=body, content_type='application/json')
+            self.assertEqual(expected.status_code, 400, body)
+            self.assertEqual(actual.status_code, expected.status_code, body)
+            self.assertEqual(actual.data, expected.data, body)
+
+        payload = {'zip': '02146', 'measure_name': 'Adult obesity'}
+        for url in ('/county_data?fallback=nearest', '/county_data?fallback=closest'):
+            expected = flask_client.post(url, json=payload)
+            actual = self.client.post(url, json=payload)
+            self.assertEqual(actual.status_code, expected.status_code, url)
+            self.assertEqual(actual.data, expected.data, url)
+
+    def test_negotiation_matches_flask(self):
+        """Test that formats, MessagePack and compression are negotiated as Flask does"""
+        flask_client = app.test_client()
+        payload = {'zip': '39401', 'measure_name': 'Adult obesity'}
+        app.config['COMPRESS_MIN_SIZE'] = 0
+        try:
+            for url, headers in (('/county_data?format=columns', {}),
+                                 ('/county_data', {'Accept': 'application/msgpack'}),
+                                 ('/county_data?format=series', {'Accept-Encoding': 'gzip'}),
+                                 ('/county_data', {'Accept': 'application/msgpack', 'Accept-Encoding': 'deflate'}),
+                                 ('/county_data?format=table', {})):
+                expected = flask_client.post(url, json=payload, headers=headers)
+                actual = self.client.post(url, json=payload, headers=headers)
+                self.assertEqual(actual.status_code, expected.status_code, (url, headers))
+                self.assertEqual(actual.data, expected.data, (url, headers))
+                for header in ('Content-Type', 'Content-Encoding', 'ETag', 'Vary'):
+                    if header != 'Vary' or expected.status_code == 200:
+                        self.assertEqual(actual.headers.get(header), expected.headers.get(header), (url, header))
+        finally:
+            app.config['COMPRESS_MIN_SIZE'] = app_module.COMPRESS_MIN_SIZE
+
+    def test_content_type_required(self):
+        response = self.client.post('/county_data', headers={'Content-Type': 'text/plain'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_etag_not_modified(self):
+        payload = {'zip': '02138', 'measure_name': 'Adult obesity'}
+        first = self.client.post('/county_data', json=payload)
+        self.assertEqual(first.headers['ETag'], app.test_client().post('/county_data', json=payload).headers['ETag'])
+        second = self.client.post('/county_data', json=payload, headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b'')
+
+
+class TestLifespan(unittest.TestCase):
+    def test_startup_loads_engine(self):
+        """Test that the engine is loaded at startup rather than by the first request"""
+        app_module.lookup.clear_engines()
+        application = asgi_app.CountyDataApp()
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            if messages[0]['type'] == 'lifespan.shutdown':
+                # The engine is in place before startup completes
+                self.assertEqual(sent, [{'type': 'lifespan.startup.complete'}])
+                self.assertIn(app.config['DATABASE_PATH'], app_module.lookup._engines)
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(application({'type': 'lifespan'}, receive, send))
+        self.assertEqual([message['type'] for message in sent],
+                         ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+
+class TestCoalescing(unittest.TestCase):
+    def setUp(self):
+        app.config['RESPONSE_CACHE_SIZE'] = 0
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+        self.render = app_module.render_county_data
+        app_module.render_county_data = self.slow_render
+
+    def tearDown(self):
+        app_module.render_county_data = self.render
+        app.config['RESPONSE_CACHE_SIZE'] = app_module.RESPONSE_CACHE_SIZE
+
+    def slow_render(self, *args):
+        with self.lock:
+            self.calls.append(args)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.1)
+        try:
+            return self.render(*args)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def run_concurrently(self, application, payloads):
+        client = AsgiTestClient(application)
+
+        async def run():
+            return await asyncio.gather(*(client.request('POST', '/county_data', json=payload)
+                                          for payload in payloads))
+        try:
+            return asyncio.run(run())
+        finally:
+            application.close()
+
+    def test_identical_requests_share_one_lookup(self):
+        application = asgi_app.CountyDataApp()
+        payload = {'zip': '02138', 'measure_name': 'Adult obesity'}
+        responses = self.run_concurrently(application, [payload] * 20)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual({(r.status_code, r.data) for r in responses}, {(200, responses[0].data)})
+        stats = application.stats()
+        self.assertEqual((stats['lookups'], stats['coalesced'], stats['in_flight']), (1, 19, 0))
+
+    def test_executor_is_bounded(self):
+        """Test that distinct lookups never run on more threads than max_workers"""
+        application = asgi_app.CountyDataApp(max_workers=2)
+        measures = sorted(app_module.VALID_MEASURES)[:6]
+        responses = self.run_concurrently(application, [{'zip': '02138', 'measure_name': m} for m in measures])
+        self.assertEqual(len(self.calls), 6)
+        self.assertEqual(self.max_running, 2)
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import app as app_module
+import prepare_db
+import synthetic_data
+from app import app
+from cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first"""
+        cache = ResponseCache(max_entries=2)
+        cache.put('a', 1, 'A')
+        cache.put('b', 1, 'B')
+        self.assertEqual(cache.get('a', 1), 'A')
+        cache.put('c', 1, 'C')
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual(cache.get('a', 1), 'A')
+        self.assertEqual(cache.get('c', 1), 'C')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl_expiry(self):
+        cache = ResponseCache(ttl=0.05)
+        cache.put('a', 1, 'A')
+        self.assertEqual(cache.get('a', 1), 'A')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a', 1))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_version_invalidation(self):
+        """Test that a new database version drops every entry"""
+        cache = ResponseCache()
+        cache.put('a', 1, 'A')
+        cache.put('b', 1, 'B')
+        self.assertIsNone(cache.get('a', 2))
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    def test_counters(self):
+        cache = ResponseCache()
+        cache.get('a', 1)
+        cache.put('a', 1, 'A')
+        cache.get('a', 1)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+
+class TestCachedCountyData(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        cls.client = app.test_client()
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.health_csv = os.path.join(cls.tmp_dir, 'county_health_rankings.csv')
+        cls.db_path = os.path.join(cls.tmp_dir, 'health_data.db')
+        synthetic_data.write_health_rankings_csv(cls.health_csv, '../zip_county.csv')
+        prepare_db.prepare_databases(cls.db_path, cls.health_csv, '../zip_county.csv')
+        app.config['DATABASE_PATH'] = cls.db_path
+
+    @classmethod
+    def tearDownClass(cls):
+        app.config['DATABASE_PATH'] = app_module.DATABASE_PATH
+        shutil.rmtree(cls.tmp_dir)
+
+    def setUp(self):
+        app.extensions.pop('response_cache', None)
+
+    def post(self, payload, **kwargs):
+        return self.client.post('/county_data', json=payload, **kwargs)
+
+    def test_hits_and_misses(self):
+        payload = {'zip': '02138', 'measure_name': 'Adult obesity'}
+        first = self.post(payload)
+        second = self.post(payload)
+        self.assertEqual(first.data, second.data)
+        stats = self.client.get('/health').get_json()['cache']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_not_found_is_cached(self):
+        payload = {'zip': '00000', 'measure_name': 'Adult obesity'}
+        self.assertEqual(self.post(payload).status_code, 404)
+        self.assertEqual(self.post(payload).status_code, 404)
+        self.assertEqual(app_module.get_response_cache().stats()['hits'], 1)
+
+    def test_etag_not_modified(self):
+        """Test that a matching If-None-Match gets a 304 without a body"""
+        payload = {'zip': '02138', 'measure_name': 'Unemployment'}
+        first = self.post(payload)
+        etag = first.headers['ETag']
+        second = self.post(payload, headers={'If-None-Match': etag})
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b'')
+        self.assertEqual(second.headers['ETag'], etag)
+
+        third = self.post(payload, headers={'If-None-Match': '"stale"'})
+        self.assertEqual(third.status_code, 200)
+        self.assertEqual(third.data, first.data)
+
+    def test_rebuild_invalidates(self):
+        """Test that rerunning prepare_db.py invalidates cached responses"""
+        payload = {'zip': '02138', 'measure_name': 'Adult obesity'}
+        before = self.post(payload)
+        synthetic_data.write_health_rankings_csv(self.health_csv, '../zip_county.csv', seed=1)
+        prepare_db.prepare_databases(self.db_path, self.health_csv, '../zip_county.csv')
+        after = self.post(payload)
+        self.assertNotEqual(before.headers['ETag'], after.headers['ETag'])
+        self.assertNotEqual(before.data, after.data)
+        stats = app_module.get_response_cache().stats()
+        self.assertEqual(stats['invalidations'], 1)
+        self.assertEqual(stats['hits'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
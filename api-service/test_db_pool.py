@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import db_pool
+from app import app
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'pool.db')
+        self.write_database(1)
+        self.pool = db_pool.ConnectionPool(self.db_path)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def write_database(self, value):
+        """Rebuild the test database by swapping in a new file"""
+        tmp_path = self.db_path + '.tmp'
+        conn = sqlite3.connect(tmp_path)
+        conn.execute("CREATE TABLE t (value)")
+        conn.execute("INSERT INTO t VALUES (?)", (value,))
+        conn.commit()
+        conn.close()
+        os.replace(tmp_path, self.db_path)
+
+    def test_reuses_connections(self):
+        """Test that released connections are handed out again"""
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.assertIs(self.pool.acquire(), conn)
+        stats = self.pool.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['open'], 1)
+
+    def test_read_only(self):
+        """Test that pooled connections cannot write"""
+        conn = self.pool.acquire()
+        with self.assertRaises(sqlite3.Error):
+            conn.execute("INSERT INTO t VALUES (2)")
+        self.pool.release(conn)
+
+    def test_rows_by_name(self):
+        conn = self.pool.acquire()
+        self.assertEqual(conn.execute("SELECT value FROM t").fetchone()['value'], 1)
+        self.pool.release(conn)
+
+    def test_reopens_after_rebuild(self):
+        """Test that a rebuilt database file is picked up"""
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.write_database(2)
+        conn = self.pool.acquire()
+        self.assertEqual(conn.execute("SELECT value FROM t").fetchone()[0], 2)
+        self.pool.release(conn)
+        self.assertEqual(self.pool.stats()['reopens'], 1)
+        self.assertEqual(self.pool.stats()['open'], 1)
+
+    def test_concurrent_checkout(self):
+        """Test that threads never share a checked out connection"""
+        in_use = set()
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(50):
+                conn = self.pool.acquire()
+                with lock:
+                    if id(conn) in in_use:
+                        errors.append('shared connection')
+                    in_use.add(id(conn))
+                conn.execute("SELECT value FROM t").fetchone()
+                with lock:
+                    in_use.discard(id(conn))
+                self.pool.release(conn)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(self.pool.stats()['open'], 8)
+
+    def test_missing_database(self):
+        pool = db_pool.ConnectionPool(os.path.join(self.tmp_dir, 'missing.db'))
+        with self.assertRaises(sqlite3.Error):
+            pool.acquire()
+
+
+class TestHealthEndpoint(unittest.TestCase):
+    def test_health_reports_pool_stats(self):
+        app.config['TESTING'] = True
+        response = app.test_client().get('/health')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['status'], 'ok')
+        for key in ('hits', 'misses', 'max_connection_age_seconds'):
+            self.assertIn(key, data['pool'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,59 @@ import json
 import time
 import sys
 
+# Request/expected status pairs, also replayed by bench_load.py as its error-path mix
+TEST_CASES = [
+    {
+        "name": "Valid Request - Adult obesity",
+        "payload": {
+            "zip": "02138",
+            "measure_name": "Adult obesity"
+        },
+        "expected_status": 200
+    },
+    {
+        "name": "Valid Request - Unemployment",
+        "payload": {
+            "zip": "02138",
+            "measure_name": "Unemployment"
+        },
+        "expected_status": 200
+    },
+    {
+        "name": "Easter Egg - Teapot",
+        "payload": {
+            "coffee": "teapot",
+            "zip": "02138",
+            "measure_name": "Adult obesity"
+        },
+        "expected_status": 418
+    },
+    {
+        "name": "Invalid ZIP Code",
+        "payload": {
+            "zip": "00000",
+            "measure_name": "Adult obesity"
+        },
+        "expected_status": 404
+    },
+    {
+        "name": "Invalid Measure",
+        "payload": {
+            "zip": "02138",
+            "measure_name": "NonexistentMeasure"
+        },
+        "expected_status": 404
+    },
+    {
+        "name": "Missing ZIP",
+        "payload": {
+            "measure_name": "Adult obesity"
+        },
+        "expected_status": 400
+    }
+]
+
+
 def test_api(base_url="http://localhost:9000"):
     """Test various API scenarios"""
     
@@ -11,59 +64,8 @@ def test_api(base_url="http://localhost:9000"):
         'Content-Type': 'application/json'
     }
     
-    test_cases = [
-        {
-            "name": "Valid Request - Adult obesity",
-            "payload": {
-                "zip": "02138",
-                "measure_name": "Adult obesity"
-            },
-            "expected_status": 200
-        },
-        {
-            "name": "Valid Request - Unemployment",
-            "payload": {
-                "zip": "02138",
-                "measure_name": "Unemployment"
-            },
-            "expected_status": 200
-        },
-        {
-            "name": "Easter Egg - Teapot",
-            "payload": {
-                "coffee": "teapot",
-                "zip": "02138",
-                "measure_name": "Adult obesity"
-            },
-            "expected_status": 418
-        },
-        {
-            "name": "Invalid ZIP Code",
-            "payload": {
-                "zip": "00000",
-                "measure_name": "Adult obesity"
-            },
-            "expected_status": 404
-        },
-        {
-            "name": "Invalid Measure",
-            "payload": {
-                "zip": "02138",
-                "measure_name": "NonexistentMeasure"
-            },
-            "expected_status": 404
-        },
-        {
-            "name": "Missing ZIP",
-            "payload": {
-                "measure_name": "Adult obesity"
-            },
-            "expected_status": 400
-        }
-    ]
-    
     results = []
-    for test in test_cases:
+    for test in TEST_CASES:
         print(f"\nTesting: {test['name']}")
         
         try:
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+import os
+import subprocess
+import unittest
+
+import app as app_module
+from app import app, VALID_MEASURES
+
+
+class TestLookupEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        # Compare the two paths directly, not through the response cache
+        app.config['RESPONSE_CACHE_SIZE'] = 0
+        cls.client = app.test_client()
+        if not os.path.exists('health_data.db'):
+            subprocess.run(['python3', 'prepare_db.py'], check=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.config['RESPONSE_CACHE_SIZE'] = app_module.RESPONSE_CACHE_SIZE
+
+    def tearDown(self):
+        app.config['USE_LOOKUP_ENGINE'] = True
+
+    def post_both(self, payload):
+        """POST the same payload through the engine and SQL paths"""
+        responses = []
+        for use_engine in (True, False):
+            app.config['USE_LOOKUP_ENGINE'] = use_engine
+            responses.append(self.client.post('/county_data', json=payload))
+        return responses
+
+    def test_identical_output(self):
+        """Test that the engine and SQL paths return the same records"""
+        zips = ['02138', '35203', '39401', '00501', '00601', '10001', '00000']
+        for zip_code in zips:
+            for measure_name in sorted(VALID_MEASURES):
+                payload = {'zip': zip_code, 'measure_name': measure_name}
+                engine_response, sql_response = self.post_both(payload)
+                self.assertEqual(engine_response.status_code, sql_response.status_code, payload)
+                self.assertEqual(engine_response.get_json(), sql_response.get_json(), payload)
+
+    def test_identical_errors(self):
+        """Test that validation errors do not depend on the path"""
+        payloads = [
+            {'zip': '02138'},
+            {'zip': '2138', 'measure_name': 'Adult obesity'},
+            {'zip': '02138', 'measure_name': 'NonexistentMeasure'},
+            {'coffee': 'teapot'}
+        ]
+        for payload in payloads:
+            engine_response, sql_response = self.post_both(payload)
+            self.assertEqual(engine_response.status_code, sql_response.status_code, payload)
+            self.assertEqual(engine_response.data, sql_response.data, payload)
+
+    def test_spliced_matches_jsonify(self):
+        """Test that responses spliced from record_json are byte-identical to jsonify's"""
+        for zip_code in ('02138', '35203', '39401', '00601'):
+            for measure_name in sorted(VALID_MEASURES):
+                with app.app_context():
+                    expected = app_module.jsonify(app_module.get_engine().lookup_dicts(zip_code, measure_name))
+                expected.add_etag()
+                for response in self.post_both({'zip': zip_code, 'measure_name': measure_name}):
+                    self.assertEqual(response.data, expected.get_data(), (zip_code, measure_name))
+                    self.assertEqual(response.headers['ETag'], expected.headers['ETag'])
+
+    def test_engine_without_record_json(self):
+        """Test that an engine built without stored fragments serializes its own"""
+        engine = app_module.get_engine()
+        rebuilt = app_module.lookup.LookupEngine(engine.zip_to_fips, engine.records)
+        self.assertEqual(rebuilt.lookup_json('39401', 'Adult obesity'), engine.lookup_json('39401', 'Adult obesity'))
+
+    def test_preload_engine(self):
+        """Test that the engine loaded at startup is the one requests use"""
+        app_module.lookup.clear_engines()
+        engine = app_module.preload_engine()
+        self.assertIsNotNone(engine)
+        with app.app_context():
+            self.assertIs(app_module.get_engine(), engine)
+
+        app.config['USE_LOOKUP_ENGINE'] = False
+        self.assertIsNone(app_module.preload_engine())
+
+    def test_year_slice(self):
+        years = (2021, 2022, 2022, 2023, 2023)
+        self.assertEqual(app_module.lookup.year_slice(years, 'latest'), (3, 5))
+        self.assertEqual(app_module.lookup.year_slice(years, (2022, 2022)), (1, 3))
+        self.assertEqual(app_module.lookup.year_slice(years, (2000, 2021)), (0, 1))
+        self.assertEqual(app_module.lookup.year_slice(years, (2024, 2030)), (5, 5))
+        self.assertEqual(app_module.lookup.year_slice((), 'latest'), (0, 0))
+
+    def test_nearest_in(self):
+        numbers = (100, 103, 107)
+        entries = (('00100',), ('00103',), ('00107',))
+        nearest_in = app_module.lookup.nearest_in
+        self.assertEqual(nearest_in(numbers, entries, 103), ('00103', 0))
+        self.assertEqual(nearest_in(numbers, entries, 105), ('00103', 2))
+        self.assertEqual(nearest_in(numbers, entries, 106), ('00107', 1))
+        self.assertEqual(nearest_in(numbers, entries, 50), ('00100', 50))
+        self.assertEqual(nearest_in(numbers, entries, 200), ('00107', 93))
+        self.assertIsNone(nearest_in((), (), 100))
+
+    def test_multi_county_zip(self):
+        """Test that a ZIP spanning several counties returns each county"""
+        engine = app_module.get_engine()
+        self.assertGreater(len(engine.zip_to_fips['39401']), 1)
+        records = engine.lookup_dicts('39401', 'Adult obesity')
+        self.assertEqual(len({record['county'] for record in records}),
+                         len(engine.zip_to_fips['39401']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import unittest
+
+import app as app_module
+import metrics
+from app import app
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_buckets(self):
+        histogram = metrics.Histogram(buckets=(0.001, 0.01))
+        for seconds in (0.0005, 0.001, 0.005, 0.5):
+            histogram.observe(seconds)
+        self.assertEqual(histogram.cumulative(), [('0.001', 2), ('0.01', 3), ('+Inf', 4)])
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 0.5065)
+
+    def test_render(self):
+        recorder = metrics.Metrics()
+        recorder.observe('query', 0.002)
+        recorder.count_request('county_data', 200, 'Adult "obesity"')
+        text = recorder.render()
+        self.assertIn('# TYPE health_api_stage_seconds histogram', text)
+        self.assertIn('health_api_stage_seconds_bucket{stage="query",le="0.0025"} 1', text)
+        self.assertIn('health_api_stage_seconds_bucket{stage="query",le="+Inf"} 1', text)
+        self.assertIn('health_api_stage_seconds_count{stage="query"} 1', text)
+        self.assertIn('health_api_requests_total{endpoint="county_data",status="200",'
+                      'measure_name="Adult \\"obesity\\""} 1', text)
+
+    def test_admission_counts(self):
+        recorder = metrics.Metrics()
+        recorder.count_admission('shed')
+        recorder.count_admission('shed')
+        self.assertEqual(recorder.admission_counts(), {'rate_limited': 0, 'shed': 2, 'deadline_exceeded': 0})
+        text = recorder.render()
+        self.assertIn('# TYPE health_api_admission_total counter', text)
+        self.assertIn('health_api_admission_total{outcome="shed"} 2', text)
+        self.assertIn('health_api_admission_total{outcome="rate_limited"} 0', text)
+
+    def test_span(self):
+        recorder = metrics.Metrics()
+        spans = []
+        with recorder.span('parse', spans):
+            pass
+        self.assertEqual([stage for stage, _ in spans], ['parse'])
+        self.assertEqual(recorder.stages['parse'].count, 1)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        cls.client = app.test_client()
+
+    def setUp(self):
+        app.extensions['metrics'] = metrics.Metrics()
+        app.extensions.pop('response_cache', None)
+        app.config['USE_LOOKUP_ENGINE'] = False
+
+    def tearDown(self):
+        app.config['USE_LOOKUP_ENGINE'] = True
+        app.config['SLOW_QUERY_MS'] = None
+
+    def test_stage_timings_and_counts(self):
+        self.client.post('/county_data', json={'zip': '02138', 'measure_name': 'Adult obesity'})
+        self.client.post('/county_data', json={'zip': '00000', 'measure_name': 'Adult obesity'})
+        self.client.post('/county_data', json={'zip': '02138', 'measure_name': 'NonexistentMeasure'})
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        for stage in ('parse', 'validate', 'cache', 'connect', 'query', 'serialize', 'total'):
+            self.assertIn(f'health_api_stage_seconds_count{{stage="{stage}"}}', text)
+        self.assertIn('health_api_requests_total{endpoint="county_data",status="200",'
+                      'measure_name="Adult obesity"} 1', text)
+        self.assertIn('health_api_requests_total{endpoint="county_data",status="404",'
+                      'measure_name="Adult obesity"} 1', text)
+        # Unknown measure names are not used as labels
+        self.assertIn('health_api_requests_total{endpoint="county_data",status="404",measure_name=""} 1', text)
+
+    def test_slow_query_log(self):
+        """Test that requests over the threshold log their stages and query plan"""
+        app.config['SLOW_QUERY_MS'] = 0
+        with self.assertLogs('health_api.slow_queries', level='WARNING') as logs:
+            self.client.post('/county_data', json={'zip': '02138', 'measure_name': 'Unemployment'})
+        message = logs.output[0]
+        self.assertIn('slow POST /county_data', message)
+        self.assertIn('query ', message)
+        self.assertIn('plan: SEARCH z USING', message)
+        self.assertEqual(app_module.get_metrics().slow_requests, 1)
+
+    def test_no_slow_query_log_under_threshold(self):
+        app.config['SLOW_QUERY_MS'] = 60000
+        with self.assertNoLogs('health_api.slow_queries'):
+            self.client.post('/county_data', json={'zip': '02138', 'measure_name': 'Unemployment'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+import unittest
+
+import msgpack_lite
+
+
+class TestMsgpackLite(unittest.TestCase):
+    def test_known_encodings(self):
+        """Test the bytes against the MessagePack specification's smallest encodings"""
+        cases = [
+            (None, b'\xc0'), (True, b'\xc3'), (False, b'\xc2'),
+            (0, b'\x00'), (127, b'\x7f'), (128, b'\xcc\x80'), (256, b'\xcd\x01\x00'),
+            (65536, b'\xce\x00\x01\x00\x00'), (2 ** 32, b'\xcf\x00\x00\x00\x01\x00\x00\x00\x00'),
+            (-1, b'\xff'), (-32, b'\xe0'), (-33, b'\xd0\xdf'), (-129, b'\xd1\xff\x7f'),
+            (1.5, b'\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00'),
+            ('', b'\xa0'), ('abc', b'\xa3abc'), ('x' * 32, b'\xd9\x20' + b'x' * 32),
+            ('x' * 256, b'\xda\x01\x00' + b'x' * 256),
+            ([], b'\x90'), ([1, 2], b'\x92\x01\x02'), (list(range(16)), b'\xdc\x00\x10' + bytes(range(16))),
+            ({}, b'\x80'), ({'b': 1, 'a': None}, b'\x82\xa1a\xc0\xa1b\x01')
+        ]
+        for value, expected in cases:
+            self.assertEqual(msgpack_lite.packb(value), expected, value)
+
+    def test_round_trip(self):
+        value = {
+            'records': [{'county': 'Middlesex County', 'raw_value': '0.25', 'numerator': None,
+                         'population_coverage': 0.9987, 'counties': 2}] * 3,
+            'unicode': 'Doña Ana County',
+            'long': 'y' * 70000,
+            'big': list(range(70000)),
+            'ints': [-2 ** 63, 2 ** 64 - 1, -40000, 40000]
+        }
+        self.assertEqual(msgpack_lite.unpackb(msgpack_lite.packb(value)), value)
+
+    def test_unsupported(self):
+        with self.assertRaises(TypeError):
+            msgpack_lite.packb({'value': object()})
+        with self.assertRaises(OverflowError):
+            msgpack_lite.packb(2 ** 64)
+        with self.assertRaises(ValueError):
+            msgpack_lite.unpackb(b'\xc0\xc0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+import csv
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import prepare_db
+import synthetic_data
+
+ZIP_CSV = '../zip_county.csv'
+
+
+class TestPrepareDatabases(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.health_csv = os.path.join(cls.tmp_dir, 'county_health_rankings.csv')
+        cls.db_path = os.path.join(cls.tmp_dir, 'health_data.db')
+        synthetic_data.write_health_rankings_csv(cls.health_csv, ZIP_CSV)
+        prepare_db.prepare_databases(cls.db_path, cls.health_csv, ZIP_CSV)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def query(self, sql):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def test_row_counts(self):
+        """Test that every CSV row is loaded exactly once"""
+        for table, csv_file in (('health_rankings', self.health_csv), ('zip_county', ZIP_CSV)):
+            with open(csv_file, encoding='utf-8-sig', newline='') as f:
+                expected = sum(1 for _ in csv.reader(f)) - 1
+            self.assertEqual(self.query(f"SELECT COUNT(*) FROM {table}")[0][0], expected, table)
+
+    def test_fips_join_key(self):
+        rows = self.query("SELECT county_code, fips FROM zip_county WHERE zip IN ('02138', '35203') ORDER BY zip")
+        self.assertEqual(rows, [('25017', 25017), ('1073', 1073)])
+        rows = self.query("SELECT DISTINCT fips FROM health_rankings WHERE State_code = '25' AND County_code = '17'")
+        self.assertEqual(rows, [(25017,)])
+
+    def test_values_stay_text(self):
+        """Test that CSV values are stored as text, as the API output expects"""
+        rows = self.query("SELECT typeof(zip), typeof(county_code) FROM zip_county LIMIT 1")
+        self.assertEqual(rows, [('text', 'text')])
+
+    def test_indexes_and_metadata(self):
+        indexes = {row[0] for row in self.query("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertTrue({'idx_zip_fips', 'idx_fips_measure'} <= indexes)
+        self.assertFalse(set(prepare_db.RETIRED_INDEXES) & indexes)
+        self.assertGreater(self.query("SELECT COUNT(*) FROM zip_measure_weighted")[0][0], 0)
+        self.assertEqual(len(self.query("SELECT value FROM build_metadata WHERE key = 'db_version'")), 1)
+
+    def test_record_json(self):
+        """Test that every joinable row is stored pre-serialized with its API field names"""
+        self.assertEqual(self.query("SELECT COUNT(*) FROM record_json"),
+                         self.query("SELECT COUNT(*) FROM health_rankings WHERE fips IS NOT NULL"))
+        fragment = self.query("""
+        SELECT r.json FROM record_json r JOIN health_rankings h ON h.rowid = r.rowid
+        WHERE h.State_code = '25' AND h.County_code = '17' AND h.Measure_name = 'Adult obesity'
+        """)[0][0]
+        record = json.loads(fragment)
+        self.assertEqual(record['fipscode'], '2517')
+        self.assertEqual(record['county'], 'Middlesex County')
+        self.assertEqual(list(record), sorted(record))
+
+    def test_weighted_aggregates(self):
+        """Test that multi-county ZIPs get one estimate weighted by population share"""
+        shares = self.query("SELECT fips, CAST(zip_pop_in_county AS REAL) FROM zip_county WHERE zip = '00601'")
+        expected = {}
+        for column in ('Raw_value', 'Confidence_Interval_Lower_Bound', 'Confidence_Interval_Upper_Bound'):
+            weighted = sum(share * self.query(
+                f"SELECT CAST({column} AS REAL) FROM health_rankings "
+                f"WHERE fips = {fips} AND Measure_name = 'Adult obesity'")[0][0] for fips, share in shares)
+            expected[column] = weighted / sum(share for _, share in shares)
+
+        rows = self.query("""
+        SELECT Raw_value, Confidence_Interval_Lower_Bound, Confidence_Interval_Upper_Bound, counties, population_coverage
+        FROM zip_measure_weighted WHERE zip = '00601' AND Measure_name = 'Adult obesity'
+        """)
+        self.assertEqual(len(rows), 1)
+        for actual, column in zip(rows[0], expected):
+            self.assertAlmostEqual(actual, expected[column], places=9)
+        self.assertEqual(rows[0][3:], (2, 1.0))
+
+    def test_weighted_single_county(self):
+        rows = self.query("""
+        SELECT w.Raw_value, CAST(h.Raw_value AS REAL), w.counties
+        FROM zip_measure_weighted w
+        JOIN zip_county z ON z.zip = w.zip
+        JOIN health_rankings h ON h.fips = z.fips AND h.Measure_name = w.Measure_name
+        WHERE w.zip = '02138' AND w.Measure_name = 'Unemployment'
+        """)
+        self.assertEqual(rows, [(rows[0][1], rows[0][1], 1)])
+
+    def test_weighted_estimates(self):
+        """Test the equal-weight fallback and that counties without a value are left out"""
+        values = {
+            1001: [('Uninsured', '2023', '85', '2021', 10.0, 9.0, 11.0)],
+            1003: [('Uninsured', '2023', '85', '2021', 20.0, None, 22.0)],
+            1005: [('Uninsured', '2023', '85', '2021', None, None, None)]
+        }
+        rows = list(prepare_db.weighted_estimates('36000', [(1001, 0.0), (1003, 0.0)], values))
+        self.assertEqual(rows, [('36000', 'Uninsured', '2023', '85', '2021', 15.0, 9.0, 16.5, 2, 1.0)])
+
+        rows = list(prepare_db.weighted_estimates('36000', [(1001, 0.25), (1003, 0.25), (1005, 0.5)], values))
+        self.assertEqual(rows, [('36000', 'Uninsured', '2023', '85', '2021', 15.0, 9.0, 16.5, 2, 0.5)])
+
+    def test_failed_build_keeps_old_database(self):
+        """Test that a failed rebuild leaves the existing database and no temp files behind"""
+        before = self.query("SELECT value FROM build_metadata WHERE key = 'db_version'")
+        with self.assertRaises(FileNotFoundError):
+            prepare_db.prepare_databases(self.db_path, os.path.join(self.tmp_dir, 'missing.csv'), ZIP_CSV)
+        self.assertEqual(self.query("SELECT value FROM build_metadata WHERE key = 'db_version'"), before)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['county_health_rankings.csv', 'health_data.db'])
+
+
+class TestIncrementalRefresh(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.health_csv = os.path.join(self.tmp_dir, 'county_health_rankings.csv')
+        self.zip_csv = os.path.join(self.tmp_dir, 'zip_county.csv')
+        self.db_path = os.path.join(self.tmp_dir, 'health_data.db')
+        shutil.copyfile(ZIP_CSV, self.zip_csv)
+        synthetic_data.write_health_rankings_csv(self.health_csv, ZIP_CSV, years=(2022,))
+        prepare_db.prepare_databases(self.db_path, self.health_csv, self.zip_csv)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def table_rows(self, db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            return {table: sorted(conn.execute(f"SELECT * FROM {table}").fetchall(), key=repr)
+                    for table in ('health_rankings', 'zip_county', 'zip_measure_weighted', 'record_json',
+                                  'zip_locator')}
+        finally:
+            conn.close()
+
+    def db_version(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute("SELECT value FROM build_metadata WHERE key = 'db_version'").fetchone()[0]
+        finally:
+            conn.close()
+
+    def assert_matches_full_build(self):
+        full_path = os.path.join(self.tmp_dir, 'full.db')
+        prepare_db.prepare_databases(full_path, self.health_csv, self.zip_csv)
+        self.assertEqual(self.table_rows(self.db_path), self.table_rows(full_path))
+
+    def test_unchanged_inputs(self):
+        """Test that a rerun with no changes is skipped entirely"""
+        version = self.db_version()
+        self.assertEqual(prepare_db.refresh_databases(self.db_path, self.health_csv, self.zip_csv), {})
+        self.assertEqual(self.db_version(), version)
+
+    def test_touched_but_identical(self):
+        """Test that a new mtime with the same content is detected by hash"""
+        version = self.db_version()
+        os.utime(self.zip_csv, ns=(0, 0))
+        self.assertEqual(prepare_db.refresh_databases(self.db_path, self.health_csv, self.zip_csv), {})
+        self.assertEqual(self.db_version(), version)
+        self.assertEqual(prepare_db.read_source_files(self.db_path)['zip_county'][2], 0)
+
+    def test_drops_retired_indexes(self):
+        """Test that a refresh of a database from an older build drops indexes no statement uses"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE INDEX idx_measure ON health_rankings(Measure_name)")
+        conn.close()
+        os.utime(self.zip_csv, ns=(0, 0))
+        prepare_db.refresh_databases(self.db_path, self.health_csv, self.zip_csv)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        finally:
+            conn.close()
+        self.assertFalse(set(prepare_db.RETIRED_INDEXES) & indexes)
+
+    def test_new_release_year(self):
+        """Test that adding a release only inserts that year's rows"""
+        with open(self.health_csv, newline='') as f:
+            before = sum(1 for _ in f) - 1
+        synthetic_data.write_health_rankings_csv(self.health_csv, ZIP_CSV, years=(2022, 2023))
+        version = self.db_version()
+        summary = prepare_db.refresh_databases(self.db_path, self.health_csv, self.zip_csv)
+        self.assertEqual(list(summary), ['health_rankings'])
+        self.assertEqual(summary['health_rankings'], (before, 0))
+        self.assertNotEqual(self.db_version(), version)
+        self.assert_matches_full_build()
+
+    def test_crosswalk_correction(self):
+        """Test that changed and removed crosswalk rows are applied"""
+        with open(self.zip_csv, encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.reader(f))
+        del rows[2]
+        rows[3][rows[0].index('default_city')] = 'Corrected City'
+        with open(self.zip_csv, 'w', newline='') as f:
+            csv.writer(f).writerows(rows)
+
+        summary = prepare_db.refresh_databases(self.db_path, self.health_csv, self.zip_csv)
+        self.assertEqual(summary, {'zip_county': (1, 2)})
+        self.assert_matches_full_build()
+
+    def test_changed_columns_rebuild(self):
+        """Test that a CSV whose columns changed falls back to a full build"""
+        with open(self.zip_csv, encoding='utf-8-sig', newline='') as f:
+            rows = [row + ['extra'] for row in csv.reader(f)]
+        with open(self.zip_csv, 'w', newline='') as f:
+            csv.writer(f).writerows(rows)
+        self.assertIsNone(prepare_db.refresh_databases(self.db_path, self.health_csv, self.zip_csv))
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self.assertIn('extra', [row[1] for row in conn.execute("PRAGMA table_info(zip_county)")])
+        finally:
+            conn.close()
+
+    def test_corrupt_input_fails(self):
+        """Test that an undecodable CSV fails the refresh instead of falling back to a full build"""
+        version = self.db_version()
+        with open(self.zip_csv, 'ab') as f:
+            f.write(b'\xff\xfe,not,utf-8\n')
+        with self.assertRaises(UnicodeDecodeError):
+            prepare_db.refresh_databases(self.db_path, self.health_csv, self.zip_csv)
+        self.assertEqual(self.db_version(), version)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ['county_health_rankings.csv', 'health_data.db', 'zip_county.csv'])
+
+    def test_null_keys_and_duplicates(self):
+        """Test that rows with a NULL key are left alone and exact duplicates keep their count"""
+        with open(self.health_csv, newline='') as f:
+            rows = list(csv.reader(f))
+        # No state code, so the derived fips key is NULL
+        rows[1][rows[0].index('State_code')] = ''
+        with open(self.health_csv, 'w', newline='') as f:
+            csv.writer(f).writerows(rows)
+        prepare_db.prepare_databases(self.db_path, self.health_csv, self.zip_csv)
+
+        rows += [list(rows[1]), list(rows[2]), list(rows[2])]
+        rows[3][rows[0].index('Raw_value')] = '12.5'
+        with open(self.health_csv, 'w', newline='') as f:
+            csv.writer(f).writerows(rows)
+        summary = prepare_db.refresh_databases(self.db_path, self.health_csv, self.zip_csv)
+        self.assertEqual(summary, {'health_rankings': (4, 1)})
+        self.assert_matches_full_build()
+
+        del rows[-2:]
+        with open(self.health_csv, 'w', newline='') as f:
+            csv.writer(f).writerows(rows)
+        summary = prepare_db.refresh_databases(self.db_path, self.health_csv, self.zip_csv)
+        self.assertEqual(summary, {'health_rankings': (0, 2)})
+        self.assert_matches_full_build()
+
+if __name__ == '__main__':
+    unittest.main()
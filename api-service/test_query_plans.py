@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import app as app_module
+import lookup
+import prepare_db
+import query_plans
+import synthetic_data
+
+ZIP_CSV = '../zip_county.csv'
+
+
+class TestQueryPlans(unittest.TestCase):
+    """Every statement the API issues must reach health_rankings and zip_county through an index"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        health_csv = os.path.join(cls.tmp_dir, 'county_health_rankings.csv')
+        cls.db_path = os.path.join(cls.tmp_dir, 'health_data.db')
+        synthetic_data.write_health_rankings_csv(health_csv, ZIP_CSV, years=(2021, 2022, 2023))
+        prepare_db.prepare_databases(cls.db_path, health_csv, ZIP_CSV)
+        cls.conn = sqlite3.connect(cls.db_path)
+        cls.report = query_plans.advise(cls.conn)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_no_full_scans(self):
+        for statement in self.report['statements']:
+            self.assertFalse(statement['plan'][0].startswith('unavailable'), statement)
+        self.assertEqual(self.report['full_scans'], [])
+        self.assertEqual(self.report['unindexed'], [])
+
+    def test_every_query_is_planned(self):
+        """Test that a new query constant cannot skip the plan checks"""
+        planned = {sql for _, sql, _ in query_plans.request_statements() + query_plans.load_statements()}
+        for module in (app_module, lookup):
+            for name in dir(module):
+                if name.endswith('_QUERY'):
+                    self.assertIn(getattr(module, name), planned, f"{module.__name__}.{name}")
+
+    def test_declared_indexes_are_used(self):
+        unused = {name for name, _ in self.report['unused_indexes']}
+        self.assertFalse({'idx_zip_fips', 'idx_fips_measure', 'idx_state_measure', 'idx_fips_zip',
+                          'idx_record_json'} & unused)
+        self.assertEqual(unused, set())
+
+    def test_detects_scans(self):
+        """Test that a join on a computed expression is reported as a full scan"""
+        sql = """
+        SELECT h.* FROM zip_county AS z
+        JOIN health_rankings h ON h.State_code || h.County_code = z.county_code
+        WHERE z.zip = ?
+        """
+        checked = query_plans.check_plan(sql, query_plans.explain(self.conn, sql, ('02138',)),
+                                         {'health_rankings', 'zip_county'})
+        self.assertIn('health_rankings', checked['scans'] + checked['automatic'])
+        self.assertNotIn('zip_county', checked['scans'])
+
+    def test_table_aliases(self):
+        aliases = query_plans.table_aliases(app_module.COUNTY_DATA_QUERY)
+        self.assertEqual(aliases, {'zip_county': 'zip_county', 'z': 'zip_county',
+                                   'health_rankings': 'health_rankings', 'h': 'health_rankings',
+                                   'l': 'health_rankings'})
+        self.assertEqual(query_plans.table_aliases("SELECT * FROM zip_county WHERE fips = ?"),
+                         {'zip_county': 'zip_county'})
+
+    def test_report_output(self):
+        stream = io.StringIO()
+        query_plans.print_report(self.report, stream)
+        output = stream.getvalue()
+        self.assertIn('Full scans of health_rankings/zip_county: none', output)
+        self.assertIn('Unused indexes: none', output)
+        self.assertIn('SEARCH z USING COVERING INDEX idx_zip_fips', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import requests
+
+from app import app
+from bench_load import free_port
+from bench_workers import child_pids
+
+PAYLOADS = [
+    {'zip': '02138', 'measure_name': 'Adult obesity'},
+    {'zip': '39401', 'measure_name': 'Unemployment'},
+    {'zip': '00000', 'measure_name': 'Adult obesity'},
+    {'zip': '0213', 'measure_name': 'Adult obesity'}
+]
+
+
+class TestServeWorkers(unittest.TestCase):
+    """serve_workers.py against health_data.db, with the snapshot exported into a temporary directory"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        if not os.path.exists('health_data.db'):
+            subprocess.run(['python3', 'prepare_db.py'], check=True)
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.snapshot_path = os.path.join(cls.tmp_dir, 'health_data.snap')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def start(self, source, workers=2):
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, 'serve_workers.py', '--workers', str(workers), '--port', str(port),
+             '--source', source, '--snapshot', self.snapshot_path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self.addCleanup(self.stop, process)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            self.assertIsNone(process.poll(), "serve_workers.py exited")
+            if len(child_pids(process.pid)) == workers:
+                try:
+                    requests.get(f'http://127.0.0.1:{port}/health', timeout=1)
+                    return process, f'http://127.0.0.1:{port}'
+                except requests.ConnectionError:
+                    pass
+            time.sleep(0.1)
+        self.fail("serve_workers.py did not start")
+
+    def stop(self, process):
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+            process.wait(10)
+
+    def test_same_responses_as_flask(self):
+        client = app.test_client()
+        for source in ('snapshot', 'sqlite'):
+            process, base_url = self.start(source)
+            for payload in PAYLOADS:
+                expected = client.post('/county_data', json=payload)
+                actual = requests.post(f'{base_url}/county_data', json=payload, timeout=10)
+                self.assertEqual(actual.status_code, expected.status_code, (source, payload))
+                self.assertEqual(actual.json(), expected.get_json(), (source, payload))
+            self.stop(process)
+
+    def test_workers_share_snapshot(self):
+        """Test that every worker maps the snapshot the parent exported, and that SIGTERM stops them all"""
+        process, _ = self.start('snapshot', workers=3)
+        workers = child_pids(process.pid)
+        self.assertEqual(len(workers), 3)
+        for pid in workers:
+            with open(f'/proc/{pid}/maps') as f:
+                self.assertIn(self.snapshot_path, f.read())
+
+        process.send_signal(signal.SIGTERM)
+        self.assertEqual(process.wait(10), 0)
+        for pid in workers:
+            self.assertFalse(os.path.exists(f'/proc/{pid}'), pid)
+
+    def test_crashed_worker_is_replaced(self):
+        process, base_url = self.start('snapshot')
+        # Let the workers outlive the startup grace period, so a crash counts as a crash
+        time.sleep(1.2)
+        crashed = child_pids(process.pid)[0]
+        os.kill(crashed, signal.SIGKILL)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            workers = child_pids(process.pid)
+            if len(workers) == 2 and crashed not in workers:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(workers), 2)
+        self.assertNotIn(crashed, workers)
+        response = requests.post(f'{base_url}/county_data', json=PAYLOADS[0], timeout=10)
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import unittest
+
+import app as app_module
+import lookup
+import prepare_db
+import snapshot
+import synthetic_data
+from app import app
+
+ZIP_CSV = '../zip_county.csv'
+
+
+class TestSnapshot(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        cls.client = app.test_client()
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.health_csv = os.path.join(cls.tmp_dir, 'county_health_rankings.csv')
+        cls.db_path = os.path.join(cls.tmp_dir, 'health_data.db')
+        cls.snapshot_path = os.path.join(cls.tmp_dir, 'health_data.snap')
+        synthetic_data.write_health_rankings_csv(cls.health_csv, ZIP_CSV)
+        prepare_db.prepare_databases(cls.db_path, cls.health_csv, ZIP_CSV)
+        snapshot.export_snapshot(cls.db_path, cls.snapshot_path)
+        cls.engine = lookup.LookupEngine.from_database(cls.db_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.config['DATABASE_PATH'] = app_module.DATABASE_PATH
+        app.config['SNAPSHOT_PATH'] = None
+        shutil.rmtree(cls.tmp_dir)
+
+    def setUp(self):
+        app.extensions.pop('response_cache', None)
+
+    def test_matches_lookup_engine(self):
+        """Test that the snapshot returns exactly what the SQLite-backed engine does"""
+        mapped = snapshot.Snapshot(self.snapshot_path)
+        try:
+            for zip_code in ('02138', '35203', '00601', '99999', 'abcde'):
+                for measure_name in synthetic_data.MEASURES + ['Unknown measure']:
+                    self.assertEqual(mapped.lookup_dicts(zip_code, measure_name),
+                                     self.engine.lookup_dicts(zip_code, measure_name),
+                                     (zip_code, measure_name))
+            self.assertEqual(mapped.version, snapshot.database_version(self.db_path))
+        finally:
+            mapped.close()
+
+    def test_app_serves_from_snapshot(self):
+        app.config['DATABASE_PATH'] = os.path.join(self.tmp_dir, 'missing.db')
+        app.config['SNAPSHOT_PATH'] = self.snapshot_path
+        try:
+            response = self.client.post('/county_data', json={'zip': '02138', 'measure_name': 'Adult obesity'})
+        finally:
+            app.config['DATABASE_PATH'] = app_module.DATABASE_PATH
+            app.config['SNAPSHOT_PATH'] = None
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), self.engine.lookup_dicts('02138', 'Adult obesity'))
+
+    def test_remap_after_export(self):
+        """Test that a re-exported snapshot is picked up without a restart"""
+        path = os.path.join(self.tmp_dir, 'remap.snap')
+        snapshot.export_snapshot(self.db_path, path)
+        first = snapshot.get_snapshot(path)
+        self.assertIs(snapshot.get_snapshot(path), first)
+        os.utime(path, ns=(0, 0))
+        self.assertIsNot(snapshot.get_snapshot(path), first)
+
+    def test_read_version(self):
+        self.assertEqual(snapshot.read_version(self.snapshot_path), snapshot.database_version(self.db_path))
+        self.assertIsNone(snapshot.read_version(os.path.join(self.tmp_dir, 'missing.snap')))
+
+    def test_rejects_other_files(self):
+        with self.assertRaises(ValueError):
+            snapshot.Snapshot(self.health_csv)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Time csv_to_sqlite.py's serial and parallel parsers on the same input.
+
+The CSV's rows are repeated --copies times into a temporary file to
+simulate a large extract. Each run loads it in bulk mode with a different
+number of parser processes, checks that the database is byte-identical to
+the serial load, and prints rows/sec and the speedup over the serial run:
+
+    python3 bench_csv_to_sqlite.py county_health_rankings.csv --copies 20 --workers 2 4 8
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import csv_to_sqlite
+
+
+def write_copies(csv_file, path, copies):
+    """Write csv_file's header once and its rows copies times"""
+    with open(csv_file, 'rb') as f:
+        header = f.readline()
+        body = f.read()
+    if body and not body.endswith(b'\n'):
+        body += b'\n'
+    with open(path, 'wb') as f:
+        f.write(header)
+        for _ in range(copies):
+            f.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serial and parallel CSV parsing")
+    parser.add_argument('csv_file')
+    parser.add_argument('--copies', type=int, default=10, help="times to repeat the CSV's rows")
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8],
+                        help="parser process counts to compare against the serial load")
+    parser.add_argument('--infer-types', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'input.csv')
+        write_copies(args.csv_file, csv_path, args.copies)
+        print(f"{os.path.getsize(csv_path) / 1e6:.1f} MB, {os.cpu_count()} CPUs")
+
+        serial = None
+        for workers in [1] + args.workers:
+            db_path = os.path.join(tmp_dir, f'workers_{workers}.db')
+            start = time.perf_counter()
+            rows = csv_to_sqlite.create_table_and_insert_data(db_path, csv_path, bulk=True,
+                                                              infer_types=args.infer_types, workers=workers)
+            elapsed = time.perf_counter() - start
+            with open(db_path, 'rb') as f:
+                data = f.read()
+            os.remove(db_path)
+            if serial is None:
+                serial = (elapsed, data)
+            identical = 'identical' if data == serial[1] else 'DIFFERENT'
+            print(f"workers {workers:>2}: {rows} rows in {elapsed:7.2f}s ({rows / elapsed:>10,.0f} rows/sec)  "
+                  f"speedup {serial[0] / elapsed:5.2f}x  {identical}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,60 +3,539 @@
 # Entirelty written by claude 3.5 sonnet using Windsurf
 
 
+import argparse
+import bz2
+import collections
+import concurrent.futures
 import csv
+import gzip
+import io
+import itertools
+import json
+import lzma
+import mmap
+import re
 import sqlite3
 import sys
 import os
+import time
+
+# Bulk mode settings
+DEFAULT_CHUNK_SIZE = 50000
+# Approximate bytes of CSV each parallel worker parses at a time
+RANGE_SIZE = 8 << 20
+# Seconds between progress reports
+PROGRESS_INTERVAL = 1.0
+# Rejected rows listed in a validation report; the rest are only counted
+MAX_REJECT_SAMPLES = 100
+TYPE_SAMPLE_SIZE = 1000
+BULK_PRAGMAS = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",  # 256 MiB
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA locking_mode = EXCLUSIVE"
+]
+
+# ASCII numerals only; leading zeros mark identifiers like ZIP codes, which must stay TEXT
+INTEGER_PATTERN = re.compile(r'[+-]?(?:0|[1-9][0-9]*)')
+REAL_PATTERN = re.compile(r'[+-]?(?:(?:0|[1-9][0-9]*)(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][+-]?[0-9]+)?')
+# Text SQLite's INTEGER and REAL affinity would silently turn into a number, leading zeros and all
+NUMERIC_TEXT_PATTERN = re.compile(r'\s*[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?\s*', re.ASCII)
+
+def is_integer(value):
+    return INTEGER_PATTERN.fullmatch(value) is not None
+
+def is_real(value):
+    return REAL_PATTERN.fullmatch(value) is not None
+
+def infer_column_types(headers, sample_rows):
+    """Infer an INTEGER, REAL or TEXT type for each column from sample rows.
+
+    Empty values are ignored; a column with no other values stays TEXT.
+    """
+    types = []
+    for i in range(len(headers)):
+        values = [row[i] for row in sample_rows if i < len(row) and row[i] != '']
+        if values and all(is_integer(v) for v in values):
+            types.append('INTEGER')
+        elif values and all(is_real(v) for v in values):
+            types.append('REAL')
+        else:
+            types.append('TEXT')
+    return types
+
+# Whether a non-empty value fits a column type
+TYPE_CHECKS = {
+    'INTEGER': is_integer,
+    'REAL': lambda value: is_integer(value) or is_real(value),
+    'TEXT': lambda value: True
+}
+
+def quote_identifier(name):
+    """Quote a CSV header for use as an SQL identifier"""
+    return '"' + name.replace('"', '""') + '"'
+
+class LoadReport:
+    """Validation report for one load: row counts, per-column null rates and rejected rows"""
+
+    def __init__(self, csv_file, headers, types, strict=False, reject_rows=True):
+        self.csv_file = csv_file
+        self.headers = headers
+        self.types = types
+        self.strict = strict
+        # Without a report to list them in, a row that would be rejected fails the load instead
+        self.reject_rows = reject_rows or strict
+        self.rows_read = 0
+        self.rows_rejected = 0
+        self.rejected = []
+        self.nulls = [0] * len(headers)
+        self.mismatches = [0] * len(headers)
+        self._checks = [(i, TYPE_CHECKS[col_type]) for i, col_type in enumerate(types) if col_type != 'TEXT']
+
+    def check(self, rows):
+        """Yield the rows that can be inserted, counting empty values and type mismatches.
+
+        Rows with the wrong number of fields are rejected. In a strict load,
+        so are rows with a value that does not fit its column's type.
+        Otherwise a mismatched value is stored as text and only counted,
+        unless SQLite would convert it to a number: a ZIP code such as
+        07001 that turns up after the type sample in an INTEGER column
+        would lose its leading zero, so that row is rejected too.
+        """
+        expected = len(self.headers)
+        for row in rows:
+            self.rows_read += 1
+            if len(row) != expected:
+                self.reject(row, f"expected {expected} fields, found {len(row)}")
+                continue
+            for i, value in enumerate(row):
+                if value == '':
+                    self.nulls[i] += 1
+            reason = None
+            converted = False
+            for i, check in self._checks:
+                value = row[i]
+                if value != '' and not check(value):
+                    self.mismatches[i] += 1
+                    if reason is None:
+                        reason = f"{self.headers[i]}: {value!r} is not {self.types[i]}"
+                    converted = converted or NUMERIC_TEXT_PATTERN.fullmatch(value) is not None
+            if reason and (self.strict or converted):
+                self.reject(row, reason)
+                continue
+            yield row
+
+    def reject(self, row, reason, row_number=None):
+        """Count a rejected row; row_number defaults to the row being checked"""
+        row_number = row_number or self.rows_read
+        if not self.reject_rows:
+            raise ValueError(f"row {row_number}: {reason}")
+        self.rows_rejected += 1
+        if len(self.rejected) < MAX_REJECT_SAMPLES:
+            self.rejected.append({'row': row_number, 'reason': reason, 'values': row})
+
+    def to_dict(self, rows_inserted):
+        checked = self.rows_read - self.rows_rejected
+        return {
+            'csv_file': self.csv_file,
+            'table': 'data',
+            'strict': self.strict,
+            'rows_read': self.rows_read,
+            'rows_inserted': rows_inserted,
+            'rows_rejected': self.rows_rejected,
+            'columns': [
+                {
+                    'name': name,
+                    'type': col_type,
+                    'nulls': nulls,
+                    'null_rate': round(nulls / checked, 6) if checked else None,
+                    'type_mismatches': mismatches
+                }
+                for name, col_type, nulls, mismatches in zip(self.headers, self.types, self.nulls, self.mismatches)
+            ],
+            'rejected_rows': self.rejected
+        }
+
+    def write(self, path, rows_inserted):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(rows_inserted), f, indent=2)
+
+def null_empty_values(row, typed):
+    """Store empty values in typed columns as NULL rather than ''"""
+    for i in typed:
+        if i < len(row) and row[i] == '':
+            row[i] = None
+    return row
+
+def insert_rows(conn, insert_sql, rows, chunk_size, validation=None, commit=False):
+    """Insert rows chunk_size at a time; return the number inserted.
+
+    With a validation report, a row SQLite refuses (a value a STRICT column
+    cannot store) is rejected on its own and the rest of its chunk goes in.
+    commit=True commits after every chunk.
+    """
+    cursor = conn.cursor()
+    inserted = 0
+    while True:
+        # validation.rows_read is the number of the row check() just yielded
+        chunk = [(validation.rows_read if validation else None, row) for row in itertools.islice(rows, chunk_size)]
+        if not chunk:
+            return inserted
+        while chunk:
+            before = conn.total_changes
+            try:
+                cursor.executemany(insert_sql, (row for _, row in chunk))
+            except sqlite3.IntegrityError as e:
+                if validation is None:
+                    raise
+                # Every row before the refused one was inserted
+                done = conn.total_changes - before
+                row_number, row = chunk[done]
+                validation.reject(row, str(e), row_number)
+                inserted += done
+                chunk = chunk[done + 1:]
+            else:
+                inserted += len(chunk)
+                chunk = None
+        if commit:
+            conn.commit()
+
+class CountingReader(io.RawIOBase):
+    """Binary stream wrapper that counts the bytes read through it"""
+
+    def __init__(self, raw, close_raw=True):
+        self._raw = raw
+        self._close_raw = close_raw
+        self.bytes = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self._raw.readinto(buffer)
+        if n:
+            self.bytes += n
+        return n
+
+    def close(self):
+        if self._close_raw:
+            self._raw.close()
+        super().close()
+
+class ClosingReader(io.RawIOBase):
+    """Binary stream reading from a decompressor, which on close also closes its input.
+
+    GzipFile(fileobj=...), BZ2File and LZMAFile leave a stream they were
+    given open when they are closed.
+    """
+
+    def __init__(self, stream, source):
+        self._stream = stream
+        self._source = source
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._stream.readinto(buffer)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._stream.close()
+            finally:
+                self._source.close()
+        super().close()
+
+def decompressed(buffered):
+    """Wrap a peekable binary stream in a decompressor chosen by its magic bytes.
+
+    Closing the returned stream closes buffered too.
+    """
+    magic = buffered.peek(6)[:6]
+    if magic.startswith(b'\x1f\x8b'):
+        stream = gzip.GzipFile(fileobj=buffered)
+    elif magic.startswith(b'BZh'):
+        stream = bz2.BZ2File(buffered)
+    elif magic.startswith(b'\xfd7zXZ\x00'):
+        stream = lzma.LZMAFile(buffered)
+    elif magic.startswith(b'\x28\xb5\x2f\xfd'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("reading zstd-compressed input needs the zstandard package") from None
+        stream = zstandard.ZstdDecompressor().stream_reader(buffered)
+    else:
+        return buffered
+    return io.BufferedReader(ClosingReader(stream, buffered))
+
+def open_csv(csv_file):
+    """Open csv_file, or stdin for '-', as text for csv.reader.
+
+    gzip, bz2, xz and (with the zstandard package) zstd input is recognized
+    by its magic bytes and decompressed as it is read, never to disk. Text
+    is decoded exactly as open(csv_file, 'r') would. Returns the text
+    stream and the CountingReader counting the bytes read from the input.
+    """
+    if csv_file == '-':
+        counter = CountingReader(sys.stdin.buffer, close_raw=False)
+    else:
+        counter = CountingReader(open(csv_file, 'rb'))
+    buffered = io.BufferedReader(counter)
+    try:
+        return io.TextIOWrapper(decompressed(buffered)), counter
+    except BaseException:
+        buffered.close()
+        raise
+
+def is_plain_file(csv_file):
+    """Whether csv_file is an uncompressed file that can be split into byte ranges"""
+    if csv_file == '-':
+        return False
+    with io.BufferedReader(open(csv_file, 'rb')) as f:
+        stream = decompressed(f)
+        stream.close()
+        return stream is f
+
+class Progress:
+    """Report rows and input bytes read, with rates, to stderr at most once per interval"""
+
+    def __init__(self, counter, total_bytes=None, interval=PROGRESS_INTERVAL, stream=None):
+        self.counter = counter
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.start = self.last = time.perf_counter()
+        self.rows = 0
+
+    def count(self, rows):
+        """Yield rows, reporting progress as they pass through"""
+        for row in rows:
+            self.rows += 1
+            if not self.rows & 1023 and time.perf_counter() - self.last >= self.interval:
+                self.report()
+            yield row
+
+    def report(self, end='\r'):
+        now = time.perf_counter()
+        self.last = now
+        elapsed = max(now - self.start, 1e-9)
+        read = self.counter.bytes
+        done = f" ({read / self.total_bytes:.0%})" if self.total_bytes else ''
+        print(f"{self.rows:,} rows, {read / 1e6:,.1f} MB read{done}  "
+              f"{self.rows / elapsed:,.0f} rows/sec, {read / 1e6 / elapsed:,.1f} MB/sec",
+              end=end, file=self.stream, flush=True)
+
+    def finish(self):
+        self.report(end='\n')
+
+def record_boundary(data, pos, quoted=False):
+    """Return the offset just past the first record-ending newline at or after pos.
+
+    quoted says whether pos is inside a quoted field. Quotes are assumed to
+    follow RFC 4180, so a newline ends a record only when an even number of
+    quotes precede it; escaped quotes ("") do not change the parity.
+    """
+    while True:
+        newline = data.find(b'\n', pos)
+        if newline < 0:
+            return len(data)
+        quoted ^= data[pos:newline].count(b'"') & 1
+        pos = newline + 1
+        if not quoted:
+            return pos
+
+def record_ranges(csv_file, range_size=None):
+    """Split the rows after the header into (start, end) byte ranges of whole records"""
+    range_size = range_size or RANGE_SIZE
+    with open(csv_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            ranges = []
+            start = record_boundary(data, 0)
+            while start < len(data):
+                target = min(start + range_size, len(data))
+                end = record_boundary(data, target, data[start:target].count(b'"') & 1)
+                ranges.append((start, end))
+                start = end
+            return ranges
+
+def parse_range(csv_file, start, end):
+    """Parse the rows in one byte range, decoded exactly as open(csv_file, 'r') would"""
+    with open(csv_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return list(csv.reader(io.TextIOWrapper(io.BytesIO(data))))
+
+def parallel_rows(csv_file, workers, range_size=None, counter=None):
+    """Yield the rows after the header, parsed by a process pool but in file order.
+
+    At most two ranges per worker are parsed ahead of the consumer, so
+    memory stays bounded however large the file is. counter.bytes, if
+    given, is advanced to the end of each range as its rows are consumed.
+    """
+    ranges = iter(record_ranges(csv_file, range_size))
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = collections.deque((end, pool.submit(parse_range, csv_file, start, end))
+                                    for start, end in itertools.islice(ranges, workers * 2))
+        while pending:
+            end, future = pending.popleft()
+            rows = future.result()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append((next_range[1], pool.submit(parse_range, csv_file, *next_range)))
+            yield from rows
+            if counter is not None:
+                counter.bytes = end
+
+def create_table_and_insert_data(db_name, csv_file, bulk=False, chunk_size=DEFAULT_CHUNK_SIZE,
+                                 index_columns=(), infer_types=False, workers=1, progress=False,
+                                 strict=False, report=None):
+    """Load csv_file into a table named data; return the number of rows inserted.
+
+    csv_file may be gzip, bz2, xz or zstd compressed, or '-' for stdin; rows
+    stream through without the decompressed file being written anywhere.
+    bulk=True applies load-time pragmas and commits every chunk_size rows.
+    index_columns are indexed after the load. infer_types=True declares
+    INTEGER/REAL/TEXT column types from a sample of the rows. workers > 1
+    parses an uncompressed file in that many processes; rows are still
+    inserted in file order, so the database is identical to a serial load.
+    progress=True reports rows and bytes per second to stderr.
+
+    strict=True infers types and creates a STRICT table; rows whose values
+    do not fit their column's type are rejected. Without it, mismatched
+    values are stored as text, except numerals SQLite would convert (such
+    as a leading-zero code in an INTEGER column), whose rows are rejected.
+    report names a file to write a JSON validation report to: row counts,
+    null rates and type mismatches per column, and the rejected rows. Rows
+    with the wrong number of fields, and rejected rows when types are
+    inferred, are listed in the report if one is given and fail the load
+    otherwise.
+    """
+    if strict:
+        if sqlite3.sqlite_version_info < (3, 37, 0):
+            raise ValueError(f"STRICT tables need SQLite 3.37 or later, not {sqlite3.sqlite_version}")
+        infer_types = True
+    if workers > 1 and not is_plain_file(csv_file):
+        raise ValueError("parallel parsing needs an uncompressed file, not stdin or compressed input")
 
-def create_table_and_insert_data(db_name, csv_file):
     # Read the first row of CSV to get column names
-    with open(csv_file, 'r') as f:
+    f, counter = open_csv(csv_file)
+    with f:
         csv_reader = csv.reader(f)
         headers = next(csv_reader)  # Get the header row
-        
+        if headers and headers[0].startswith('\ufeff'):
+            # A UTF-8 BOM is not part of the first column's name
+            headers[0] = headers[0][1:]
+
         # Connect to SQLite database
         conn = sqlite3.connect(db_name)
         cursor = conn.cursor()
-        
+
+        if bulk:
+            for pragma in BULK_PRAGMAS:
+                cursor.execute(pragma)
+
         # Drop existing table if it exists
         cursor.execute("DROP TABLE IF EXISTS data")
-        
-        # Create table using headers as column names
-        # Using headers directly as they are guaranteed to be valid SQL names
-        create_table_sql = f"CREATE TABLE data ({','.join(headers)})"
+
+        rows = parallel_rows(csv_file, workers, counter=counter) if workers > 1 else csv_reader
+        reporter = None
+        if progress:
+            reporter = Progress(counter, os.path.getsize(csv_file) if csv_file != '-' else None)
+            rows = reporter.count(rows)
+        quoted = [quote_identifier(name) for name in headers]
+        columns = quoted
+        types = ['TEXT'] * len(headers)
+        if infer_types:
+            sample = list(itertools.islice(rows, TYPE_SAMPLE_SIZE))
+            types = infer_column_types(headers, sample)
+            columns = [f"{name} {col_type}" for name, col_type in zip(quoted, types)]
+            rows = itertools.chain(sample, rows)
+
+        validation = None
+        if strict or report or infer_types:
+            validation = LoadReport(csv_file, headers, types, strict, reject_rows=bool(report))
+            rows = validation.check(rows)
+        if infer_types:
+            typed = [i for i, col_type in enumerate(types) if col_type != 'TEXT']
+            rows = (null_empty_values(row, typed) for row in rows)
+
+        # Create table using the quoted headers as column names
+        create_table_sql = f"CREATE TABLE data ({','.join(columns)}){' STRICT' if strict else ''}"
         cursor.execute(create_table_sql)
-        
+
         # Create the INSERT statement
         placeholders = ','.join(['?' for _ in headers])
-        insert_sql = f"INSERT INTO data ({','.join(headers)}) VALUES ({placeholders})"
-        
-        # Insert all rows
-        cursor.executemany(insert_sql, csv_reader)
-        
+        insert_sql = f"INSERT INTO data ({','.join(quoted)}) VALUES ({placeholders})"
+
+        # Bulk loads commit every chunk; otherwise everything goes in one transaction
+        row_count = insert_rows(conn, insert_sql, rows, chunk_size, validation, commit=bulk)
+
+        # Index once the data is in, which is faster than maintaining indexes row by row
+        for column in index_columns:
+            cursor.execute(f"CREATE INDEX {quote_identifier(f'idx_data_{column}')} ON data ({quote_identifier(column)})")
+
         # Commit changes and close connection
         conn.commit()
         conn.close()
+        if reporter:
+            reporter.finish()
+        if report:
+            validation.write(report, row_count)
+        return row_count
 
 def main():
-    # Check command line arguments
-    if len(sys.argv) != 3:
-        print("Usage: python3 csv_to_sqlite.py <database_name> <csv_file>")
-        sys.exit(1)
-        
-    db_name = sys.argv[1]
-    csv_file = sys.argv[2]
-    
+    parser = argparse.ArgumentParser(description="Convert a CSV file to a SQLite database")
+    parser.add_argument('db_name', metavar='database_name')
+    parser.add_argument('csv_file', help="CSV file, optionally gzip/bz2/xz/zstd compressed, or - for stdin")
+    parser.add_argument('--bulk', action='store_true',
+                        help="fast load: relaxed durability pragmas and chunked transactions")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="rows per transaction in bulk mode")
+    parser.add_argument('--index', action='append', default=[], metavar='COLUMN',
+                        help="column to index after the load (repeatable)")
+    parser.add_argument('--infer-types', action='store_true',
+                        help="declare INTEGER/REAL column types inferred from a sample")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes parsing the CSV in parallel (default 1, parse serially)")
+    parser.add_argument('--progress', action='store_true',
+                        help="report rows and bytes per second to stderr while loading")
+    parser.add_argument('--strict', action='store_true',
+                        help="infer types, create a STRICT table and reject rows that do not fit it")
+    parser.add_argument('--report', metavar='PATH',
+                        help="write a JSON validation report: row counts, null rates, rejected rows")
+    args = parser.parse_args()
+
+    db_name = args.db_name
+    csv_file = args.csv_file
+
     # Check if CSV file exists
-    if not os.path.exists(csv_file):
+    if csv_file != '-' and not os.path.exists(csv_file):
         print(f"Error: CSV file '{csv_file}' not found")
         sys.exit(1)
-    
+
     try:
-        create_table_and_insert_data(db_name, csv_file)
+        start = time.perf_counter()
+        row_count = create_table_and_insert_data(db_name, csv_file, bulk=args.bulk,
+                                                 chunk_size=args.chunk_size,
+                                                 index_columns=args.index,
+                                                 infer_types=args.infer_types,
+                                                 workers=args.workers,
+                                                 progress=args.progress,
+                                                 strict=args.strict,
+                                                 report=args.report)
+        elapsed = time.perf_counter() - start
         print(f"Successfully created {db_name} from {csv_file}")
+        if args.bulk or args.workers > 1:
+            print(f"Loaded {row_count} rows in {elapsed:.2f}s ({row_count / elapsed:,.0f} rows/sec)")
+        if args.report:
+            print(f"Validation report written to {args.report}")
     except Exception as e:
         print(f"Error: {str(e)}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -6,15 +6,26 @@
 import unittest
 import sqlite3
 import csv
+import bz2
+import gzip
+import io
+import json
+import lzma
 import os
 import subprocess
+import tempfile
+
+import csv_to_sqlite
 
 class TestCSVToSQLite(unittest.TestCase):
+    # Extra command line arguments for csv_to_sqlite.py
+    extra_args = []
+    db_files = ['health_rankings.db', 'zip_county.db']
+
     @classmethod
     def setUpClass(cls):
         # Convert both CSV files to SQLite databases
         csv_files = ['county_health_rankings.csv', 'zip_county.csv']
-        cls.db_files = ['health_rankings.db', 'zip_county.db']
         
         for csv_file, db_file in zip(csv_files, cls.db_files):
             # Remove existing database if it exists
@@ -22,7 +33,7 @@ class TestCSVToSQLite(unittest.TestCase):
                 os.remove(db_file)
             
             # Run the conversion script
-            subprocess.run(['python3', 'csv_to_sqlite.py', db_file, csv_file], check=True)
+            subprocess.run(['python3', 'csv_to_sqlite.py'] + cls.extra_args + [db_file, csv_file], check=True)
             
         # Store CSV data for comparison
         cls.csv_data = {}
@@ -109,5 +120,271 @@ class TestCSVToSQLite(unittest.TestCase):
             if os.path.exists(db_file):
                 os.remove(db_file)
 
+class TestCSVToSQLiteBulk(TestCSVToSQLite):
+    """Run the same checks against the bulk loader"""
+    extra_args = ['--bulk', '--chunk-size', '1000']
+    db_files = ['health_rankings_bulk.db', 'zip_county_bulk.db']
+
+class TestCSVToSQLiteParallel(TestCSVToSQLite):
+    """Run the same checks against the parallel parser"""
+    extra_args = ['--bulk', '--chunk-size', '1000', '--workers', '2']
+    db_files = ['health_rankings_parallel.db', 'zip_county_parallel.db']
+
+class TestParallelParsing(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def serial_rows(self, csv_file):
+        with open(csv_file, 'r') as f:
+            return list(csv.reader(f))[1:]
+
+    def test_record_boundaries(self):
+        """Test that ranges of every size split between records, not inside quoted fields"""
+        csv_file = os.path.join(self.tmp_dir.name, 'tricky.csv')
+        with open(csv_file, 'w', encoding='utf-8-sig', newline='') as f:
+            f.write('zip,"note, with comma",city\r\n')
+            f.write('00501,"two\r\nlines",Holtsville\r\n')
+            f.write('02138,"say ""hi""\nthen ""bye""",Cambridge\r\n')
+            f.write('35203,,Bogot\u00e1\r\n')
+            f.write('99999,"""\n""",\u6771\u4eac')
+        expected = self.serial_rows(csv_file)
+        self.assertEqual(len(expected), 4)
+        for range_size in range(1, 80):
+            ranges = csv_to_sqlite.record_ranges(csv_file, range_size)
+            rows = [row for start, end in ranges for row in csv_to_sqlite.parse_range(csv_file, start, end)]
+            self.assertEqual(rows, expected, range_size)
+        self.assertEqual(list(csv_to_sqlite.parallel_rows(csv_file, 2, 16)), expected)
+
+    def test_header_only(self):
+        csv_file = os.path.join(self.tmp_dir.name, 'empty.csv')
+        with open(csv_file, 'w') as f:
+            f.write('zip,city\n')
+        self.assertEqual(list(csv_to_sqlite.parallel_rows(csv_file, 2)), [])
+
+    def test_identical_database(self):
+        """Test that a parallel load writes the same database file, byte for byte, as a serial one"""
+        databases = []
+        range_size = csv_to_sqlite.RANGE_SIZE
+        csv_to_sqlite.RANGE_SIZE = 1 << 16
+        try:
+            for workers in (1, 3):
+                db_file = os.path.join(self.tmp_dir.name, f'zip_county_{workers}.db')
+                csv_to_sqlite.create_table_and_insert_data(db_file, 'zip_county.csv', bulk=True, chunk_size=1000,
+                                                           infer_types=True, workers=workers)
+                with open(db_file, 'rb') as f:
+                    databases.append(f.read())
+        finally:
+            csv_to_sqlite.RANGE_SIZE = range_size
+        self.assertEqual(databases[0], databases[1])
+
+class TestCompressedInput(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        with open('zip_county.csv', 'rb') as f:
+            self.data = f.read()
+
+    def load(self, csv_file, **kwargs):
+        """Load csv_file into a fresh database; return its bytes"""
+        db_file = os.path.join(self.tmp_dir.name, 'out.db')
+        if os.path.exists(db_file):
+            os.remove(db_file)
+        csv_to_sqlite.create_table_and_insert_data(db_file, csv_file, bulk=True, **kwargs)
+        with open(db_file, 'rb') as f:
+            return f.read()
+
+    def test_compressed_files(self):
+        """Test that gzip, bz2 and xz input loads exactly like the plain file"""
+        expected = self.load('zip_county.csv', infer_types=True)
+        for name, compress in (('gz', gzip.compress), ('bz2', bz2.compress), ('xz', lzma.compress)):
+            # Named without the extension: the format is detected from the content
+            csv_file = os.path.join(self.tmp_dir.name, f'zip_county_{name}')
+            with open(csv_file, 'wb') as f:
+                f.write(compress(self.data))
+            self.assertEqual(self.load(csv_file, infer_types=True), expected, name)
+            with self.assertRaises(ValueError):
+                self.load(csv_file, workers=2)
+
+    def test_input_closed(self):
+        """Test that closing the text stream closes the input file, compressed or not"""
+        for name, compress in (('plain', bytes), ('gz', gzip.compress), ('bz2', bz2.compress), ('xz', lzma.compress)):
+            csv_file = os.path.join(self.tmp_dir.name, f'zip_county_{name}')
+            with open(csv_file, 'wb') as f:
+                f.write(compress(self.data))
+            text, counter = csv_to_sqlite.open_csv(csv_file)
+            raw = counter._raw
+            with text:
+                self.assertEqual(next(csv.reader(text))[0], '\ufeffzip')
+            self.assertTrue(counter.closed, name)
+            self.assertTrue(raw.closed, name)
+            self.assertEqual(csv_to_sqlite.is_plain_file(csv_file), name == 'plain', name)
+
+    def test_stdin(self):
+        """Test that - reads compressed rows from stdin and reports progress"""
+        db_file = os.path.join(self.tmp_dir.name, 'stdin.db')
+        result = subprocess.run(['python3', 'csv_to_sqlite.py', '--progress', db_file, '-'],
+                                input=gzip.compress(self.data), capture_output=True, check=True)
+        self.assertIn(b'rows/sec', result.stderr)
+        self.assertIn(b'MB/sec', result.stderr)
+        conn = sqlite3.connect(db_file)
+        count = conn.execute("SELECT COUNT(*) FROM data").fetchone()[0]
+        conn.close()
+        self.assertEqual(count, self.data.count(b'\n') - 1)
+
+    def test_progress(self):
+        counter = csv_to_sqlite.CountingReader(io.BytesIO(self.data))
+        stream = io.StringIO()
+        progress = csv_to_sqlite.Progress(counter, len(self.data), interval=0, stream=stream)
+        rows = list(progress.count(csv.reader(io.TextIOWrapper(io.BufferedReader(counter)))))
+        progress.finish()
+        self.assertEqual(progress.rows, len(rows))
+        self.assertTrue(stream.getvalue().endswith('\n'))
+        self.assertIn(f'{len(rows):,} rows', stream.getvalue())
+        self.assertIn('(100%)', stream.getvalue())
+
+class TestValidation(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.csv_file = os.path.join(self.tmp_dir.name, 'messy.csv')
+        self.db_file = os.path.join(self.tmp_dir.name, 'messy.db')
+        self.report = os.path.join(self.tmp_dir.name, 'report.json')
+        with open(self.csv_file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['zip', 'zip pop', 'say "share"', 'select'])
+            writer.writerow(['00501', '', '0.5', 'a'])
+            writer.writerow(['02138', '38077', '1', 'b'])
+            writer.writerow(['35203', 'unknown', '0.25', 'c'])
+            writer.writerow(['35204', '12'])
+            writer.writerow(['35205', '7', '', 'd'])
+
+    def load(self, **kwargs):
+        sample_size = csv_to_sqlite.TYPE_SAMPLE_SIZE
+        csv_to_sqlite.TYPE_SAMPLE_SIZE = 2
+        try:
+            inserted = csv_to_sqlite.create_table_and_insert_data(self.db_file, self.csv_file,
+                                                                  report=self.report, **kwargs)
+        finally:
+            csv_to_sqlite.TYPE_SAMPLE_SIZE = sample_size
+        with open(self.report) as f:
+            report = json.load(f)
+        conn = sqlite3.connect(self.db_file)
+        rows = conn.execute("SELECT * FROM data").fetchall()
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'data'").fetchone()[0]
+        conn.close()
+        return inserted, report, rows, sql
+
+    def test_strict(self):
+        """Test that a strict load rejects rows that do not fit the inferred types"""
+        inserted, report, rows, sql = self.load(strict=True)
+        self.assertTrue(sql.endswith('STRICT'))
+        self.assertIn('"say ""share""" REAL', sql)
+        self.assertEqual(rows, [('00501', None, 0.5, 'a'), ('02138', 38077, 1.0, 'b'), ('35205', 7, None, 'd')])
+        self.assertEqual((report['rows_read'], report['rows_inserted'], report['rows_rejected']), (5, 3, 2))
+        self.assertEqual(inserted, 3)
+        self.assertEqual([(r['row'], r['reason']) for r in report['rejected_rows']],
+                         [(3, "zip pop: 'unknown' is not INTEGER"), (4, 'expected 4 fields, found 2')])
+        columns = {column['name']: column for column in report['columns']}
+        self.assertEqual(columns['zip']['type'], 'TEXT')
+        self.assertEqual(columns['zip pop']['null_rate'], round(1 / 3, 6))
+        self.assertEqual(columns['zip pop']['type_mismatches'], 1)
+
+    def test_report_without_strict(self):
+        """Test that without STRICT, mismatched non-numeric values are stored as text and only counted"""
+        inserted, report, rows, sql = self.load(infer_types=True)
+        self.assertFalse(sql.endswith('STRICT'))
+        self.assertIn(('35203', 'unknown', 0.25, 'c'), rows)
+        self.assertEqual((report['rows_read'], report['rows_inserted'], report['rows_rejected']), (5, 4, 1))
+        self.assertEqual(report['columns'][1]['type_mismatches'], 1)
+
+    def write_rows(self, rows):
+        with open(self.csv_file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['zip', 'zip pop', 'share'])
+            writer.writerows(rows)
+
+    def test_leading_zero_after_sample(self):
+        """Test that a code like 07001 past the type sample is rejected, not stored as 7001"""
+        self.write_rows([['02138', '38077', '0.5'], ['35203', '3301', '1'],
+                         ['07001', '07001', '0.25'], ['35204', '12', '007']])
+        for strict in (False, True):
+            inserted, report, rows, _ = self.load(infer_types=True, strict=strict)
+            self.assertEqual(rows, [('02138', 38077, 0.5), ('35203', 3301, 1.0)], strict)
+            self.assertEqual([(r['row'], r['reason']) for r in report['rejected_rows']],
+                             [(3, "zip pop: '07001' is not INTEGER"), (4, "share: '007' is not REAL")])
+            self.assertEqual([column['type_mismatches'] for column in report['columns']], [0, 1, 1])
+        # With no report to list the row in, the load fails
+        self.addCleanup(setattr, csv_to_sqlite, 'TYPE_SAMPLE_SIZE', csv_to_sqlite.TYPE_SAMPLE_SIZE)
+        csv_to_sqlite.TYPE_SAMPLE_SIZE = 2
+        with self.assertRaisesRegex(ValueError, "row 3: zip pop: '07001' is not INTEGER"):
+            csv_to_sqlite.create_table_and_insert_data(self.db_file, self.csv_file, infer_types=True)
+
+    def test_non_ascii_numerals(self):
+        """Test that only ASCII numerals count as numbers, and SQLite's refusals reject one row"""
+        self.assertFalse(csv_to_sqlite.is_integer('3\u00b2'))
+        self.assertFalse(csv_to_sqlite.is_integer('\u0661\u0662'))
+        self.assertFalse(csv_to_sqlite.is_real('1_000'))
+        self.assertTrue(csv_to_sqlite.is_real('-1.5e+3'))
+        self.write_rows([['02138', '38077', '0.5'], ['35203', '3301', '1'], ['35204', '3\u00b2', '1_000'],
+                         ['35205', '99999999999999999999', '2'], ['35206', '7', '3']])
+        inserted, report, rows, _ = self.load(strict=True)
+        self.assertEqual(inserted, 3)
+        self.assertEqual(rows, [('02138', 38077, 0.5), ('35203', 3301, 1.0), ('35206', 7, 3.0)])
+        self.assertEqual([(r['row'], r['reason']) for r in report['rejected_rows']],
+                         [(3, "zip pop: '3\u00b2' is not INTEGER"),
+                          (4, 'cannot store REAL value in INTEGER column data.zip pop')])
+        self.assertEqual((report['rows_read'], report['rows_inserted'], report['rows_rejected']), (5, 3, 2))
+        # Without STRICT, text SQLite leaves alone is stored as it is
+        _, _, rows, _ = self.load(infer_types=True)
+        self.assertIn(('35204', '3\u00b2', '1_000'), rows)
+
+    def test_column_names_quoted(self):
+        """Test that headers which are not plain SQL names become columns unchanged"""
+        _, _, _, sql = self.load()
+        conn = sqlite3.connect(self.db_file)
+        columns = [d[0] for d in conn.execute("SELECT * FROM data LIMIT 0").description]
+        conn.close()
+        self.assertEqual(columns, ['zip', 'zip pop', 'say "share"', 'select'])
+
+class TestBulkLoaderOptions(unittest.TestCase):
+    def test_infer_column_types(self):
+        headers = ['zip', 'county_code', 'zip_pop', 'share', 'name', 'empty']
+        rows = [
+            ['00501', '36103', '', '0', 'Holtsville', ''],
+            ['02138', '25017', '38077', '0.99744898', 'Cambridge', ''],
+            ['35203', '1073', '3301', '1', 'Birmingham', '']
+        ]
+        self.assertEqual(csv_to_sqlite.infer_column_types(headers, rows),
+                         ['TEXT', 'INTEGER', 'INTEGER', 'REAL', 'TEXT', 'TEXT'])
+
+    def test_index_built(self):
+        """Test that --index columns are indexed after the load"""
+        db_file = 'zip_county_indexed.db'
+        try:
+            subprocess.run(['python3', 'csv_to_sqlite.py', '--bulk', '--index', 'zip', db_file, 'zip_county.csv'],
+                           check=True)
+            conn = sqlite3.connect(db_file)
+            indexes = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+            conn.close()
+            self.assertIn('idx_data_zip', indexes)
+        finally:
+            if os.path.exists(db_file):
+                os.remove(db_file)
+
+    def test_typed_load(self):
+        """Test that --infer-types stores numbers as numbers and keeps ZIP leading zeros"""
+        db_file = 'zip_county_typed.db'
+        try:
+            subprocess.run(['python3', 'csv_to_sqlite.py', '--bulk', '--infer-types', db_file, 'zip_county.csv'],
+                           check=True)
+            conn = sqlite3.connect(db_file)
+            row = conn.execute("SELECT zip, county_code, zip_pop, n_counties FROM data LIMIT 1").fetchone()
+            conn.close()
+            self.assertEqual(row, ('00501', 36103, None, 1))
+        finally:
+            if os.path.exists(db_file):
+                os.remove(db_file)
+
 if __name__ == '__main__':
     unittest.main()